@@ -1,6 +1,12 @@
 from discord.ext import commands
 import discord
 from cogs.utils import checks
+from cogs.utils.channel_pool import ChannelPool
+from cogs.utils.database import Database
+from cogs.utils.deleter import MessageDeleter
+from cogs.utils.prompts import PromptDispatcher
+from cogs.utils.provisioning import ChannelProvisioner
+from cogs.utils.scheduler import Scheduler
 import datetime, re
 import asyncio
 import copy
@@ -11,6 +17,8 @@ import os
 from collections import Counter
 
 import web.wsgi
+from django.conf import settings
+from gaming import identity
 from gaming.models import Log, Channel, Server, DiscordUser, ServerUser
 from gaming.utils import logify_exception_info, logify_dict
 
@@ -49,7 +57,33 @@ handler = logging.FileHandler(filename=log_filename, encoding='utf-8', mode='w')
 log.addHandler(handler)
 help_attrs = dict(hidden=True)
 prefix = ['?']
-bot = commands.Bot(command_prefix=prefix, description=description, pm_help=None, help_attrs=help_attrs)
+
+
+class SquidBot(commands.Bot):
+    async def close(self):
+        # Cogs with writes still queued get to finish them while the loop is running, unloading happens after it is closed
+        for cog in list(self.cogs.values()):
+            flush = getattr(cog, 'flush', None)
+            if flush is not None:
+                try:
+                    await flush()
+                except Exception as e:
+                    log.error('Error flushing {}: {}'.format(type(cog).__name__, e))
+        await super().close()
+
+
+bot = SquidBot(command_prefix=prefix, description=description, pm_help=None, help_attrs=help_attrs)
+bot.scheduler = Scheduler(bot.loop)
+bot.db = Database(bot.loop, pool_size=settings.DATABASE_POOL_SIZE)
+bot.deleter = MessageDeleter(bot)
+bot.prompts = PromptDispatcher(bot)
+bot.provisioner = ChannelProvisioner(bot)
+bot.channel_pool = ChannelPool(
+    bot,
+    min_size=settings.GAME_CHANNEL_POOL_MIN_SIZE,
+    max_size=settings.GAME_CHANNEL_POOL_MAX_SIZE,
+    window=settings.GAME_CHANNEL_POOL_WINDOW,
+)
 
 @bot.event
 async def on_command_error(error, ctx):
@@ -72,6 +106,7 @@ async def on_ready():
     log.info('Logged in as:\nUsername: {0.user.name}\nID: {0.user.id}\nDebug: {1}\n------'.format(bot, str(debug_mode)))
     if not hasattr(bot, 'uptime'):
         bot.uptime = bot_start_time
+    bot.scheduler.start()
     squid_bot_game = discord.Game(name='?help', url=github_url, type=0)
     await bot.change_presence(game=squid_bot_game, status=discord.Status.online, afk=False)
 
@@ -93,15 +128,23 @@ async def on_command(command, ctx):
 
 @bot.event
 async def on_message(message):
-    server = Server.objects.get_or_create(server_id=message.server.id)[0]
-    channel = Channel.objects.get_or_create(channel_id=message.channel.id, server=server)[0]
-    user = DiscordUser.objects.get_or_create(user_id=message.author.id)[0]
-    server_user = ServerUser.objects.get_or_create(user=user, server=server)[0]
+    bot.prompts.dispatch(message)
+    await bot.db.run(get_message_objects, message.server.id, message.channel.id, message.author.id)
     if message.author.bot:
         return
 
     await bot.process_commands(message)
 
+def get_message_objects(server_id, channel_id, user_id):
+    """
+    Make sure the Server, Channel, DiscordUser and ServerUser for a message exist
+    """
+    server = identity.get_server(server_id)
+    channel = identity.get_channel(channel_id, server)
+    user = identity.get_user(user_id)
+    server_user = identity.get_server_user(user, server)
+    return server, channel, user, server_user
+
 @bot.command(pass_context=True, hidden=True)
 @checks.is_owner()
 async def do(ctx, times : int, *, command):
@@ -136,6 +179,10 @@ if __name__ == '__main__':
             print('Failed to load extension {}\n{}: {}'.format(extension, type(e).__name__, e))
 
     bot.run(os.environ['SQUID_BOT_TOKEN'])
+    for extension in list(bot.extensions):
+        # Give cogs a chance to finish any pending writes
+        bot.unload_extension(extension)
+    bot.db.close()
     handlers = log.handlers[:]
     for hdlr in handlers:
         hdlr.close()
@@ -1,12 +1,13 @@
 from discord.ext import commands
-from .utils import checks
+from .utils import checks, formats
 import discord
 import inspect
 
 import datetime
 from collections import Counter
 from django.conf import settings
-from gaming import utils
+from gaming import identity, utils
+from gaming.page_cache import page_cache
 
 
 def get_current_commit():
@@ -118,5 +119,36 @@ class Admin:
         commit_url = member.game.url + '/commit/' + current_commit
         msg = await self.bot.send_message(ctx.message.channel, 'I am currently running on commit `{}`\n\n{}'.format(current_commit, commit_url))
 
+    @commands.command(name='cachestats', hidden=True)
+    @checks.is_owner()
+    async def cache_stats_command(self):
+        """
+        Print the hit rate of the identity maps and the webapp's page cache
+        """
+        entries = []
+        for stat in identity.stats():
+            entries.append((stat['name'], '{0[hit_rate]:.1%} hit rate ({0[hits]} hits, {0[misses]} misses, {0[evictions]} evictions, {0[size]}/{0[max_size]} held)'.format(stat)))
+        stat = page_cache.stats()
+        entries.append((stat['name'], '{0[hit_rate]:.1%} hit rate ({0[hits]} hits, {0[misses]} misses)'.format(stat)))
+        await formats.entry_to_code(self.bot, entries)
+
+    @commands.command(name='dbstats', hidden=True)
+    @checks.is_owner()
+    async def database_stats_command(self):
+        """
+        Print the queue depth and call counts of the database pool
+        """
+        stats = self.bot.db.stats()
+        await formats.entry_to_code(self.bot, sorted(stats.items()))
+
+    @commands.command(name='channelstats', hidden=True)
+    @checks.is_owner()
+    async def channel_stats_command(self):
+        """
+        Print how many requests setting up channels took and how long it took
+        """
+        stats = self.bot.provisioner.stats()
+        await formats.entry_to_code(self.bot, sorted(stats.items()))
+
 def setup(bot):
     bot.add_cog(Admin(bot))
@@ -9,6 +9,7 @@ from .utils import checks
 import web.wsgi
 from django.utils import timezone
 from django.db import models
+from gaming import identity
 from gaming.models import DiscordUser, Server, Channel, ServerUser
 
 class PrivateChannel:
@@ -32,13 +33,13 @@ class PrivateChannel:
         # Does not do anything for a bot user
         if member.bot:
             return False
-        return DiscordUser.objects.get(user_id=member.id)
+        return identity.get_user(member.id, create=False)
 
     def get_server(self, discord_server):
         """
         Get a :class:`gaming.models.Server` object for the discord_server
         """
-        return Server.objects.get(server_id=discord_server.id)
+        return identity.get_server(discord_server.id, create=False)
 
     def get_server_user(self, member, discord_server):
         """
@@ -46,13 +47,16 @@ class PrivateChannel:
         """
         user = self.get_user(member)
         server = self.get_server(discord_server)
-        return ServerUser.objects.get(user=user, server=server)
+        return identity.get_server_user(user, server, create=False)
 
     def get_channel(self, dchannel, user, server):
         """
         Get a :class:`gaming.models.Channel` object for the dchannel, user and server
+
+        The row may already have been made by a channel sync without knowing who it's for, so it is updated to be private
         """
-        return Channel.objects.get(channel_id=dchannel.id, user=user, server=server, private=True)
+        channel, created = Channel.objects.update_or_create(channel_id=dchannel.id, defaults={'user': user, 'server': server, 'name': dchannel.name, 'private': True, 'expire_date': None})
+        return channel
     # End methods
 
     # Events
@@ -86,24 +90,24 @@ class PrivateChannel:
         """
         dserver = ctx.message.server
         duser = ctx.message.author
-        server = self.get_server(dserver)
-        user = self.get_user(duser)
+        server = await self.bot.db.run(self.get_server, dserver)
+        user = await self.bot.db.run(self.get_user, duser)
         if not user:
             return
         try:
-            channel = Channel.objects.get(user=user, server=server, private=True)
+            channel = await self.bot.db.run(Channel.objects.get, user=user, server=server, private=True)
             dchannel = self.bot.get_channel(channel.channel_id)
             if dchannel:
-                await self.bot.say("Looks like you already have a channel {}, which is {}".format(duser.mention, dchannel.mention), delete_after=30)
+                self.bot.deleter.delete(await self.bot.say("Looks like you already have a channel {}, which is {}".format(duser.mention, dchannel.mention)), delay=30)
             else:
-                message = "Channel ID {} was in my Database but is no longer on the Server {}".format(str(channel), str(channel.server))
-                channel.delete()
+                message = "Channel ID {} was in my Database but is no longer on the Server {}".format(str(channel), str(server))
+                await self.bot.db.run(channel.delete)
                 raise Channel.DoesNotExist(message)
         except Channel.DoesNotExist as e:
             everyone = discord.PermissionOverwrite(read_messages=False, send_messages=False, connect=False)
             user_perms = discord.PermissionOverwrite(read_messages=True, send_messages=True, connect=True, speak=True, manage_channels=True)
-            dchannel = await self.bot.create_channel(dserver, user.name.replace(" ", "_"), (dserver.default_role, everyone), (dserver.me, user_perms), (ctx.message.author, user_perms))
-            self.get_channel(dchannel, user, server)
+            dchannel = await self.bot.provisioner.create(dserver, user.name.replace(" ", "_"), [(dserver.default_role, everyone), (dserver.me, user_perms), (ctx.message.author, user_perms)])
+            await self.bot.db.run(self.get_channel, dchannel, user, server)
             formatted_message = """
 Welcome to your private channel!
 You can add and remove people from this and the associated voice channel as you please.
@@ -116,7 +120,7 @@ Please make sure you still follow the rules that apply to the `{0.name}` server
 """.format(server)
             msg = await self.bot.send_message(dchannel, formatted_message)
             await self.bot.pin_message(msg)
-            await self.bot.say("Your channel has been created {}! Please go to {} to learn more.".format(duser.mention, dchannel.mention), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say("Your channel has been created {}! Please go to {} to learn more.".format(duser.mention, dchannel.mention)), delay=30)
     # End Commands
 
     # Errors
@@ -5,14 +5,26 @@ import discord
 from discord.ext import commands
 from discord.ext.commands import Bot
 from .utils import checks
+from .utils.matchmaking import Matchmaker
 
 import web.wsgi
+from django.conf import settings
 from django.db import models
-from django.db.models import Count
+from django.db.models import Case, IntegerField, Sum, Value, When
 from django.db.models.query import QuerySet
 from django.utils import timezone
+from gaming import identity
 from gaming.models import DiscordUser, Game, GameUser, Server, ServerUser, Role, GameSearch, Channel, Task, Log, ChannelUser
-from gaming.utils import logify_exception_info, logify_object, paginate
+from gaming.game_index import game_index
+from gaming.membership import membership
+from gaming.occupancy import channel_occupancy
+from gaming.rankings import game_rankings
+from gaming.utils import logify_exception_info, logify_object, chunks, page_bounds, render_lines, Page
+
+
+GAMES_PER_PAGE = 20
+PLAYERS_PER_PAGE = 50
+SEARCH_UPDATE_CHUNK_SIZE = 500
 
 
 class Gaming:
@@ -21,84 +33,154 @@ class Gaming:
     """
     def __init__(self, bot):
         self.bot = bot
+        self.matchmaker = Matchmaker(
+            party_size=getattr(settings, 'MATCHMAKING_PARTY_SIZE', 5),
+            min_party_size=getattr(settings, 'MATCHMAKING_MIN_PARTY_SIZE', 2),
+        )
+        self.flush_interval = getattr(settings, 'MATCHMAKING_FLUSH_INTERVAL', 1000) / 1000
+        self.search_updates = {}
 
     def __unload(self):
         """Called when the cog is unloaded"""
-        pass
+        self.bot.scheduler.cancel(('matchmaking_flush',))
+        if self.search_updates:
+            self.write_search_updates(self.search_updates)
+            self.search_updates = {}
 
     # Class methods
-    async def game_beautify(self, games, reserve=0, page=0, available=True):
+    def game_beautify(self, games, reserve=0, page=0, available=True, server=None):
         """
-        Return a message of all games ready for displaying all pretty like
+        Return a message of one page of games ready for displaying all pretty like
         """
         formatted_message = '**No games are currently in the database!\nStart playing some games to make the database better**'
         try:
-            if not isinstance(games, dict):
-                tmp_games = Game.objects.filter(pk__in=[g.pk for g in games])
-                games = self.map_games(tmp_games)
+            if not isinstance(games, Page):
+                games = self.map_games(games, server=server, page=page)
             if len(games) == 0:
-                games = self.map_games(Game.objects.all())
+                games = self.map_games(server=server, page=page)
+            if len(games) == 0:
+                raise Exception("No games to show")
 
             formatted_message = ''
             if available:
                 formatted_message += '\n**Available games**\n'
-            for i in games:
-                game = games[i]
-                if game is None:
-                    continue
-                if isinstance(game, GameSearch):
-                    game = Game.objects.get(pk=game.pk)
-                current_searches = self.get_game_searches(game=game)
-                formatted_message += '{0}: `{1.name}` {2} people searching\n'.format(i, game, current_searches.count())
+            footer = '_Page {} of {}_'.format(games.number + 1, games.pages) if games.pages > 1 else ''
+            lines = ('{0}: `{1.name}` {1.searching} people searching'.format(i, game) for i, game in games.items())
+            formatted_message += render_lines(lines, reserve=reserve + len(formatted_message) + len(footer))
+            formatted_message += footer
         except Exception as e:
             pass
-        return paginate(formatted_message, reserve=reserve)[page]
+        return formatted_message
 
-    async def game_user_beautify(self, game, server, user, reserve=0, page=0):
+    def game_user_beautify(self, game, server, user, reserve=0, page=0):
         """
         Return a message of all users who play a specific game ready for displaying all pretty like
         """
         formatted_message = '**It doesn\'t look like anyone has played `{0.name}`, be one of the first by starting to play now!**'.format(game)
         try:
-            user_pks = [s.user.pk for s in ServerUser.objects.filter(server=server)]
-            game_users = GameUser.objects.filter(game=game, user__pk__in=user_pks).exclude(user=user)
-            if game_users.count() >= 1:
-                formatted_message = 'The following people have played `{1.name}`:\n```'.format(game_users.count(), game)
-                for gu in game_users:
-                    u = gu.user
-                    formatted_message += '\n{0}'.format(u.name)
-                formatted_message += '```'
+            players = GameUser.objects.filter(game=game).exclude(user=user).values_list('user_id', flat=True)
+            player_pks = membership.intersect(server, players)
+            if len(player_pks) >= 1:
+                start, stop = page_bounds(page, PLAYERS_PER_PAGE)
+                players = Page(player_pks[start:stop], max(page, 0), PLAYERS_PER_PAGE, len(player_pks))
+                names = dict(DiscordUser.objects.filter(pk__in=players.page_items).values_list('pk', 'name'))
+                formatted_message = 'The following people have played `{0.name}`:\n```\n'.format(game)
+                footer = '```' + ('_Page {} of {}_'.format(players.number + 1, players.pages) if players.pages > 1 else '')
+                lines = (names[user_pk] for user_pk in players.page_items if user_pk in names)
+                formatted_message += render_lines(lines, reserve=reserve + len(formatted_message) + len(footer))
+                formatted_message += footer
         except Exception as e:
             pass
-        return paginate(formatted_message, reserve=reserve)[page]
+        return formatted_message
 
     def get_server(self, server):
         """
         Returns a :class:`gaming.models.Server` object after getting or creating the server
         """
-        return Server.objects.get(server_id=server.id)
+        return identity.get_server(server.id, create=False)
 
     def get_user(self, member):
         """
         Returns a :class:`gaming.models.DiscordUser` object after getting or creating the user
         Does not create users for Bots
         """
-        return DiscordUser.objects.get(user_id=member.id)
+        return identity.get_user(member.id, create=False)
 
     def get_server_user(self, user, server):
-        return ServerUser.objects.get(user=user, server=server)
+        return identity.get_server_user(user, server, create=False)
+
+    def create_game_search(self, user, game, server=None, exclude=()):
+        """
+        Create a GameSearch object for a user if one does not exist or isn't active
 
-    def create_game_search(self, user, game):
-        """ Create a GameSearch object for a user if one does not exist or isn't active """
+        exclude : Optional[list]
+            Primary keys of searches to ignore, for ones that have ended but haven't been written yet
+        """
         created = False
-        game_searches = self.get_game_searches(user=user, game=game)
-        if game_searches.count() >= 1:
-            game_search = game_searches[0]
-        else:
-            game_search = GameSearch.objects.create(user=user, game=game)
+        game_searches = self.get_game_searches(user=user, game=game).exclude(pk__in=exclude)
+        game_search = game_searches.select_related('user', 'game', 'server').first()
+        if game_search is None:
+            game_search = GameSearch.objects.create(user=user, game=game, server=server)
             created = True
         return (game_search, created)
 
+    def load_game_searches(self):
+        """ Returns a list of every active :class:`gaming.models.GameSearch`, oldest first """
+        return list(self.get_game_searches().select_related('user', 'game', 'server'))
+
+    def pending_search_pks(self):
+        """ Returns the primary keys of the GameSearches with changes that haven't been written yet """
+        return [pk for pks in self.search_updates.values() for pk in pks]
+
+    def update_searches(self, searches, field):
+        """
+        Set :attr:`field` to True on :attr:`searches` in the next batch of writes
+
+        The searches no longer need to expire, so their deadlines are cancelled
+        """
+        if not self.search_updates:
+            self.bot.scheduler.schedule(self.flush_interval, ('matchmaking_flush',), self.flush_search_updates)
+        pks = self.search_updates.setdefault(field, set())
+        for search in searches:
+            pks.add(search.pk)
+            self.bot.scheduler.cancel(('game_search', search.pk))
+
+    async def flush_search_updates(self):
+        """ Write every pending GameSearch change """
+        updates, self.search_updates = self.search_updates, {}
+        if updates:
+            await self.bot.db.run(self.write_search_updates, updates)
+
+    def write_search_updates(self, updates):
+        """ Write a dict of field name to GameSearch primary keys with one update per field and chunk """
+        for field, pks in updates.items():
+            for chunk in chunks(list(pks), SEARCH_UPDATE_CHUNK_SIZE):
+                GameSearch.objects.filter(pk__in=chunk).update(**{field: True})
+
+    async def start_group(self, server, game, group):
+        """
+        Make a game channel for a group formed by the :class:`cogs.utils.matchmaking.Matchmaker` and mark their searches as found
+
+        If the channel can't be made the group goes back to the front of its queue, their searches left to expire as usual,
+        and everyone in it is told
+
+        Returns the new :class:`gaming.models.Channel`, or None if it couldn't be made
+        """
+        mchannel = await self.create_game_channel(server, game, searches=group)
+        if mchannel is not None:
+            return mchannel
+        self.matchmaker.requeue(group)
+        for search in group:
+            member = server.get_member(search.user.user_id)
+            if member is None:
+                continue
+            try:
+                await self.bot.send_message(member, "A group was found for `{0.name}` but I couldn't make a channel for it. You're still in the queue.".format(game))
+            except discord.HTTPException:
+                # They don't accept direct messages
+                pass
+        return None
+
     def get_game_searches(self, user=None, game=None, server=None):
         """
         Get :class:`gaming.models.GameSearch` for the specified user and/or game. If none provided, return all
@@ -109,71 +191,219 @@ class Gaming:
         if isinstance(game, Game):
             game_searches = game_searches.filter(game=game)
         if isinstance(server, Server):
-            server_users = ServerUser.objects.filter(server=server)
-            user_ids = [u.user.pk for u in server_users]
-            game_searches = game_searches.filter(user__pk__in=user_ids)
+            game_searches = game_searches.filter(user__in=ServerUser.objects.filter(server=server).values('user'))
         return game_searches.order_by('created_date')
 
-    def order_games(self, games):
-        """ Takes a QuerySet of Game """
-        if isinstance(games, list):
-            games = Game.objects.filter(pk__in=[g.pk for g in games])
-        # Order the games by the number of players who play it
-        return games.annotate(user_count=Count('gameuser')).filter(user_count__gte=3).order_by('-user_count')
-
-    def map_games(self, games):
-        """ Maps games to a number from highest played to lowest played """
-        games = self.order_games(games)
-        game_map = {}
-        for i, game in enumerate(games):
-            game_map[i+1] = game
-        return game_map
-
-    def get_game_channels(game):
-        if not isinstance(game, Game):
-            return False
-        return Channel.objects.annotate(num_users=Count('channeluser')).filter(
-            game=game,
-            private=False,
-            game_channel=True,
-            deleted=False,
-            expire_date__gte=timezone.now(),
-            num_users__lte=4
-        ).order_by('-expire_date', '-num_users')
-
-    async def create_game_channel(self, ctx, game, searches=None):
-        """
-        Creates/Gets a :class:`gaming.models.Channel` for the selected :class:`gaming.models.Game`
-
-        Returns an instance of :class:`gaming.models.Channel`
-        """
-        server = ctx.message.server
-        mserver = Server.objects.get(server_id=server.id)
+    def find_games(self, game_search_key):
+        """ Returns a list of Games matching a primary key or name, best match first, using :mod:`gaming.game_index` """
+        try:
+            return list(Game.objects.filter(pk=int(game_search_key)))
+        except ValueError:
+            pass
+        game_pks = game_index.search(game_search_key)
+        games = Game.objects.in_bulk(game_pks)
+        return [games[pk] for pk in game_pks if pk in games]
+
+    def rank_games(self, games, server=None):
+        """ Takes a QuerySet or list of Game and returns a list of (game_pk, players) ordered by the number of players on the server """
+        if isinstance(games, QuerySet):
+            game_pks = games.values_list('pk', flat=True)
+        else:
+            game_pks = [g.pk for g in games]
+        return game_rankings.rank(game_pks, server=server)
 
-        if searches is None:
-            searches = self.get_game_searches(game=game)[:5]
+    def order_games(self, games, server=None):
+        """ Takes a QuerySet or list of Game and returns a list of them ordered by the number of players on the server """
+        return self.get_ranked_games(self.rank_games(games, server=server))
+
+    def get_ranked_games(self, ranked):
+        """
+        Takes a list of (game_pk, players) from :mod:`gaming.rankings` and returns the Games in one query
+        with user_count and the number of people searching set
+        """
+        searching = When(
+            gamesearch__cancelled=False,
+            gamesearch__game_found=False,
+            gamesearch__expire_date__gte=timezone.now(),
+            then=Value(1),
+        )
+        games = Game.objects.filter(pk__in=[game_pk for game_pk, players in ranked]).annotate(
+            searching=Sum(Case(searching, default=Value(0), output_field=IntegerField()))
+        )
+        games = {game.pk: game for game in games}
+        ordered = []
+        for game_pk, players in ranked:
+            game = games.get(game_pk)
+            if game is not None:
+                game.user_count = players
+                ordered.append(game)
+        return ordered
+
+    def map_games(self, games=None, server=None, page=0):
+        """
+        Returns a :class:`gaming.utils.Page` numbering games from highest played to lowest played,
+        using every ranked game if none are given
+
+        Only the Games on :attr:`page` are fetched
+        """
+        start, stop = page_bounds(page, GAMES_PER_PAGE)
+        if games is None:
+            ranked = game_rankings.page(server=server, start=start, stop=stop)
+            total = game_rankings.count(server=server)
+        else:
+            ranked = self.rank_games(games, server=server)
+            total = len(ranked)
+            ranked = ranked[start:stop]
+        return Page(self.get_ranked_games(ranked), max(page, 0), GAMES_PER_PAGE, total)
+
+    async def match_search(self, server, game, search):
+        """
+        Put a search in a game channel with a free slot, or queue it and start a group if enough players are waiting
 
-        everyone = discord.PermissionOverwrite(read_messages=False, send_messages=False)
+        server : Required[:class:`discord.Server`]
+            The Server the search was made on
+
+        Returns the :class:`gaming.models.Channel` the user was put in, or None if they are waiting for a group
+        """
+        member = server.get_member(search.user.user_id)
+        if member is None:
+            return None
+        while True:
+            channel_pk = await self.bot.db.run(channel_occupancy.find_open, search.server_id, game.pk)
+            if channel_pk is None:
+                break
+            mchannel = await self.join_game_channel(channel_pk, member, search)
+            if mchannel is not None:
+                return mchannel
+        group = self.matchmaker.enqueue(search)
+        if group:
+            return await self.start_group(server, game, group)
+        return None
+
+    async def join_game_channel(self, channel_pk, member, search):
+        """
+        Let a member into an open game channel and mark their search as found
+
+        Returns the :class:`gaming.models.Channel`, or None if the channel is gone
+        """
+        mchannel = await self.bot.db.run(Channel.objects.filter(pk=channel_pk).first)
+        channel = self.bot.get_channel(mchannel.channel_id) if mchannel is not None else None
+        if channel is None:
+            channel_occupancy.discard(channel_pk)
+            return None
+        # Take the slot now so nobody else is given it while the permissions are changed
+        channel_occupancy.add_user(channel_pk, search.user_id)
         user_perms = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+        try:
+            await self.bot.edit_channel_permissions(channel, member, user_perms)
+        except Exception:
+            # They never got in, so give the slot back
+            channel_occupancy.remove_user(channel_pk, search.user_id)
+            raise
+        await self.bot.db.run(ChannelUser.objects.get_or_create, channel=mchannel, user_id=search.user_id)
+        self.update_searches([search], 'game_found')
+        await self.bot.send_message(channel, "{}: You've joined the group for `{}`, have fun!".format(member.mention, search.game.name))
+        return mchannel
 
-        channel = await self.bot.create_channel(server, game.name, (server.default_role, everyone), (server.me, user_perms))
-        mchannel = Channel.objects.create(server=mserver, channel_id=channel.id, name=channel.name, expire_date=(timezone.now() + timedelta(minutes=15)))
+    def sync_channel_users(self, channel_pk, user_ids):
+        """
+        Make the :class:`gaming.models.ChannelUser` rows for a game channel match the members allowed to read it
 
+        user_ids : Required[list]
+            The Discord IDs of every member with access to the channel
+        """
+        channel_users = {channel_user.user.user_id: channel_user for channel_user in ChannelUser.objects.filter(channel_id=channel_pk).select_related('user')}
+        for user_id in user_ids:
+            if user_id not in channel_users:
+                ChannelUser.objects.get_or_create(channel_id=channel_pk, user=identity.get_user(user_id))
+        removed_pks = [channel_user.pk for user_id, channel_user in channel_users.items() if user_id not in user_ids]
+        if removed_pks:
+            ChannelUser.objects.filter(pk__in=removed_pks).delete()
+
+    async def create_game_channel(self, server, game, searches=None):
+        """
+        Gives a group a :class:`gaming.models.Channel` for the selected :class:`gaming.models.Game` from the bot's :class:`cogs.utils.channel_pool.ChannelPool`
+
+        server : Required[:class:`discord.Server`]
+            The Server to create the channel on
+        searches : Optional[list]
+            The :class:`gaming.models.GameSearch` of everyone to let in, with their users already fetched
+
+        Their searches are marked as found once the channel is theirs
+
+        Returns an instance of :class:`gaming.models.Channel`, or None if no channel could be claimed
+        """
+        await self.bot.db.run(self.get_server, server)
+
+        if searches is None:
+            searches = await self.bot.db.run(list, self.get_game_searches(game=game).select_related('user')[:self.matchmaker.party_size])
+
+        members = []
         for search in searches:
-            await self.bot.edit_channel_permissions(channel, channel.server.get_member(search.user.user_id), user_perms)
-            search.game_found = True
-            search.save()
+            member = server.get_member(search.user.user_id)
+            if member is not None:
+                members.append((search, member))
+
+        try:
+            mchannel = await self.bot.channel_pool.claim(server, game, [member for search, member in members], timezone.now() + timedelta(minutes=15))
+        except Exception as e:
+            await self.bot.db.run(Log.objects.create, message="Error creating game channel for {} on {}\n{}\n{}".format(game, server, logify_exception_info(), e))
+            return None
+        self.update_searches(searches, 'game_found')
+        for search, member in members:
+            channel_occupancy.add_user(mchannel.pk, search.user_id)
+        await self.bot.db.run(self.sync_channel_users, mchannel.pk, [member.id for search, member in members])
         time_to_delete = mchannel.expire_date.strftime("%Y-%m-%d %H:%M")
-        msg = await self.bot.send_message(channel, "This channel will be deleted at {} UTC ({} minutes from creation.)".format(time_to_delete, 15))
-        await self.bot.pin_message(msg)
+        await self.bot.send_message(
+            self.bot.get_channel(mchannel.channel_id) or discord.Object(mchannel.channel_id),
+            "{}: You've been grouped up for `{}`, have fun!\nThis channel will be closed at {} UTC ({} minutes from now.)".format(
+                ' '.join(member.mention for search, member in members), game.name, time_to_delete, 15),
+        )
         return mchannel
 
     # Events
     async def on_ready(self):
         """
-        Bot is loaded, do stuff that needs to be done
+        Bot is loaded, fill the channel pool and queue every active search in the :class:`cogs.utils.matchmaking.Matchmaker`
         """
-        pass
+        await self.bot.channel_pool.load()
+        for search in await self.bot.db.run(self.load_game_searches):
+            if search.server is None:
+                # Searches from before they were tied to a server can't be grouped, so they are left to expire
+                continue
+            server = self.bot.get_server(search.server.server_id)
+            if server is not None:
+                await self.match_search(server, search.game, search)
+
+    async def on_channel_update(self, before, after):
+        """
+        Keep the Users of a game channel in line with who has been given access to it
+        """
+        if after.is_private:
+            return
+        channel_pk = await self.bot.db.run(channel_occupancy.get_channel_pk, after.id)
+        if channel_pk is None:
+            return
+        user_ids = [target.id for target, overwrite in after.overwrites if isinstance(target, discord.Member) and target != after.server.me and overwrite.read_messages]
+        await self.bot.db.run(self.sync_channel_users, channel_pk, user_ids)
+
+    async def on_game_search_expire(self, game_search):
+        """
+        A search ran out without finding a group, take it out of its queue and let the user know
+        """
+        self.matchmaker.remove(game_search.pk)
+        member = None
+        if game_search.server is not None:
+            server = self.bot.get_server(game_search.server.server_id)
+            if server is not None:
+                member = server.get_member(game_search.user.user_id)
+        if member is None:
+            return
+        try:
+            await self.bot.send_message(member, "Your search for `{0.name}` has expired without finding a group. Type ?lfg {0.name} to search again.".format(game_search.game))
+        except discord.HTTPException:
+            # They don't accept direct messages
+            pass
 
     async def on_member_join(self, member):
         """
@@ -199,8 +429,7 @@ class Gaming:
     async def list_games(self, ctx, *, game_search_key: str = None, page_number: str = None):
         """Get a list of all the games
         Example: ?games over p2"""
-        server = self.get_server(self.get_server(ctx.message.server))
-        user = self.get_user(self.get_user(ctx.message.author))
+        user = await self.bot.db.run(self.get_user, ctx.message.author)
         if not user or user.bot:
             return
 
@@ -209,29 +438,25 @@ class Gaming:
             if page_number.lower().startswith('p'):
                 page = int(page_number[1::]) - 1
 
+        server = await self.bot.db.run(self.get_server, ctx.message.server)
+        games = None
         if game_search_key:
-            try:
-                game_search_key = int(game_search_key)
-                games = Game.objects.get(pk=game_search_key)
-            except:
-                games = Game.objects.filter(name__icontains=game_search_key)
-        else:
-            games = Game.objects.all()
-        games = self.map_games(games)
-        message_to_send = '{}\n'.format(await self.game_beautify(games, page=page))
-        await self.bot.say(message_to_send, delete_after=30)
-        await self.bot.delete_message(ctx.message)
+            games = await self.bot.db.run(self.find_games, game_search_key)
+        games = await self.bot.db.run(self.map_games, games, server=server, page=page)
+        message_to_send = '{}\n'.format(await self.bot.db.run(self.game_beautify, games, page=page, server=server))
+        self.bot.deleter.delete(await self.bot.say(message_to_send), delay=30)
+        self.bot.deleter.delete(ctx.message)
 
     @checks.is_owner()
     @commands.command(name='lfg', pass_context=True)
     async def looking_for_game(self, ctx, game_search_key: str = None, page_number: str = None):
         """Used when users want to play a game with others
         Example: ?lfg overwatch"""
-        user = self.get_user(ctx.message.author)
-        games = [game for game in Game.objects.all()]
-        server = self.get_server(ctx.message.server)
+        user = await self.bot.db.run(self.get_user, ctx.message.author)
+        games = None
+        server = await self.bot.db.run(self.get_server, ctx.message.server)
 
-        log_item = Log.objects.create(message="Log item for {} on {} searching for {}".format(user, server, game_search_key))
+        log_item = await self.bot.db.run(Log.objects.create, message="Log item for {} on {} searching for {}".format(user, server, game_search_key))
 
         if not user or user.bot:
             return
@@ -241,29 +466,28 @@ class Gaming:
             if page_number.lower().startswith('p'):
                 page = int(page_number[1::]) - 1
 
+        game = None
         game_search = False
         created = False
-        create_search = False
+        game_found = False
+        time_ran_out = False
 
         if game_search_key:
-            current_searches = self.get_game_searches(user=user)
+            current_searches = await self.bot.db.run(list, self.get_game_searches(user=user).select_related('game'))
             current_searches_games = [search.game for search in current_searches]
             games = []
-            try:
-                possible_games = Game.objects.filter(pk=int(game_search_key))
-            except:
-                possible_games = Game.objects.filter(name__icontains=game_search_key)
-            for game in possible_games:
-                if game not in current_searches_games:
-                    if game not in games:
-                        games.append(game)
-        if len(games) == 1:
+            possible_games = await self.bot.db.run(self.find_games, game_search_key)
+            for possible_game in possible_games:
+                if possible_game not in current_searches_games:
+                    if possible_game not in games:
+                        games.append(possible_game)
+        if games is not None and len(games) == 1:
             game = games[0]
         else:
-            games = self.map_games(games)
+            games = await self.bot.db.run(self.map_games, games, server=server, page=page)
             msg = False
             temp_message = '{0.message.author.mention}: Which game did you want to search for?\n_Please only type in the number next to the game_\n_You have 30 seconds to respond_\n'.format(ctx)
-            formatted_games = await self.game_beautify(games, reserve=len(temp_message), page=page)
+            formatted_games = await self.bot.db.run(self.game_beautify, games, reserve=len(temp_message), page=page, server=server)
             final_message = '{}{}'.format(temp_message, formatted_games)
             question_message = await self.bot.say(final_message)
             time_ran_out = False
@@ -273,104 +497,53 @@ class Gaming:
                     return int(msg.content.strip()) in gameIDs
                 except:
                     return False
-            msg = await self.bot.wait_for_message(author=ctx.message.author, check=check, timeout=30)
+            msg = await self.bot.prompts.wait(ctx.message.channel, ctx.message.author, check=check, timeout=30)
             if isinstance(msg, discord.Message):
                 try:
                     content = msg.content.strip()
                     try:
-                        possible_game = Game.objects.filter(pk=games[int(content)].pk)
+                        possible_game = [games[int(content)]]
                     except:
-                        possible_game = Game.objects.filter(name__icontains=content)
-                    if possible_game.count() == 1:
+                        possible_game = (await self.bot.db.run(self.find_games, content))[:2]
+                    if len(possible_game) == 1:
                         game = possible_game[0]
                 except Exception as e:
                     log_item.message += '- Failed\n\n{}'.format(logify_exception_info())
-                await self.bot.delete_message(msg)
+                self.bot.deleter.delete(msg)
             else:
                 time_ran_out = True
-            await self.bot.delete_message(question_message)
+            self.bot.deleter.delete(question_message)
 
         if isinstance(game, Game):
-            """
-            .. todo:: Ask the user if they want to join a currently (non-full) game group
-            or if they want to start their own search
-            Somehow limit the number of people per group to 5 (or some other good number)
-            """
-            current_searches = self.get_game_searches(game=game)
-            current_game_channels = self.get_game_channels(game=game)
-            game_channel = None
-
-            for channel in current_game_channels:
-                c = await self.bot.get_channel(channel.channel_id)
-                if c is None:
-                    channel.deleted = True
-                    channel.save()
-                    continue
-                if channel.num_users > 5:
-                    continue
-                else:
-                    game_channel = channel
-                    break
-
-            if current_searches.count() == 0:
-                create_search = True
-            else:
-                msg = False
-                temp_message = '{0.message.author.mention}: There is a group with less than 5 people for {1.name}, would you like to join them?\n_Please only type in `yes` or `no`_\n_You have 30 seconds to respond_\n'.format(ctx, game)
-                question_message = await self.bot.say(temp_message)
-                time_ran_out = False
-                def yesno_check(msg):
-                    try:
-                        return msg.content.strip().lower() in ['yes', 'no']
-                    except:
-                        return False
-                msg = await self.bot.wait_for_message(author=ctx.message.author, check=yesno_check, timeout=30)
-                if isinstance(msg, discord.Message):
-                    try:
-                        log_item.message += "Response from user about joining existing group: '{}'\n".format(message.content)
-                        content = msg.content.strip().lower()
-                        if content == 'yes':
-                            # Put the user with the group already found
-                            pass
-                        elif content == 'no':
-                            # They said no, so start a new search
-                            create_search = True
-                        else:
-                            raise Exception("Content is not equal to yes/no")
-                    except Exception as e:
-                        log_item.message += '- Failed\n\n{}'.format(logify_exception_info())
-                    await self.bot.delete_message(msg)
-                else:
-                    time_ran_out = True
-                await self.bot.delete_message(question_message)
-
-        if create_search:
-            game_search, created = self.create_game_search(user, game)
-        log_item.message += "game_search: {0}\ncreated: {1}\ngame_found: {2}\ntime_ran_out: {3}\ncreate_search: {4}\n".format(game_search, created, game_found, time_ran_out, create_search)
-        log_item.save()
-
-        if created and game_search:
-            await self.bot.say("{0.message.author.mention}: You've been added to the search queue for `{1.name}`!".format(ctx, game), delete_after=30)
-        elif game_found:
-            await self.bot.say("{0.message.author.mention}: You've been added to the current group `{1.name}`!".format(ctx, game), delete_after=30)
+            game_search, created = await self.bot.db.run(self.create_game_search, user, game, server, self.pending_search_pks())
+            game_channel = await self.match_search(ctx.message.server, game, game_search)
+            if game_channel is not None:
+                game_found = True
+        log_item.message += "game_search: {0}\ncreated: {1}\ngame_found: {2}\ntime_ran_out: {3}\n".format(game_search, created, game_found, time_ran_out)
+        await self.bot.db.run(log_item.save)
+
+        if game_found:
+            self.bot.deleter.delete(await self.bot.say("{0.message.author.mention}: A group has been found for `{1.name}`! Head over to <#{2.channel_id}>".format(ctx, game, game_channel)), delay=30)
+        elif created and game_search:
+            self.bot.deleter.delete(await self.bot.say("{0.message.author.mention}: You've been added to the search queue for `{1.name}`!".format(ctx, game)), delay=30)
         elif game_search:
-            await self.bot.say("{0.message.author.mention}: You're already in the queue for `{1.name}`. If you would like to stop looking for this game, type {0.prefix}lfgstop {1.name}".format(ctx, gaame), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say("{0.message.author.mention}: You're already in the queue for `{1.name}`. If you would like to stop looking for this game, type {0.prefix}lfgstop {1.name}".format(ctx, game)), delay=30)
         elif time_ran_out:
-            await self.bot.say('Whoops... looks like your time ran out `{0.message.author.mention}`. Please re-run the command and try again.'.format(ctx), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say('Whoops... looks like your time ran out `{0.message.author.mention}`. Please re-run the command and try again.'.format(ctx)), delay=30)
         else:
-            await self.bot.say("{0.message.author.mention}: I didn't quite understand your response, please run the command again.".format(ctx), delete_after=30)
-        await self.bot.delete_message(ctx.message)
+            self.bot.deleter.delete(await self.bot.say("{0.message.author.mention}: I didn't quite understand your response, please run the command again.".format(ctx)), delay=30)
+        self.bot.deleter.delete(ctx.message)
 
     @commands.command(name='lfgstop', pass_context=True)
     async def looking_for_game_remove(self, ctx, *, game_search_key: str = None, page_number: str = None):
         """
         Stop searching for a game
         """
-        user = self.get_user(ctx.message.author)
-        server = self.get_server(ctx.message.server)
+        user = await self.bot.db.run(self.get_user, ctx.message.author)
+        server = await self.bot.db.run(self.get_server, ctx.message.server)
         games_removed = []
 
-        log_item = Log.objects.create(message="Log item for {} on {} trying to stop searching for {}".format(user, server, game_search_key))
+        log_item = await self.bot.db.run(Log.objects.create, message="Log item for {} on {} trying to stop searching for {}".format(user, server, game_search_key))
 
         if not user or user.bot:
             return
@@ -385,31 +558,29 @@ class Gaming:
         no_game_searches = False
 
         if game_search_key:
-            games = Game.objects.filter(name__icontains=game_search_key)
+            games = await self.bot.db.run(self.find_games, game_search_key)
         else:
-            game_pks = []
-            for search in self.get_game_searches(user=user):
-                game_pks.append(search.game.pk)
-            games = Game.objects.filter(pk__in=game_pks)
+            games = Game.objects.filter(pk__in=self.get_game_searches(user=user).values('game'))
         game_removed = 'All Games'
-        games = self.order_games(games)
+        games = (await self.bot.db.run(self.order_games, games, server=server))[:2]
 
-        if games.count() == 1:
+        if len(games) == 1:
             game = games[0]
             game_search = self.get_game_searches(user=user, game=game)
-            games_removed = [search.game for search in game_search]
-            game_search.update(cancelled=True)
+            games_removed = [game]
+            await self.bot.db.run(game_search.update, cancelled=True)
+            self.matchmaker.remove_user(user.pk, game.pk)
             game_search_cancelled = True
         else:
-            game_searches = self.get_game_searches(user=user)
+            game_searches = await self.bot.db.run(list, self.get_game_searches(user=user).select_related('game'))
             games = []
             for game in game_searches:
                 if game.game not in games:
                     games.append(game.game)
             if len(games) >= 1:
-                games = self.map_games(games)
+                games = await self.bot.db.run(self.map_games, games, server=server, page=page)
                 temp_message = '{0.message.author.mention}: Which game would you like to stop searching for?\n_Please only type in the number next to the game_\n_You have 30 seconds to respond_\n'.format(ctx)
-                formatted_games = await self.game_beautify(games, page=page)
+                formatted_games = await self.bot.db.run(self.game_beautify, games, page=page, server=server)
                 final_message = '{}{}'.format(temp_message, formatted_games)
                 question_message = await self.bot.say(final_message)
                 gameIDs = games.keys()
@@ -419,48 +590,49 @@ class Gaming:
                     except:
                         return False
                 msg = False
-                msg = await self.bot.wait_for_message(author=ctx.message.author, check=check, timeout=30)
+                msg = await self.bot.prompts.wait(ctx.message.channel, ctx.message.author, check=check, timeout=30)
                 if isinstance(msg, discord.Message):
                     try:
                         content = msg.content.strip()
                         try:
-                            possible_game = Game.objects.filter(pk=games[int(content)].pk)
+                            possible_game = [games[int(content)]]
                         except:
-                            possible_game = Game.objects.filter(name__icontains=game_pk)
-                        if possible_game.count() == 1:
+                            possible_game = (await self.bot.db.run(self.find_games, content))[:2]
+                        if len(possible_game) == 1:
                             game = possible_game[0]
                             game_searches = self.get_game_searches(user=user, game=game)
-                            game_searches.update(cancelled=True)
+                            await self.bot.db.run(game_searches.update, cancelled=True)
+                            self.matchmaker.remove_user(user.pk, game.pk)
                             games_removed = [game]
                             game_search_cancelled = True
                     except Exception as e:
                         log_item.message += '- Failed\n\n{}'.format(logify_exception_info())
-                    await self.bot.delete_message(msg)
-                await self.bot.delete_message(question_message)
+                    self.bot.deleter.delete(msg)
+                self.bot.deleter.delete(question_message)
             else:
                 no_game_searches = True
-        log_item.save()
+        await self.bot.db.run(log_item.save)
 
         if game_search_cancelled:
-            await self.bot.say("{0.message.author.mention}: You've stopped searching for the following game(s):\n{1}".format(ctx, await self.game_beautify(games_removed, available=False)), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say("{0.message.author.mention}: You've stopped searching for the following game(s):\n{1}".format(ctx, await self.bot.db.run(self.game_beautify, games_removed, available=False, server=server))), delay=30)
         elif time_ran_out:
-            await self.bot.say('Whoops... looks like your time ran out {0.message.author.mention}. Please re-run the command and try again.'.format(ctx), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say('Whoops... looks like your time ran out {0.message.author.mention}. Please re-run the command and try again.'.format(ctx)), delay=30)
         elif no_game_searches:
-            await self.bot.say('It doesn\'t look like you\'re currently searching for any games {0.message.author.mention}.\nIf you would like to start, type {0.prefix}lfg'.format(ctx), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say('It doesn\'t look like you\'re currently searching for any games {0.message.author.mention}.\nIf you would like to start, type {0.prefix}lfg'.format(ctx)), delay=30)
         else:
-            await self.bot.say("I didn't quite understand your response {0.message.author.mention}, please run the command again.".format(ctx), delete_after=30)
-        await self.bot.delete_message(ctx.message)
+            self.bot.deleter.delete(await self.bot.say("I didn't quite understand your response {0.message.author.mention}, please run the command again.".format(ctx)), delay=30)
+        self.bot.deleter.delete(ctx.message)
 
     @commands.command(name='whoplays', pass_context=True)
     async def who_plays(self, ctx, *, game_search_key: str = None, page_number: str = None):
         """
         See who has played a certain game in the past
         """
-        user = self.get_user(ctx.message.author)
-        server = self.get_server(ctx.message.server)
-        games = Game.objects.all()
+        user = await self.bot.db.run(self.get_user, ctx.message.author)
+        server = await self.bot.db.run(self.get_server, ctx.message.server)
+        games = None
 
-        log_item = Log.objects.create(message="Log item for {} on {} searching for {}".format(user, server, game_search_key))
+        log_item = await self.bot.db.run(Log.objects.create, message="Log item for {} on {} searching for {}".format(user, server, game_search_key))
 
         if not user or user.bot:
             return
@@ -474,21 +646,14 @@ class Gaming:
                 page = int(page_number[1::]) - 1
 
         if game_search_key:
-            current_searches = self.get_game_searches(user=user, server=server)
-            current_searches_games = [search.game for search in current_searches]
-            try:
-                possible_games = Game.objects.filter(pk=int(game_search_key))
-            except:
-                possible_games = Game.objects.filter(name__icontains=game_search_key)
-            games = possible_games
-        games = self.map_games(games)
-        if len(games) == 1:
-            game = games[1]
-            game_search, created = self.create_game_search(user, game)
+            games = await self.bot.db.run(self.find_games, game_search_key)
+        games = await self.bot.db.run(self.map_games, games, server=server, page=page)
+        if games.total == 1 and len(games) == 1:
+            game = games.page_items[0]
         else:
             msg = False
             temp_message = '{0.message.author.mention}: Which game did you want to search for?\n_Please only type in the number next to the game_\n_You have 30 seconds to respond_\n'.format(ctx)
-            formatted_games = await self.game_beautify(games, reserve=len(temp_message), page=page)
+            formatted_games = await self.bot.db.run(self.game_beautify, games, reserve=len(temp_message), page=page, server=server)
             final_message = '{}{}'.format(temp_message, formatted_games)
             question_message = await self.bot.say(final_message)
             gameIDs = games.keys()
@@ -497,32 +662,32 @@ class Gaming:
                     return int(msg.content.strip()) in gameIDs
                 except:
                     return False
-            msg = await self.bot.wait_for_message(author=ctx.message.author, check=check, timeout=30)
+            msg = await self.bot.prompts.wait(ctx.message.channel, ctx.message.author, check=check, timeout=30)
             if isinstance(msg, discord.Message):
                 try:
                     content = msg.content.strip()
                     try:
-                        possible_game = Game.objects.filter(pk=games[int(content)].pk)
+                        possible_game = [games[int(content)]]
                     except:
-                        possible_game = Game.objects.filter(name__icontains=content)
-                    if possible_game.count() == 1:
+                        possible_game = (await self.bot.db.run(self.find_games, content))[:2]
+                    if len(possible_game) == 1:
                         game = possible_game[0]
                 except Exception as e:
                     log_item.message += '- Failed\n\n{}'.format(logify_exception_info())
-                await self.bot.delete_message(msg)
+                self.bot.deleter.delete(msg)
             else:
                 time_ran_out = True
-            await self.bot.delete_message(question_message)
-        log_item.save()
+            self.bot.deleter.delete(question_message)
+        await self.bot.db.run(log_item.save)
 
         if game:
             temp_message = '{0.message.author.mention}\n'.format(ctx)
-            await self.bot.say('{}{}'.format(temp_message, await self.game_user_beautify(game, server, user, reserve=len(temp_message), page=page)), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say('{}{}'.format(temp_message, await self.bot.db.run(self.game_user_beautify, game, server, user, reserve=len(temp_message), page=page))), delay=30)
         elif time_ran_out:
-            await self.bot.say('Whoops... looks like your time ran out {0.message.author.mention}. Please re-run the command and try again.'.format(ctx), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say('Whoops... looks like your time ran out {0.message.author.mention}. Please re-run the command and try again.'.format(ctx)), delay=30)
         else:
-            await self.bot.say("{0.message.author.mention}: I didn't quite understand your response, please run the command again.".format(ctx), delete_after=30)
-        await self.bot.delete_message(ctx.message)
+            self.bot.deleter.delete(await self.bot.say("{0.message.author.mention}: I didn't quite understand your response, please run the command again.".format(ctx)), delay=30)
+        self.bot.deleter.delete(ctx.message)
 
     @commands.command(name='lfgpurge', pass_context=True, hidden=True)
     @checks.is_owner()
@@ -531,22 +696,23 @@ class Gaming:
         Cancel all current :class:`gaming.models.GameSearch`
         """
         game_searches = self.get_game_searches()
-        question_message = await self.bot.say('\n**Are you sure you want to cancel all active game searches?**\nActive Searches: `{}`.'.format(game_searches.count()))
+        question_message = await self.bot.say('\n**Are you sure you want to cancel all active game searches?**\nActive Searches: `{}`.'.format(await self.bot.db.run(game_searches.count)))
         def check(msg):
             try:
                 return msg.content.strip().lower() == "yes"
             except:
                 return False
         msg = False
-        msg = await self.bot.wait_for_message(author=ctx.message.author, check=check, timeout=15)
+        msg = await self.bot.prompts.wait(ctx.message.channel, ctx.message.author, check=check, timeout=15)
         if isinstance(msg, discord.Message):
-            game_searches.update(cancelled=True)
+            await self.bot.db.run(game_searches.update, cancelled=True)
+            self.matchmaker.clear()
             for server in self.bot.servers:
                 cancelled_message = '**All active Searches have been cancelled by {} at {}**'.format(ctx.message.author.name, timezone.now().strftime("%Y-%m-%d %H:%M"))
                 cmsg = await self.bot.send_message(server.default_channel, cancelled_message)
-            await self.bot.delete_message(msg)
-        await self.bot.delete_message(question_message)
-        await self.bot.delete_message(ctx.message)
+            self.bot.deleter.delete(msg)
+        self.bot.deleter.delete(question_message)
+        self.bot.deleter.delete(ctx.message)
 
     @commands.command(name='halp', pass_context=True, hidden=True)
     @checks.is_owner()
@@ -1,46 +1,196 @@
 import asyncio
 import datetime
 import discord
+from collections import namedtuple
 from discord.ext import commands
 import pytz
 
 from .utils import checks
 
 import web.wsgi
+from django.conf import settings
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
-from gaming.models import DiscordUser, Server, Channel, Log, Message, Attachment
+from gaming import identity
+from gaming.models import DiscordUser, Server, Channel, Log, Message, Attachment, ServerUser
+from gaming.page_cache import page_cache
 from gaming.utils import logify_exception_info, logify_object
 
 
+LoggedMessage = namedtuple('LoggedMessage', 'message_id content server channel user timestamp attachments parent')
+DeletedMessage = namedtuple('DeletedMessage', 'message_id')
+
+
 class MessageLog:
     """
     Logs all the Messages sent by users
+
+    Messages are put on a bounded queue and written in batches by a background worker.
+    The worker flushes every :attr:`batch_size` records or :attr:`flush_interval` seconds, whichever comes first.
+    When the queue is full, handlers wait for the worker to catch up.
+    Records the worker has taken off the queue are kept in :attr:`pending` until their write starts,
+    so :meth:`flush` and :meth:`drain` can write them along with what is still queued.
     """
     def __init__(self, bot):
         self.bot = bot
+        self.batch_size = getattr(settings, 'MESSAGE_LOG_BATCH_SIZE', 100)
+        self.flush_interval = getattr(settings, 'MESSAGE_LOG_FLUSH_INTERVAL', 500) / 1000
+        self.queue = asyncio.Queue(maxsize=getattr(settings, 'MESSAGE_LOG_QUEUE_SIZE', 10000), loop=bot.loop)
+        self.batch_ready = asyncio.Event(loop=bot.loop)
+        self.pending = []
+        self.writing = None
+        self.writer = bot.loop.create_task(self.run_writer())
 
     def __unload(self):
-        pass
+        # Normally :meth:`flush` has already run while the bot was closing, this catches reloads
+        if not self.writer.done():
+            self.writer.cancel()
+        self.drain()
+
+    async def flush(self):
+        """
+        Stop the worker and write everything it hasn't, called by the bot while it closes so the loop is still running
+        """
+        self.writer.cancel()
+        await asyncio.wait([self.writer], loop=self.bot.loop)
+        if self.writing is not None:
+            await asyncio.wait([self.writing], loop=self.bot.loop)
+        await self.bot.db.run(self.drain)
+
+    async def log(self, record):
+        """
+        Queue a record to be written by the worker
+        """
+        await self.queue.put(record)
+        if self.queue.qsize() >= self.batch_size:
+            self.batch_ready.set()
+
+    async def run_writer(self):
+        try:
+            while True:
+                self.pending = [await self.queue.get()]
+                try:
+                    await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval, loop=self.bot.loop)
+                except asyncio.TimeoutError:
+                    pass
+                self.batch_ready.clear()
+                while len(self.pending) < self.batch_size and not self.queue.empty():
+                    self.pending.append(self.queue.get_nowait())
+                if self.queue.qsize() >= self.batch_size:
+                    self.batch_ready.set()
+                batch, self.pending = self.pending, []
+                # Shielded so cancelling the worker leaves a write that has started to finish, see :meth:`flush`
+                self.writing = asyncio.ensure_future(self.bot.db.run(self.write_batch, batch), loop=self.bot.loop)
+                await asyncio.shield(self.writing, loop=self.bot.loop)
+                self.writing = None
+        except asyncio.CancelledError:
+            pass
+
+    def drain(self):
+        """
+        Write the worker's pending records and everything left in the queue. Used when the cog is unloaded.
+        """
+        batch, self.pending = self.pending, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            self.write_batch(batch)
+
+    def write_batch(self, records):
+        """
+        Write a batch of records in a single transaction, keeping the order they were received in
+        """
+        pending = []
+        try:
+            with transaction.atomic():
+                for record in records:
+                    if isinstance(record, DeletedMessage):
+                        self.create_messages(pending)
+                        pending = []
+                        Message.objects.filter(message_id=record.message_id).update(deleted=True)
+                    elif record.parent is not None:
+                        self.create_messages(pending)
+                        pending = []
+                        self.create_edited_message(record)
+                    else:
+                        pending.append(record)
+                self.create_messages(pending)
+        except Exception as e:
+            Log.objects.create(message="Error writing {} logged messages\n{}\n{}".format(len(records), logify_exception_info(), e))
+        # bulk_create doesn't send post_save, so expire the message pages directly
+        server_ids = set(record.server.server_id for record in records if isinstance(record, LoggedMessage))
+        page_cache.bump(*[('messages', server_id) for server_id in server_ids])
+
+    def create_messages(self, records):
+        """
+        Bulk create :class:`gaming.models.Message` and :class:`gaming.models.Attachment` objects for the records
+        """
+        if not records:
+            return
+        message_ids = [record.message_id for record in records]
+        seen = set(Message.objects.filter(message_id__in=message_ids, parent__isnull=True).values_list('message_id', flat=True))
+        new_records = []
+        for record in records:
+            if record.message_id not in seen:
+                seen.add(record.message_id)
+                new_records.append(record)
+        if not new_records:
+            return
+
+        messages = [Message(message_id=r.message_id, content=r.content, server=r.server, user=r.user, channel=r.channel, timestamp=r.timestamp) for r in new_records]
+        Message.objects.bulk_create(messages)
+
+        attachments = []
+        for record in new_records:
+            for a in record.attachments:
+                attachments.append(Attachment(attachment_id=a['id'], url=a['url'], timestamp=record.timestamp, user=record.user, channel=record.channel, server=record.server))
+        if not attachments:
+            return
+        Attachment.objects.bulk_create(attachments)
+
+        message_pks = self.get_primary_keys(Message.objects.filter(parent__isnull=True), 'message_id', messages)
+        attachment_pks = self.get_primary_keys(Attachment.objects.all(), 'attachment_id', attachments)
+        through = Message.attachments.through
+        through.objects.bulk_create([
+            through(message_id=message_pks[record.message_id], attachment_id=attachment_pks[a['id']])
+            for record in new_records for a in record.attachments
+        ])
+
+    def get_primary_keys(self, queryset, field, objects):
+        """
+        Returns a dict of :attr:`field` to primary key for :attr:`objects`
+
+        bulk_create only sets primary keys on PostgreSQL, so look them up when they are missing
+        """
+        if all(obj.pk is not None for obj in objects):
+            return {getattr(obj, field): obj.pk for obj in objects}
+        values = [getattr(obj, field) for obj in objects]
+        lookup = {'{}__in'.format(field): values}
+        return dict(queryset.filter(**lookup).order_by('pk').values_list(field, 'pk'))
+
+    def create_edited_message(self, record):
+        parent = record.parent
+        parent_message = Message.objects.get_or_create(message_id=parent.message_id, content=parent.content, server=parent.server, user=parent.user, channel=parent.channel, timestamp=parent.timestamp)[0]
+        Message.objects.get_or_create(message_id=record.message_id, content=record.content, server=record.server, user=record.user, channel=record.channel, timestamp=record.timestamp, parent=parent_message)
 
     def get_server(self, server):
         """
         Returns a :class:`gaming.models.Server` object after getting or creating the server
         """
-        return Server.objects.get(server_id=server.id)
+        return identity.get_server(server.id)
 
     def get_user(self, member):
         """
         Returns a :class:`gaming.models.DiscordUser` object after getting or creating the user
         """
-        return DiscordUser.objects.get(user_id=member.id)
+        return identity.get_user(member.id)
 
     def get_server_user(self, user, server):
         """
         Returns a :class:`gaming.models.ServerUser` object
         """
-        return ServerUser.objects.get(user=user, server=server)
+        return identity.get_server_user(user, server, create=False)
 
     def get_channel(self, channel):
         """
@@ -49,24 +199,24 @@ class MessageLog:
         if channel.is_private:
             return False
         else:
-            return Channel.objects.get(channel_id=channel.id, server=self.get_server(channel.server))
+            return identity.get_channel(channel.id, self.get_server(channel.server))
+
+    def get_message_objects(self, message):
+        """
+        Returns the :class:`gaming.models.DiscordUser`, :class:`gaming.models.Server` and :class:`gaming.models.Channel` for a message
+        """
+        return self.get_user(message.author), self.get_server(message.server), self.get_channel(message.channel)
 
     async def on_message(self, message):
         """
         Logs the message sent
         """
-        user = self.get_user(message.author)
-        server = self.get_server(message.server)
-        channel = self.get_channel(message.channel)
+        user, server, channel = await self.bot.db.run(self.get_message_objects, message)
 
         if user and server and channel:
             timestamp = pytz.utc.localize(message.timestamp)
-            m, created = Message.objects.get_or_create(message_id=message.id, content=message.content, server=server, user=user, channel=channel, timestamp=timestamp)
-            if len(message.attachments) >= 1:
-                for a in message.attachments:
-                    attachment = Attachment.objects.get_or_create(attachment_id=a['id'], url=a['url'], timestamp=timestamp, user=user, channel=channel, server=server)[0]
-                    m.attachments.add(attachment)
-            m.save()
+            attachments = [{'id': a['id'], 'url': a['url']} for a in message.attachments]
+            await self.log(LoggedMessage(message.id, message.content, server, channel, user, timestamp, attachments, None))
 
     async def on_message_edit(self, before, after):
         """
@@ -77,26 +227,21 @@ class MessageLog:
             # So this is here to prevent two messages of the same exact info
             return
         message = after
-        user = self.get_user(message.author)
-        server = self.get_server(message.server)
-        channel = self.get_channel(message.channel)
+        user, server, channel = await self.bot.db.run(self.get_message_objects, message)
 
         if user and server and channel:
             timestamp = pytz.utc.localize(message.timestamp)
-            parent = Message.objects.get_or_create(message_id=before.id, content=before.content, server=server, user=user, channel=channel, timestamp=timestamp)[0]
-            Message.objects.get_or_create(message_id=message.id, content=message.content, server=server, user=user, channel=channel, timestamp=timestamp, parent=parent)
+            parent = LoggedMessage(before.id, before.content, server, channel, user, timestamp, [], None)
+            await self.log(LoggedMessage(message.id, message.content, server, channel, user, timestamp, [], parent))
 
     async def on_message_delete(self, message):
         """
         Mark a message as deleted
         """
-        user = self.get_user(message.author)
-        server = self.get_server(message.server)
-        channel = self.get_channel(message.channel)
+        user, server, channel = await self.bot.db.run(self.get_message_objects, message)
 
         if user and server and channel:
-            m = Message.objects.filter(message_id=message.id)
-            m.update(deleted=True)
+            await self.log(DeletedMessage(message.id))
 
 
 def setup(bot):
@@ -12,8 +12,12 @@ from django.db import models
 from django.db.models import Count
 from django.db.models.query import QuerySet
 from django.utils import timezone
+from gaming import identity
 from gaming.models import DiscordUser, Server, ServerUser, Quote, Log
-from gaming.utils import logify_exception_info, logify_object, paginate
+from gaming.utils import logify_exception_info, logify_object, page_bounds, render_lines, Page
+
+
+QUOTES_PER_PAGE = 5
 
 
 class Quotes:
@@ -32,14 +36,14 @@ class Quotes:
         """
         Returns a :class:`gaming.models.Server` object after getting or creating the server
         """
-        return Server.objects.get(server_id=server.id)
+        return identity.get_server(server.id, create=False)
 
     def get_user(self, member):
         """
         Returns a :class:`gaming.models.DiscordUser` object after getting or creating the user
         Does not create users for Bots
         """
-        return DiscordUser.objects.get(user_id=member.id)
+        return identity.get_user(member.id, create=False)
 
     def get_server_user(self, member, discord_server):
         """
@@ -47,7 +51,7 @@ class Quotes:
         """
         user = self.get_user(member)
         server = self.get_server(discord_server)
-        ServerUser.objects.get(user=user, server=server)
+        return identity.get_server_user(user, server, create=False)
 
     def beautify_quote(self, quote, requester=None, multiple=False):
         """
@@ -69,22 +73,27 @@ class Quotes:
 
     def beautify_quotes(self, quotes, reserve=0, page=0, requester=None):
         """
-        Return a "pretty" form of multiple quotes
+        Return a "pretty" form of one page of quotes
         """
         formatted_message = '**No quotes were found!\n Type `?help quote` to find out how to create a Quote**'
         try:
             if not isinstance(quotes, QuerySet):
                 raise Exception("Quotes passed are not of type QuerySet. It is {}".format(type(quotes)))
-            if quotes.count() == 0:
+            total = quotes.count()
+            if total == 0:
                 raise Exception("No quotes were passed")
+            start, stop = page_bounds(page, QUOTES_PER_PAGE)
+            quotes = Page(quotes.select_related('user').order_by('timestamp', 'pk')[start:stop], max(page, 0), QUOTES_PER_PAGE, total)
             formatted_message = ""
             if requester is not None:
-                formatted_message += "Quotes requested by `{}`".format(requester.name)
-            for quote in quotes:
-                formatted_message += "\n{}".format(self.beautify_quote(quote, requester=requester, multiple=True))
+                formatted_message += "Quotes requested by `{}`\n".format(requester.name)
+            footer = '_Page {} of {}_'.format(quotes.number + 1, quotes.pages) if quotes.pages > 1 else ''
+            lines = (self.beautify_quote(quote, requester=requester, multiple=True) for quote in quotes.page_items)
+            formatted_message += render_lines(lines, reserve=reserve + len(formatted_message) + len(footer))
+            formatted_message += footer
         except Exception as e:
             pass
-        return paginate(formatted_message, reserve=reserve)[page]
+        return formatted_message
     # End class methods
 
     # Events
@@ -115,8 +124,8 @@ class Quotes:
         Quote everything!
         """
         if ctx.invoked_subcommand is None:
-            await self.bot.say("{}: I didn't quite understand your command, please run `?help quote` to learn how to use this command.".format(ctx.message.author.mention), delete_after=30)
-        await self.bot.delete_message(ctx.message)
+            self.bot.deleter.delete(await self.bot.say("{}: I didn't quite understand your command, please run `?help quote` to learn how to use this command.".format(ctx.message.author.mention)), delay=30)
+        self.bot.deleter.delete(ctx.message)
 
     @quote_command.command(name="add", pass_context=True)
     @checks.is_personal_server()
@@ -124,16 +133,16 @@ class Quotes:
         """
         Create a quote for a specific User
         """
-        quote_user = self.get_user(user)
-        server = self.get_server(ctx.message.server)
-        user = self.get_user(ctx.message.author)
+        quote_user = await self.bot.db.run(self.get_user, user)
+        server = await self.bot.db.run(self.get_server, ctx.message.server)
+        user = await self.bot.db.run(self.get_user, ctx.message.author)
         content = message.strip()
         try:
-            quote = Quote.objects.create(timestamp=timezone.now(), user=quote_user, added_by=user, server=server, message=content)
-            await self.bot.say("{0}, Your quote was create successfully!\nThe Quote ID is `{1}`\nYou can use this to reference it in the future by typing `?quote get {1}`".format(ctx.message.author.mention, quote.quote_id), delete_after=30)
+            quote = await self.bot.db.run(Quote.objects.create, timestamp=timezone.now(), user=quote_user, added_by=user, server=server, message=content)
+            self.bot.deleter.delete(await self.bot.say("{0}, Your quote was create successfully!\nThe Quote ID is `{1}`\nYou can use this to reference it in the future by typing `?quote get {1}`".format(ctx.message.author.mention, quote.quote_id)), delay=30)
         except Exception as e:
-            log_item = Log.objects.create(message="{}\nError creating Quote\n{}\nquote_user: {}\nuser: {}\nserver: {}\nmessage: {}\nmentions: {}".format(logify_exception_info(), e, quote_user, user, server, message, mentions))
-            await self.bot.say("{}, There was an error when trying to create your Quote. Please contact my Owner with the following code: `{}`".format(ctx.message.author.mention, log_item.message_token), delete_after=30)
+            log_item = await self.bot.db.run(Log.objects.create, message="{}\nError creating Quote\n{}\nquote_user: {}\nuser: {}\nserver: {}\nmessage: {}".format(logify_exception_info(), e, quote_user, user, server, message))
+            self.bot.deleter.delete(await self.bot.say("{}, There was an error when trying to create your Quote. Please contact my Owner with the following code: `{}`".format(ctx.message.author.mention, log_item.message_token)), delay=30)
 
     @quote_command.command(name="get", pass_context=True)
     @checks.is_personal_server()
@@ -141,17 +150,16 @@ class Quotes:
         """
         Get a specific Quote based on quote_id
         """
-        server = self.get_server(ctx.message.server)
-        user = self.get_user(ctx.message.author)
+        user = await self.bot.db.run(self.get_user, ctx.message.author)
         quote_id = quote_id.strip()
         try:
-            quote = Quote.objects.get(quote_id=quote_id.strip())
+            quote = await self.bot.db.run(Quote.objects.select_related('user').get, quote_id=quote_id)
             await self.bot.say("{}".format(self.beautify_quote(quote, requester=user)))
         except Quote.DoesNotExist as e:
-            await self.bot.say("{}, I'm sorry but I can't find a quote with the ID `{}`".format(ctx.message.author.mention, quote_id), delete_after=30)
+            self.bot.deleter.delete(await self.bot.say("{}, I'm sorry but I can't find a quote with the ID `{}`".format(ctx.message.author.mention, quote_id)), delay=30)
         except Exception as e:
-            log_item = Log.objects.create(message="{}\nError retrieving Quote\n{}\nquote_id: {}".format(logify_exception_info(), e, quote_id))
-            await self.bot.say("{}, There was an error when trying to get your Quote. Please contact my Owner with the following code: `{}`".format(ctx.message.author.mention, log_item.message_token), delete_after=30)
+            log_item = await self.bot.db.run(Log.objects.create, message="{}\nError retrieving Quote\n{}\nquote_id: {}".format(logify_exception_info(), e, quote_id))
+            self.bot.deleter.delete(await self.bot.say("{}, There was an error when trying to get your Quote. Please contact my Owner with the following code: `{}`".format(ctx.message.author.mention, log_item.message_token)), delay=30)
 
     @quote_command.command(name="user", pass_context=True)
     @checks.is_personal_server()
@@ -159,12 +167,12 @@ class Quotes:
         """
         Return all quotes for a specific user
         """
-        requester = self.get_user(ctx.message.author)
-        quote_user = self.get_user(user)
-        server = self.get_server(ctx.message.server)
+        requester = await self.bot.db.run(self.get_user, ctx.message.author)
+        quote_user = await self.bot.db.run(self.get_user, user)
+        server = await self.bot.db.run(self.get_server, ctx.message.server)
         quotes = Quote.objects.filter(user=quote_user, server=server)
-        if quotes.count() >= 1:
-            await self.bot.say("{}".format(self.beautify_quotes(quotes, page=page, requester=requester)))
+        if await self.bot.db.run(quotes.exists):
+            await self.bot.say("{}".format(await self.bot.db.run(self.beautify_quotes, quotes, page=page, requester=requester)))
         else:
             await self.bot.say("`{}` does not have any quotes!".format(quote_user.name))
 
@@ -174,8 +182,10 @@ class Quotes:
         """
         Return a random Quote
         """
-        server = self.get_server(ctx.message.server)
-        await self.bot.say("{}".format(self.beautify_quote(Quote.random_quote(sserver=server), requester=self.get_user(ctx.message.author))))
+        server = await self.bot.db.run(self.get_server, ctx.message.server)
+        requester = await self.bot.db.run(self.get_user, ctx.message.author)
+        quote = await self.bot.db.run(Quote.random_quote, server=server)
+        await self.bot.say("{}".format(await self.bot.db.run(self.beautify_quote, quote, requester=requester)))
 
     @quote_command.command(name="delete", pass_context=True)
     @checks.is_personal_server()
@@ -184,22 +194,21 @@ class Quotes:
         """
         Delete a specific Quote with quote_id
         """
-        user = self.get_user(ctx.message.author)
-        server = self.get_server(ctx.message.server)
+        user = await self.bot.db.run(self.get_user, ctx.message.author)
         try:
-            quote = Quote.objects.get(quote_id=quote_id.strip())
+            quote = await self.bot.db.run(Quote.objects.get, quote_id=quote_id.strip())
             try:
-                quote.delete()
-                Log.objects.create(message="Quote ID {} deleted by {}.\nQuote Message:\n\n{}".format(quote_id, user, quote.message))
+                await self.bot.db.run(quote.delete)
+                await self.bot.db.run(Log.objects.create, message="Quote ID {} deleted by {}.\nQuote Message:\n\n{}".format(quote_id, user, quote.message))
                 await self.bot.say("{}, The Quote with ID `{}` has been deleted!".format(ctx.message.author.mention, quote_id))
             except Exception as e:
-                log_item = Log.objects.create(message="{}\nError deleting Quote\n{}\nquote_id: {}".format(logify_exception_info(), e, quote_id))
+                log_item = await self.bot.db.run(Log.objects.create, message="{}\nError deleting Quote\n{}\nquote_id: {}".format(logify_exception_info(), e, quote_id))
                 await self.bot.say("{}, The Quote with ID `{}` could not be deleted! Please contact my owner with the following code: `{}`".format(ctx.message.author.mention, quote_id, log_item.message_token))
         except Quote.DoesNotExist as e:
             await self.bot.say("{}, A Quote qith ID `{}` cannot be found!".format())
         except Exception as e:
-            log_item = Log.objects.create(message="{}\nError retrieving Quote\n{}\nquote_id: {}".format(logify_exception_info(), e, quote_id))
-            await self.bot.say("{}, There was an error when trying to get your Quote. Please contact my Owner with the following code: `{}`".format(ctx.message.author.mention, log_item.message_token), delete_after=30)
+            log_item = await self.bot.db.run(Log.objects.create, message="{}\nError retrieving Quote\n{}\nquote_id: {}".format(logify_exception_info(), e, quote_id))
+            self.bot.deleter.delete(await self.bot.say("{}, There was an error when trying to get your Quote. Please contact my Owner with the following code: `{}`".format(ctx.message.author.mention, log_item.message_token)), delay=30)
 
     @quote_command.command(name="created", pass_context=True)
     @checks.is_personal_server()
@@ -207,11 +216,11 @@ class Quotes:
         """
         Get Quotes created by the specified user
         """
-        requester = self.get_user(ctx.message.author)
-        user = self.get_user(user)
+        requester = await self.bot.db.run(self.get_user, ctx.message.author)
+        user = await self.bot.db.run(self.get_user, user)
         quotes = Quote.objects.filter(user=user)
-        if quotes.count() >= 1:
-            await self.bot.say("{}".format(self.beautify_quotes(quotes, page=page, requester=requester)))
+        if await self.bot.db.run(quotes.exists):
+            await self.bot.say("{}".format(await self.bot.db.run(self.beautify_quotes, quotes, page=page, requester=requester)))
         else:
             await self.bot.say("`{}` has not created any quotes!".format(user.name))
     # End Commands
@@ -3,13 +3,33 @@ from discord.enums import ChannelType
 from .utils import checks
 import asyncio
 import discord
+import logging
+import time
 
 import web.wsgi
+from datetime import timedelta
 from django.utils import timezone
 from django.db import models
+from django.db.models.signals import post_save
 import pytz
-from gaming.models import DiscordUser, Game, GameUser, Server, Role, GameSearch, Channel, Task, Log, ChannelUser, ServerUser
-from gaming.utils import logify_exception_info, logify_object, current_line
+from gaming import identity
+from gaming.models import DiscordUser, DiscordUserHistory, Game, GameUser, Server, Role, GameSearch, Channel, Task, Log, ChannelUser, ServerUser
+from gaming.membership import membership
+from gaming.occupancy import channel_occupancy
+from gaming.page_cache import page_cache
+from gaming.rankings import game_rankings
+from gaming.utils import logify_exception_info, logify_object, current_line, chunks, bulk_update
+
+log = logging.getLogger(__name__)
+
+# Number of rows written or looked up per query when syncing members
+SYNC_CHUNK_SIZE = 500
+
+# How long before a game channel is closed that a warning is sent to it
+CHANNEL_WARNING_TIME = timedelta(minutes=5)
+
+# Maximum number of channel deletions in flight at once when pruning
+PRUNE_CONCURRENCY = 5
 
 
 class Tasks:
@@ -24,33 +44,110 @@ class Tasks:
     - Creates a :class:`gaming.models.DiscordUser` object for every User on each Server the bot is a part of
     - Associates a :class:`gaming.models.Channel` with every :class:`gaming.models.DiscordUser` that has access
     - Processes :class:`gaming.models.Task` that are pending
+    - Closes game channels and expires game searches when they are due, using the bot's :class:`cogs.utils.scheduler.Scheduler`
     """
     def __init__(self, bot):
         self.bot = bot
-        self.task_runner = bot.loop.create_task(self.run_tasks())
+        self.channel_fingerprints = {}
+        self.scheduler = bot.scheduler
+        self.prune_lock = asyncio.Lock(loop=bot.loop)
+        post_save.connect(self.schedule_channel, sender=Channel, weak=False, dispatch_uid='tasks_schedule_channel')
+        post_save.connect(self.schedule_task, sender=Task, weak=False, dispatch_uid='tasks_schedule_task')
+        post_save.connect(self.schedule_game_search, sender=GameSearch, weak=False, dispatch_uid='tasks_schedule_game_search')
 
     def __unload(self):
-        self.task_runner.cancel()
+        post_save.disconnect(sender=Channel, dispatch_uid='tasks_schedule_channel')
+        post_save.disconnect(sender=Task, dispatch_uid='tasks_schedule_task')
+        post_save.disconnect(sender=GameSearch, dispatch_uid='tasks_schedule_game_search')
 
-    def populate_info(self):
+    async def populate_info(self):
         """ Populate all users and servers """
-        for server in self.bot.servers:
-            s = self.get_server(server)
-            for user in server.members:
-                u = self.get_user(user)
-                self.get_server_user(u, s)
+        for server in list(self.bot.servers):
+            s = await self.bot.db.run(self.get_server, server)
+            members = {member.id: self.get_member_fields(member) for member in server.members}
+            await self.bot.db.run(self.sync_members, s, members)
+
+    def sync_members(self, server, members):
+        """
+        Brings the :class:`gaming.models.DiscordUser` and :class:`gaming.models.ServerUser` rows for a server in line with its members
+
+        server : Required[:class:`gaming.models.Server`]
+            The Server being synced
+        members : Required[dict]
+            Member ID to the fields from :meth:`get_member_fields` for every member currently on the server
+        """
+        start = time.monotonic()
+        server_users = {}
+        users = {}
+        for server_user in ServerUser.objects.filter(server=server).select_related('user'):
+            server_users[server_user.user.user_id] = server_user
+            users[server_user.user.user_id] = server_user.user
+
+        missing_ids = [user_id for user_id in members if user_id not in users]
+        for chunk in chunks(missing_ids, SYNC_CHUNK_SIZE):
+            for user in DiscordUser.objects.filter(user_id__in=chunk):
+                users[user.user_id] = user
+
+        new_users = [DiscordUser(user_id=user_id, **members[user_id]) for user_id in members if user_id not in users]
+        DiscordUser.objects.bulk_create(new_users, batch_size=SYNC_CHUNK_SIZE)
+        for chunk in chunks([user.user_id for user in new_users], SYNC_CHUNK_SIZE):
+            for user in DiscordUser.objects.filter(user_id__in=chunk):
+                users[user.user_id] = user
+
+        changed_users = []
+        history = []
+        for user_id, fields in members.items():
+            user = users[user_id]
+            for name, value in fields.items():
+                setattr(user, name, value)
+            changed = user.get_changed_fields()
+            if changed:
+                changed_users.append(user)
+                history.extend(user.get_history(changed))
+        bulk_update(DiscordUser, changed_users, ['name', 'bot', 'avatar_url'])
+        DiscordUserHistory.objects.bulk_create(history, batch_size=SYNC_CHUNK_SIZE)
+        for user in changed_users:
+            user.snapshot_fields()
+
+        new_server_users = [ServerUser(user=users[user_id], server=server) for user_id in members if user_id not in server_users]
+        ServerUser.objects.bulk_create(new_server_users, batch_size=SYNC_CHUNK_SIZE)
+        # bulk_create doesn't send post_save, so tell the indexes directly
+        for server_user in new_server_users:
+            membership.add(server_user.user.pk, server.pk)
+            game_rankings.add_member(server_user.user.pk, server.pk)
+        changed_user_ids = set(user.user_id for user in changed_users) | set(server_user.user.user_id for server_user in new_server_users)
+        if changed_user_ids:
+            page_cache.bump(('server', server.server_id), *[('user', user_id) for user_id in changed_user_ids])
+
+        removed_pks = [server_user.pk for user_id, server_user in server_users.items() if user_id not in members]
+        for chunk in chunks(removed_pks, SYNC_CHUNK_SIZE):
+            ServerUser.objects.filter(pk__in=chunk).delete()
+
+        for user_id in members:
+            identity.users.set(user_id, users[user_id])
+
+        log.info('Synced {} members for server {} in {:.2f}s: {} users created, {} users updated, {} server users created, {} server users deleted'.format(
+            len(members), server, time.monotonic() - start, len(new_users), len(changed_users), len(new_server_users), len(removed_pks)))
+
+    def get_member_fields(self, member):
+        """
+        Returns a dict of the :class:`gaming.models.DiscordUser` field values for a member
+        """
+        avatar_url = member.avatar_url
+        if avatar_url is None or avatar_url == "":
+            avatar_url = member.default_avatar_url
+        return {'name': member.name, 'bot': member.bot, 'avatar_url': avatar_url}
 
     def get_server(self, server):
         """
         Returns a :class:`gaming.models.Server` object after getting or creating the server
         """
         error = False
-        s, created = Server.objects.get_or_create(server_id=server.id)
+        s = identity.get_server(server.id)
         try:
             s.name = server.name
             s.icon = server.icon
             s.owner = self.get_user(server.owner)
-            s.save()
             # Log.objects.create(message="s: {0}\ncreated: {1}\nname: {0.name}\nicon: {0.icon}\nowner: {0.owner}".format(s, created))
         except Exception as e:
             error = True
@@ -64,42 +161,50 @@ class Tasks:
         Returns a :class:`gaming.models.DiscordUser` object after getting or creating the user
         """
         error = False
-        u, created = DiscordUser.objects.get_or_create(user_id=member.id)
+        u = identity.get_user(member.id)
         try:
-            u.name = member.name
-            u.bot = member.bot
-            avatar_url = member.avatar_url
-            if avatar_url is None or avatar_url == "":
-                avatar_url = member.default_avatar_url
-            u.avatar_url = avatar_url
+            for name, value in self.get_member_fields(member).items():
+                setattr(u, name, value)
             # Log.objects.create(message="u: {0}\ncreated: {1}\nname: {0.name}\navatar_url: {0.avatar_url}\nbot: {0.bot}".format(u, created))
         except Exception as e:
             error = True
             Log.objects.create(message="Error trying to get DiscordUser object for member: {}.\n{}".format(u, logify_exception_info()))
         finally:
+            changed = u.get_changed_fields()
             u.save()
+            # The receiver only expires the user's own page, the server the member was seen on shows them too
+            if (changed is None or changed) and getattr(member, 'server', None) is not None:
+                page_cache.bump(('server', member.server.id))
             return u
 
     def get_server_user(self, user, server):
-        return ServerUser.objects.get_or_create(user=user, server=server)[0]
+        return identity.get_server_user(user, server)
 
     async def on_ready(self):
         """
         Bot is loaaded, populate information that is needed for everything
         """
-        self.populate_info()
+        await self.populate_info()
+        await self.update_channels()
+        await self.bot.db.run(self.load_deadlines)
 
     async def on_member_join(self, member):
         """
         A new member has joined, make sure there are instance of :class:`gaming.models.Server` and :class:`gaming.models.DiscordUser` for this event
         """
-        server = self.get_server(member.server)
-        user = self.get_user(member)
+        await self.bot.db.run(self.get_server, member.server)
+        await self.bot.db.run(self.get_user, member)
 
     async def on_member_remove(self, member):
         """
         A member has been kicked/banned or has left a server, deleted their instances of :class:`gaming.models.ServerUser`
         """
+        await self.bot.db.run(self.remove_server_user, member)
+
+    def remove_server_user(self, member):
+        """
+        Delete the :class:`gaming.models.ServerUser` objects for a member that has left a server
+        """
         error = False
         server = self.get_server(member.server)
         user = self.get_user(member)
@@ -108,11 +213,9 @@ class Tasks:
         for server_user in server_users:
             try:
                 server_user.delete()
-                # delete_message = "- Deleted user {} for server {}".format(user, server)
             except Exception as e:
                 error = True
-                delete_message = "- Could not delete user {} for server {}\n{}".format(user, server, e)
-            log_item.message += "{}\n".format(delete_message)
+                log_item.message += "- Could not delete user {} for server {}\n{}\n".format(user, server, e)
         if error:
             log_item.save()
 
@@ -120,96 +223,237 @@ class Tasks:
         """
         This is to populate games and users automatically
         """
-        server = self.get_server(after.server)
-        user = self.get_user(after)
-        server_user = self.get_server_user(user=user, server=server)
+        await self.bot.db.run(self.update_member, after)
 
-    async def run_tasks(self):
-        try:
-            while not self.bot.is_closed:
-                await self.run_scheduled_tasks()
-                await self.prune_channels()
-                await self.update_channels()
-                await asyncio.sleep(60)
-        except asyncio.CancelledError as e:
-            pass
+    def update_member(self, member):
+        """
+        Update the :class:`gaming.models.Server`, :class:`gaming.models.DiscordUser` and :class:`gaming.models.ServerUser` for a member
+        """
+        server = self.get_server(member.server)
+        user = self.get_user(member)
+        return self.get_server_user(user=user, server=server)
 
-    async def prune_channels(self):
-        error = False
-        channels = Channel.objects.filter(private=False, game_channel=True, expire_date__lte=timezone.now(), deleted=False)
-        if channels.count() >= 1:
-            log_item = Log(message="Running task to prune channels:\n{}\n\n".format(logify_object(channels)))
-            for channel in channels:
-                if channel is None:
-                    continue
-                log_item.message += 'Deleting channel {}\n\n'.format(channel)
-                try:
-                    c = await self.bot.get_channel(channel.channel_id)
-                    if c is not None:
-                        try:
-                            await self.bot.delete_channel(c)
-                            # log_item.message += '- Success'
-                        except Exception as e:
-                            error = True
-                            log_item.message += '- Failure\n\n{}{}\n'.format(logify_exception_info(), e)
-                except Exception as e:
-                    # Channel no longer exists on server
-                    error = True
-                    log_item.message += '- Failure\n\n{}{}\n'.format(logify_exception_info(), e)
-                finally:
-                    channel.deleted = True
-                    channel.save()
-                log_item.message += "\n\n"
-                await asyncio.sleep(1)
-            if error:
-                log_item.save()
+    def load_deadlines(self):
+        """
+        Schedule every pending game channel, task and game search from the database
+        """
+        for channel in Channel.objects.filter(private=False, game_channel=True, deleted=False, expire_date__isnull=False):
+            self.schedule_channel(Channel, channel)
+        for task in Task.objects.filter(cancelled=False, completed=False):
+            self.schedule_task(Task, task)
+        for game_search in GameSearch.objects.filter(cancelled=False, game_found=False, expire_date__gte=timezone.now()):
+            self.schedule_game_search(GameSearch, game_search)
+
+    def schedule_channel(self, sender, instance, *args, **kwargs):
+        """
+        Schedule the warning and deletion of a game channel, or cancel them if it no longer needs deleting
+        """
+        if instance.private or not instance.game_channel or instance.deleted or instance.expire_date is None:
+            self.scheduler.cancel(('channel', instance.pk))
+            self.scheduler.cancel(('channel_warning', instance.pk))
+            return
+        self.scheduler.schedule(instance.expire_date, ('channel', instance.pk), self.prune_channels)
+        if instance.warning_sent:
+            self.scheduler.cancel(('channel_warning', instance.pk))
         else:
-            # No channels found to be deleted
-            pass
+            self.scheduler.schedule(instance.expire_date - CHANNEL_WARNING_TIME, ('channel_warning', instance.pk), self.warn_channel, instance.pk)
+
+    def schedule_task(self, sender, instance, *args, **kwargs):
+        """
+        Schedule a task to be run when it expires, or cancel it if it is no longer pending
+        """
+        if instance.cancelled or instance.completed:
+            self.scheduler.cancel(('task', instance.pk))
+        else:
+            self.scheduler.schedule(instance.expire_date, ('task', instance.pk), self.run_scheduled_tasks)
+
+    def schedule_game_search(self, sender, instance, *args, **kwargs):
+        """
+        Schedule a game search to expire, or cancel it if it is no longer active
+        """
+        if instance.cancelled or instance.game_found:
+            self.scheduler.cancel(('game_search', instance.pk))
+        else:
+            self.scheduler.schedule(instance.expire_date, ('game_search', instance.pk), self.expire_game_search, instance.pk)
+
+    async def warn_channel(self, channel_pk):
+        """
+        Let a game channel know it is about to be deleted
+        """
+        channel = await self.bot.db.run(Channel.objects.filter(pk=channel_pk, deleted=False, warning_sent=False).first)
+        if channel is None:
+            return
+        c = self.bot.get_channel(channel.channel_id)
+        if c is not None:
+            minutes = max(int((channel.expire_date - timezone.now()).total_seconds() // 60), 0)
+            try:
+                await self.bot.send_message(c, "This channel will be closed in {} minutes.".format(minutes))
+            except Exception as e:
+                await self.bot.db.run(Log.objects.create, message="Error sending deletion warning to channel {}\n{}\n{}".format(channel, logify_exception_info(), e))
+        channel.warning_sent = True
+        await self.bot.db.run(channel.save)
+
+    async def expire_game_search(self, game_search_pk):
+        """
+        Dispatch ``on_game_search_expire`` for a game search that ran out without finding a game
+        """
+        game_search = await self.bot.db.run(GameSearch.objects.filter(pk=game_search_pk, cancelled=False, game_found=False).select_related('user', 'game', 'server').first)
+        if game_search is None:
+            return
+        self.bot.dispatch('game_search_expire', game_search)
+
+    async def prune_channels(self):
+        """
+        Close every game channel that has expired
+
+        Each channel is returned to the bot's :class:`cogs.utils.channel_pool.ChannelPool` if the pool wants it, otherwise deleted.
+        Up to :data:`PRUNE_CONCURRENCY` channels are closed at a time. discord.py queues requests per rate limit bucket
+        and retries when rate limited, so this only bounds how many requests are waiting at once.
+        """
+        async with self.prune_lock:
+            channels = await self.bot.db.run(list, Channel.objects.filter(private=False, game_channel=True, expire_date__lte=timezone.now(), deleted=False))
+            if not channels:
+                return
+            semaphore = asyncio.Semaphore(PRUNE_CONCURRENCY, loop=self.bot.loop)
+            results = await asyncio.gather(*[self.close_channel(channel, semaphore) for channel in channels], loop=self.bot.loop)
+            deleted = [channel for channel, (pooled, error) in zip(channels, results) if not pooled]
+            if deleted:
+                await self.bot.db.run(Channel.objects.filter(pk__in=[channel.pk for channel in deleted]).update, deleted=True)
+            for channel in deleted:
+                identity.channels.discard(channel.pk)
+                channel_occupancy.discard(channel.pk)
+
+            failures = [(channel, error) for channel, (pooled, error) in zip(channels, results) if error is not None]
+            if failures:
+                await self.bot.db.run(self.log_prune_failures, channels, failures)
+
+    def log_prune_failures(self, channels, failures):
+        """
+        Save a :class:`gaming.models.Log` of the channels that could not be closed
+
+        Formatting every channel is slow enough that it is done here, on the database pool, rather than on the event loop
+        """
+        log_item = Log(message="Running task to prune channels:\n{}\n\n".format(logify_object(channels)))
+        for channel, error in failures:
+            log_item.message += 'Deleting channel {}\n- Failure\n\n{}\n\n'.format(channel, error)
+        log_item.save()
+
+    async def close_channel(self, channel, semaphore):
+        """
+        Return the Discord channel for a :class:`gaming.models.Channel` to the channel pool, or delete it
+
+        Returns a (pooled, error) tuple, where error is None on success or if the channel is already gone, otherwise a description of the error
+        """
+        c = self.bot.get_channel(channel.channel_id)
+        if c is None:
+            return (False, None)
+        async with semaphore:
+            if await self.bot.channel_pool.release(channel):
+                return (True, None)
+            try:
+                await self.bot.delete_channel(c)
+            except Exception as e:
+                return (False, '{}{}'.format(logify_exception_info(), e))
+        return (False, None)
 
     async def update_channels(self):
-        error = False
-        for server in Server.objects.all():
-            # This will be to populate Channels and Users
-            s = self.bot.get_server(server.server_id)
-            log_item = Log(message="Starting population of channels for server {}\n\n".format(server))
+        """
+        Sync the channels of every server the bot is a part of
+        """
+        for server in list(self.bot.servers):
             try:
-                for c in s.channels:
-                    if c.is_private or c.type == ChannelType.voice:
-                        continue
-                    channel, created = Channel.objects.get_or_create(channel_id=c.id, server=server)
-                    channel.name = c.name
-                    channel.created_date = pytz.timezone('UTC').localize(c.created_at)
-                    channel.save()
-                channels = Channel.objects.filter(server=server, deleted=False)
-                # log_item.message += "Found channels:\n{}\n\n".format(logify_object(channels))
-                for channel in channels:
-                    try:
-                        # log_item.message += "Running for channel {}\n".format(channel)
-                        c = self.bot.get_channel(channel.channel_id)
-                        if c.is_default:
-                            # log_item.message += "- Channel is default channel, skipping...\n"
-                            continue
-                        if c is None:
-                            # log_item.message += "- Channel is not found, marking as deleted\n"
-                            c.deleted = True
-                            c.save()
-                            continue
-                    except Exception as e:
-                        error = True
-                        log_item.message += "- Failed:\n{}\n{}\n".format(logify_exception_info(), e)
-                    finally:
-                        # log_item.message += "- Finished channel processing\n\n"
-                        pass
-                # log_item.message += "\n"
+                await self.sync_channels(server)
             except Exception as e:
-                error = True
-                log_item.message += "- Failed: {}\n{}\n".format(logify_exception_info(), e)
-            finally:
-                if error:
-                    log_item.save()
+                await self.bot.db.run(Log.objects.create, message="Error syncing channels for server {}\n{}\n{}".format(server.id, logify_exception_info(), e))
+
+    def get_channel_fingerprint(self, server):
+        """
+        Returns a value that changes whenever a channel on the server is added, removed, renamed or changes type
+        """
+        return frozenset((c.id, c.name, str(c.type)) for c in server.channels)
+
+    async def sync_channels(self, server):
+        """
+        Brings the :class:`gaming.models.Channel` rows for a server in line with its text channels
+
+        Nothing is read or written if the channels haven't changed since the last sync
+        """
+        fingerprint = self.get_channel_fingerprint(server)
+        if self.channel_fingerprints.get(server.id) == fingerprint:
+            return
+        text_channels = [(c.id, c.name, pytz.utc.localize(c.created_at)) for c in server.channels if not c.is_private and c.type != ChannelType.voice]
+        await self.bot.db.run(self.write_channels, server.id, text_channels)
+        self.channel_fingerprints[server.id] = fingerprint
+
+    def write_channels(self, server_id, text_channels):
+        """
+        Create, rename and mark deleted :class:`gaming.models.Channel` rows so they match :attr:`text_channels`
+
+        server_id : Required[str]
+            The ID of the Server the channels are on
+        text_channels : Required[list]
+            A (channel_id, name, created_date) tuple for every text channel on the server
+        """
+        s = identity.get_server(server_id)
+        channels = {channel.channel_id: channel for channel in Channel.objects.filter(server=s)}
+        for channel_id, name, created_date in text_channels:
+            channel = channels.get(channel_id)
+            if channel is None:
+                # The channel pool and provisioning can insert a channel the bot just created at the same time
+                channel, created = Channel.objects.get_or_create(channel_id=channel_id, defaults={'server': s, 'name': name, 'created_date': created_date})
+                if channel.name != name:
+                    channel.name = name
+                    channel.save()
+                identity.channels.set(channel_id, channel)
+            elif channel.name != name:
+                channel.name = name
+                channel.save()
+        current_ids = set(channel_id for channel_id, name, created_date in text_channels)
+        removed_pks = [channel.pk for channel in channels.values() if not channel.deleted and channel.channel_id not in current_ids]
+        if removed_pks:
+            Channel.objects.filter(pk__in=removed_pks).update(deleted=True)
+            for pk in removed_pks:
+                identity.channels.discard(pk)
+                channel_occupancy.discard(pk)
+
+    async def on_channel_create(self, channel):
+        """
+        A channel has been created, sync the channels for its server
+        """
+        if not channel.is_private:
+            await self.sync_channels(channel.server)
+
+    async def on_channel_update(self, before, after):
+        """
+        A channel has been updated, sync the channels for its server
+        """
+        if not after.is_private:
+            await self.sync_channels(after.server)
+
+    async def on_channel_delete(self, channel):
+        """
+        A channel has been deleted, sync the channels for its server
+        """
+        if not channel.is_private:
+            await self.sync_channels(channel.server)
+
+    async def on_server_join(self, server):
+        """
+        The bot has joined a server, make sure it has a :class:`gaming.models.Server` and its channels are synced
+        """
+        await self.bot.db.run(self.get_server, server)
+        await self.sync_channels(server)
+
+    async def on_resumed(self):
+        """
+        Events may have been missed while disconnected, so check every server for channel changes
+        """
+        await self.update_channels()
 
     async def run_scheduled_tasks(self):
+        await self.bot.db.run(self.process_scheduled_tasks)
+
+    def process_scheduled_tasks(self):
         error = False
         tasks = Task.objects.filter(cancelled=False, completed=False, expire_date__lte=timezone.now())
         log_item = Log(message="Starting task processing\n")
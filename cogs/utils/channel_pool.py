@@ -0,0 +1,235 @@
+import time
+from collections import defaultdict, deque
+
+import discord
+
+from gaming import identity
+from gaming.models import Channel, ChannelUser, Log
+from gaming.utils import logify_exception_info
+
+
+# The name a pooled channel has while it waits for a group
+POOL_CHANNEL_NAME = 'game-channel'
+
+# A channel with more messages than this is deleted instead of being cleared out and pooled again
+PURGE_LIMIT = 500
+
+HIDDEN = discord.PermissionOverwrite(read_messages=False, send_messages=False)
+ALLOWED = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+
+
+class ChannelPool:
+    """
+    Keeps hidden game channels ready on every server, so a new group is given one with a single edit
+
+    bot : Required[obj]
+        The bot instance that is currently running
+    min_size : Optional[int]
+        The fewest channels to keep ready on a server
+    max_size : Optional[int]
+        The most channels to keep ready on a server
+    window : Optional[int]
+        Seconds of recent groups to size the pool by
+
+    Pooled channels are :class:`gaming.models.Channel` rows with ``pooled`` set, only the bot can see them.
+    Claiming one renames it and replaces its overwrites in one request with the bot's
+    :class:`cogs.utils.provisioning.ChannelProvisioner`, instead of creating a channel and setting every member's permissions. When a game channel expires it is cleared out and
+    returned to the pool, unless the pool is already full.
+    A server keeps as many channels as groups it started in the last :attr:`window` seconds, between
+    :attr:`min_size` and :attr:`max_size`.
+    """
+    def __init__(self, bot, min_size=0, max_size=5, window=900):
+        self.bot = bot
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        self.window = window
+        self._channels = defaultdict(deque)
+        self._claims = defaultdict(deque)
+        self._filling = set()
+
+    def size(self, server_id):
+        """
+        Returns the number of channels ready on a server
+        """
+        return len(self._channels.get(server_id, ()))
+
+    def demand(self, server_id, now=None):
+        """
+        Returns the number of groups started on a server in the last :attr:`window` seconds
+        """
+        now = time.monotonic() if now is None else now
+        claims = self._claims.get(server_id)
+        if claims is None:
+            return 0
+        while claims and claims[0] <= now - self.window:
+            claims.popleft()
+        if not claims:
+            del self._claims[server_id]
+            return 0
+        return len(claims)
+
+    def target_size(self, server_id, now=None):
+        """
+        Returns how many channels should be kept ready on a server
+        """
+        return max(self.min_size, min(self.demand(server_id, now), self.max_size))
+
+    def record_claim(self, server_id, now=None):
+        self._claims[server_id].append(time.monotonic() if now is None else now)
+
+    def put(self, server_id, channel):
+        """
+        Add a pooled :class:`gaming.models.Channel` to a server's pool
+        """
+        self._channels[server_id].append(channel)
+
+    def take(self, server_id):
+        """
+        Returns the oldest pooled :class:`gaming.models.Channel` on a server, or None if there aren't any
+        """
+        channels = self._channels.get(server_id)
+        if not channels:
+            return None
+        channel = channels.popleft()
+        if not channels:
+            del self._channels[server_id]
+        return channel
+
+    def clear(self):
+        self._channels.clear()
+        self._claims.clear()
+
+    async def load(self):
+        """
+        Fill the pools from the database, marking pooled channels that no longer exist as deleted
+        """
+        channels = await self.bot.db.run(list, Channel.objects.filter(pooled=True, deleted=False).select_related('server'))
+        self._channels.clear()
+        missing = []
+        for channel in channels:
+            if self.bot.get_channel(channel.channel_id) is None:
+                missing.append(channel)
+            else:
+                self.put(channel.server.server_id, channel)
+        for channel in missing:
+            await self.bot.db.run(self.retire, channel)
+
+    async def claim(self, server, game, members, expire_date):
+        """
+        Give a group a game channel, from the pool if there is one ready or else a new one
+
+        server : Required[:class:`discord.Server`]
+            The Server the group is on
+        members : Required[list]
+            The :class:`discord.Member` to let in
+
+        Returns the :class:`gaming.models.Channel`
+        """
+        self.record_claim(server.id)
+        overwrites = [(server.default_role, HIDDEN), (server.me, ALLOWED)] + [(member, ALLOWED) for member in members]
+        mchannel = None
+        while mchannel is None:
+            pooled = self.take(server.id)
+            if pooled is None:
+                break
+            channel = self.bot.get_channel(pooled.channel_id)
+            if channel is None:
+                await self.bot.db.run(self.retire, pooled)
+                continue
+            # The row is updated first so a sync caused by the edit reads it as a game channel
+            await self.bot.db.run(self.assign, pooled, game, expire_date)
+            try:
+                await self.bot.provisioner.apply(channel, overwrites, name=game.name)
+            except Exception as e:
+                await self.bot.db.run(Log.objects.create, message="Error claiming pooled channel {}\n{}\n{}".format(pooled, logify_exception_info(), e))
+                await self.bot.db.run(self.retire, pooled)
+                try:
+                    await self.bot.delete_channel(channel)
+                except Exception:
+                    pass
+                continue
+            mchannel = pooled
+        if mchannel is None:
+            channel = await self.bot.provisioner.create(server, game.name, overwrites)
+            mchannel = await self.bot.db.run(self.create, server.id, channel, game=game, expire_date=expire_date)
+        self.bot.loop.create_task(self.fill(server))
+        return mchannel
+
+    async def release(self, mchannel):
+        """
+        Clear out an expired game channel and return it to the pool
+
+        Returns True if the channel was pooled, or False if it should be deleted instead
+        """
+        channel = self.bot.get_channel(mchannel.channel_id)
+        if channel is None:
+            return False
+        server = channel.server
+        if self.size(server.id) >= self.target_size(server.id):
+            return False
+        try:
+            purged = await self.bot.purge_from(channel, limit=PURGE_LIMIT)
+            if len(purged) >= PURGE_LIMIT:
+                return False
+            await self.bot.db.run(self.reset, mchannel)
+            await self.bot.provisioner.apply(channel, [(server.default_role, HIDDEN), (server.me, ALLOWED)], name=POOL_CHANNEL_NAME, topic='')
+        except Exception as e:
+            await self.bot.db.run(Log.objects.create, message="Error returning channel {} to the pool\n{}\n{}".format(mchannel, logify_exception_info(), e))
+            return False
+        self.put(server.id, mchannel)
+        return True
+
+    async def fill(self, server):
+        """
+        Create hidden channels on a server until its pool is the size recent demand calls for
+        """
+        if server.id in self._filling:
+            return
+        self._filling.add(server.id)
+        try:
+            while self.size(server.id) < self.target_size(server.id):
+                channel = await self.bot.provisioner.create(server, POOL_CHANNEL_NAME, [(server.default_role, HIDDEN), (server.me, ALLOWED)])
+                self.put(server.id, await self.bot.db.run(self.create, server.id, channel, pooled=True))
+        except Exception as e:
+            await self.bot.db.run(Log.objects.create, message="Error filling the channel pool for server {}\n{}\n{}".format(server.id, logify_exception_info(), e))
+        finally:
+            self._filling.discard(server.id)
+
+    def create(self, server_id, channel, **fields):
+        """
+        Returns the :class:`gaming.models.Channel` for a channel the bot just created
+        """
+        fields.update({'server': identity.get_server(server_id), 'name': channel.name, 'game_channel': True})
+        mchannel, created = Channel.objects.update_or_create(channel_id=channel.id, defaults=fields)
+        return mchannel
+
+    def assign(self, mchannel, game, expire_date):
+        """
+        Turn a pooled :class:`gaming.models.Channel` into the game channel for a group
+        """
+        mchannel.pooled = False
+        mchannel.game = game
+        mchannel.name = game.name
+        mchannel.expire_date = expire_date
+        mchannel.warning_sent = False
+        mchannel.save()
+
+    def reset(self, mchannel):
+        """
+        Turn an expired game :class:`gaming.models.Channel` back into a pooled one
+        """
+        ChannelUser.objects.filter(channel=mchannel).delete()
+        mchannel.pooled = True
+        mchannel.game = None
+        mchannel.name = POOL_CHANNEL_NAME
+        mchannel.expire_date = None
+        mchannel.warning_sent = False
+        mchannel.save()
+
+    def retire(self, mchannel):
+        """
+        Mark a pooled :class:`gaming.models.Channel` whose Discord channel is gone, or unusable, as deleted
+        """
+        mchannel.deleted = True
+        mchannel.save()
+        identity.channels.discard(mchannel.pk)
@@ -0,0 +1,81 @@
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+
+class Database:
+    """
+    Runs Django ORM work on a dedicated thread pool so it never blocks the event loop
+
+    loop : Required[obj]
+        The event loop the results are returned to
+    pool_size : Optional[int]
+        The number of threads, and so database connections, to use
+
+    Usage: ``user = await bot.db.run(DiscordUser.objects.get, user_id=member.id)``
+
+    Anything returned must already be evaluated, so return lists instead of QuerySets.
+    """
+    def __init__(self, loop, pool_size=4):
+        self.loop = loop
+        self.pool_size = pool_size
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.submitted = 0
+        self.completed = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Call :attr:`func` with :attr:`args` and :attr:`kwargs` on the pool and return the result
+        """
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            return await self.loop.run_in_executor(self.executor, functools.partial(self._call, func, args, kwargs))
+        finally:
+            with self._lock:
+                self.completed += 1
+
+    def _call(self, func, args, kwargs):
+        with self._lock:
+            self.running += 1
+        # Connections are per thread, so make sure this thread's connection is usable before and after
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self.running -= 1
+
+    @property
+    def queue_depth(self):
+        """
+        The number of calls waiting for a free thread
+        """
+        return max(self.submitted - self.completed - self.running, 0)
+
+    def stats(self):
+        """
+        Returns a dict of pool size, queue depth and call counts
+        """
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'running': self.running,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+            }
+
+    def close(self):
+        """
+        Wait for every pending call to finish and stop the threads
+        """
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import math
+from collections import defaultdict
+
+import discord
+
+
+# Discord only bulk deletes messages younger than two weeks, less a margin for clock skew and the time spent waiting
+BULK_DELETE_WINDOW = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+
+# The most messages one bulk delete request takes
+BULK_DELETE_LIMIT = 100
+
+
+class MessageDeleter:
+    """
+    Deletes messages after a delay, in batches, from a timer wheel driven by the bot's :class:`cogs.utils.scheduler.Scheduler`
+
+    bot : Required[obj]
+        The bot instance that is currently running
+    resolution : Optional[float]
+        Seconds between ticks of the wheel, and so how late a deletion can be
+    slots : Optional[int]
+        The number of slots in the wheel, delays longer than ``resolution * slots`` go around more than once
+
+    Usage: ``deleter.delete(await bot.say('...'), ctx.message, delay=30)``
+
+    Instead of a sleeping task per message, every pending deletion sits in the slot of the tick it is due on,
+    and a single deadline is kept for the next tick while anything is pending.
+    Messages due on the same tick are grouped by channel and removed with the bulk delete endpoint,
+    while messages too old for it, and messages in private channels, are deleted one at a time.
+    """
+    def __init__(self, bot, resolution=1.0, slots=64):
+        self.bot = bot
+        self.resolution = resolution
+        self.slots = slots
+        self.pending = 0
+        self.requests = 0
+        self.deleted = 0
+        self._wheel = [[] for i in range(slots)]
+        self._cursor = 0
+        self._scheduled = False
+
+    def __len__(self):
+        return self.pending
+
+    def delete(self, *messages, delay=0):
+        """
+        Delete :attr:`messages` after :attr:`delay` seconds, anything that isn't a message (ex: None from a timeout) is skipped
+        """
+        ticks = max(int(math.ceil(delay / self.resolution)), 1)
+        rounds, offset = divmod(ticks - 1, self.slots)
+        bucket = self._wheel[(self._cursor + offset + 1) % self.slots]
+        for message in messages:
+            if isinstance(message, discord.Message):
+                bucket.append([rounds, message])
+                self.pending += 1
+        if self.pending and not self._scheduled:
+            self._schedule()
+
+    def _schedule(self):
+        # Scheduling the same key again would push the tick back, so it is only done once per tick
+        self._scheduled = True
+        self.bot.scheduler.schedule(self.resolution, ('message_deleter',), self.tick)
+
+    def advance(self):
+        """
+        Move the wheel on one slot and return the messages that are now due
+        """
+        self._cursor = (self._cursor + 1) % self.slots
+        bucket = self._wheel[self._cursor]
+        due = []
+        waiting = []
+        for entry in bucket:
+            if entry[0] > 0:
+                entry[0] -= 1
+                waiting.append(entry)
+            else:
+                due.append(entry[1])
+        self._wheel[self._cursor] = waiting
+        self.pending -= len(due)
+        return due
+
+    async def tick(self):
+        self._scheduled = False
+        due = self.advance()
+        if self.pending:
+            self._schedule()
+        if not due:
+            return
+        by_channel = defaultdict(dict)
+        for message in due:
+            by_channel[message.channel.id][message.id] = message
+        await asyncio.gather(*[self.delete_from(list(messages.values())) for messages in by_channel.values()], loop=self.bot.loop)
+
+    async def delete_from(self, messages):
+        """
+        Delete messages from one channel, in bulk where Discord allows it
+        """
+        channel = messages[0].channel
+        cutoff = datetime.datetime.utcnow() - BULK_DELETE_WINDOW
+        if channel.is_private:
+            bulk, single = [], messages
+        else:
+            bulk = [message for message in messages if message.timestamp > cutoff]
+            single = [message for message in messages if message.timestamp <= cutoff]
+        for i in range(0, len(bulk), BULK_DELETE_LIMIT):
+            chunk = bulk[i:i + BULK_DELETE_LIMIT]
+            if len(chunk) == 1:
+                single.extend(chunk)
+                continue
+            self.requests += 1
+            try:
+                await self.bot.delete_messages(chunk)
+                self.deleted += len(chunk)
+            except discord.HTTPException:
+                # Usually a message that is already gone or a missing permission, so try them one at a time
+                single.extend(chunk)
+        for message in single:
+            self.requests += 1
+            try:
+                await self.bot.delete_message(message)
+                self.deleted += 1
+            except discord.HTTPException:
+                pass
+
+    def stats(self):
+        """
+        Returns a dict of pending deletions, requests made and messages deleted
+        """
+        return {
+            'pending': self.pending,
+            'requests': self.requests,
+            'deleted': self.deleted,
+        }
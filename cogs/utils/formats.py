@@ -23,7 +23,7 @@ async def too_many_matches(bot, msg, matches, entry):
 
     # only give them 3 tries.
     for i in range(3):
-        message = await bot.wait_for_message(author=msg.author, channel=msg.channel, check=check)
+        message = await bot.prompts.wait(msg.channel, msg.author, check=check)
         index = int(message.content)
         try:
             return matches[index - 1]
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+
+
+class Matchmaker:
+    """
+    Queues game searches for every server and game, and forms a group the moment enough players are waiting
+
+    party_size : Optional[int]
+        The most players put in one group
+    min_party_size : Optional[int]
+        How many players need to be waiting before a group is formed
+
+    Searches are anything with ``pk``, ``user_id``, ``game_id`` and ``server_id``, normally :class:`gaming.models.GameSearch`.
+    Each queue is first in, first out, and adding or removing a search never looks at the other searches.
+    Expiring searches is left to the shared :class:`cogs.utils.scheduler.Scheduler`, which calls :meth:`remove`.
+    """
+    def __init__(self, party_size=5, min_party_size=2):
+        self.party_size = party_size
+        self.min_party_size = max(min(min_party_size, party_size), 1)
+        self._queues = {}
+        self._searches = {}
+        self._by_user = {}
+
+    def __len__(self):
+        return len(self._searches)
+
+    def __contains__(self, search_pk):
+        return search_pk in self._searches
+
+    def waiting(self, server_pk, game_pk):
+        """
+        Returns the number of searches waiting for a game on a server
+        """
+        return len(self._queues.get((server_pk, game_pk), ()))
+
+    def enqueue(self, search):
+        """
+        Add a search to its queue
+
+        Returns a list of the searches put in a new group, oldest first, or an empty list if there aren't enough players yet
+        """
+        key = (search.server_id, search.game_id)
+        if search.pk in self._searches or key in self._by_user.get(search.user_id, ()):
+            return []
+        queue = self._queues.setdefault(key, OrderedDict())
+        queue[search.pk] = search
+        self._searches[search.pk] = search
+        self._by_user.setdefault(search.user_id, {})[key] = search.pk
+        if len(queue) < self.min_party_size:
+            return []
+        group = []
+        while queue and len(group) < self.party_size:
+            search_pk, search = queue.popitem(last=False)
+            self._forget(search)
+            group.append(search)
+        if not queue:
+            del self._queues[key]
+        return group
+
+    def requeue(self, searches):
+        """
+        Put the searches of a group that couldn't be started back at the front of their queues, in their original order
+
+        No group is formed, the next :meth:`enqueue` does that. Searches that are queued again already are skipped.
+        """
+        for search in reversed(searches):
+            key = (search.server_id, search.game_id)
+            if search.pk in self._searches or key in self._by_user.get(search.user_id, ()):
+                continue
+            queue = self._queues.setdefault(key, OrderedDict())
+            queue[search.pk] = search
+            queue.move_to_end(search.pk, last=False)
+            self._searches[search.pk] = search
+            self._by_user.setdefault(search.user_id, {})[key] = search.pk
+
+    def _forget(self, search):
+        del self._searches[search.pk]
+        user_searches = self._by_user[search.user_id]
+        del user_searches[(search.server_id, search.game_id)]
+        if not user_searches:
+            del self._by_user[search.user_id]
+
+    def remove(self, search_pk):
+        """
+        Take a search out of its queue, returning it or None if it wasn't queued
+        """
+        search = self._searches.get(search_pk)
+        if search is None:
+            return None
+        key = (search.server_id, search.game_id)
+        queue = self._queues[key]
+        del queue[search_pk]
+        if not queue:
+            del self._queues[key]
+        self._forget(search)
+        return search
+
+    def remove_user(self, user_pk, game_pk=None):
+        """
+        Take every search by a user, or only the ones for :attr:`game_pk`, out of their queues
+
+        Returns a list of the removed searches
+        """
+        user_searches = self._by_user.get(user_pk, {})
+        search_pks = [search_pk for (server_pk, search_game_pk), search_pk in user_searches.items() if game_pk is None or search_game_pk == game_pk]
+        return [self.remove(search_pk) for search_pk in search_pks]
+
+    def clear(self):
+        """
+        Empty every queue
+        """
+        self._queues.clear()
+        self._searches.clear()
+        self._by_user.clear()
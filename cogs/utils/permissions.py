@@ -0,0 +1,34 @@
+import discord
+from discord.http import Route
+
+
+def overwrite_payload(target, overwrite):
+    """
+    Returns the API form of a permission overwrite for a :class:`discord.Role` or :class:`discord.Member`
+    """
+    allow, deny = overwrite.pair()
+    return {
+        'allow': allow.value,
+        'deny': deny.value,
+        'id': target.id,
+        'type': 'role' if isinstance(target, discord.Role) else 'member',
+    }
+
+
+async def edit_channel(bot, channel, *, overwrites=None, **fields):
+    """
+    Edit a channel and replace all of its permission overwrites in a single request
+
+    overwrites : Optional[list]
+        ``(target, PermissionOverwrite)`` pairs, any overwrite not given is removed
+    fields : Optional[dict]
+        Anything else the API accepts for a channel, ex: ``name`` or ``topic``
+
+    :meth:`discord.Client.edit_channel` doesn't send overwrites, and :meth:`discord.Client.edit_channel_permissions`
+    is one request per member, so this sends the request directly.
+    """
+    payload = dict(fields)
+    if overwrites is not None:
+        payload['permission_overwrites'] = [overwrite_payload(target, overwrite) for target, overwrite in overwrites]
+    route = Route('PATCH', '/channels/{channel_id}', channel_id=channel.id)
+    return await bot.http.request(route, json=payload)
@@ -0,0 +1,75 @@
+import asyncio
+import itertools
+
+
+class PromptDispatcher:
+    """
+    Routes replies to commands waiting on a member's answer
+
+    bot : Required[obj]
+        The bot instance that is currently running
+
+    Usage: ``msg = await bot.prompts.wait(ctx.message.channel, ctx.message.author, check=check, timeout=30)``
+
+    Pending prompts are indexed by channel and author, so each incoming message is matched with one dict lookup
+    instead of running every open prompt's check against it like :meth:`discord.Client.wait_for_message`.
+    Timeouts are deadlines on the bot's :class:`cogs.utils.scheduler.Scheduler`.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self._prompts = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return sum(len(prompts) for prompts in self._prompts.values())
+
+    async def wait(self, channel, author, check=None, timeout=None):
+        """
+        Wait for the next message from :attr:`author` in :attr:`channel` that passes :attr:`check`
+
+        timeout : Optional[float]
+            Seconds to wait before giving up
+
+        Returns the :class:`discord.Message`, or None if the time ran out
+        """
+        key = (channel.id, author.id)
+        prompt_id = next(self._counter)
+        prompt = (prompt_id, asyncio.Future(loop=self.bot.loop), check)
+        self._prompts.setdefault(key, []).append(prompt)
+        if timeout is not None:
+            self.bot.scheduler.schedule(timeout, ('prompt', prompt_id), self._expire, prompt[1])
+        try:
+            return await prompt[1]
+        finally:
+            self.bot.scheduler.cancel(('prompt', prompt_id))
+            prompts = self._prompts.get(key, [])
+            if prompt in prompts:
+                prompts.remove(prompt)
+            if not prompts:
+                self._prompts.pop(key, None)
+
+    def _expire(self, future):
+        if not future.done():
+            future.set_result(None)
+
+    def dispatch(self, message):
+        """
+        Hand :attr:`message` to every prompt waiting on its author in its channel whose check it passes
+
+        Returns True if any prompt took the message
+        """
+        prompts = self._prompts.get((message.channel.id, message.author.id))
+        if not prompts:
+            return False
+        answered = False
+        for prompt_id, future, check in prompts:
+            if future.done():
+                continue
+            try:
+                passed = check is None or check(message)
+            except Exception:
+                passed = False
+            if passed:
+                future.set_result(message)
+                answered = True
+        return answered
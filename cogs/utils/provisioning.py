@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+
+import discord
+
+from .permissions import edit_channel
+
+
+log = logging.getLogger(__name__)
+
+
+class ChannelProvisioner:
+    """
+    Sets up channels with every permission overwrite they need in one request
+
+    bot : Required[obj]
+        The bot instance that is currently running
+
+    The complete overwrite set (everyone, the bot and each member) is sent with the request that creates or edits the channel,
+    instead of calling :meth:`discord.Client.edit_channel_permissions` once per member afterwards.
+    The overwrites Discord sends back are checked, and only the ones missing from them are applied one at a time.
+    Every call is timed, see :meth:`stats`.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.calls = 0
+        self.requests = 0
+        self.repaired = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+        self._lock = threading.Lock()
+
+    async def create(self, server, name, overwrites):
+        """
+        Create a text channel with all of :attr:`overwrites`
+
+        overwrites : Required[list]
+            ``(target, PermissionOverwrite)`` pairs, the ones for roles are treated as required
+
+        If Discord rejects the request, for example because a member has just left, the channel is created with only the
+        role and bot overwrites and the members are added afterwards.
+
+        Returns the :class:`discord.Channel`
+        """
+        start = time.monotonic()
+        requests = 1
+        try:
+            channel = await self.bot.create_channel(server, name, *overwrites)
+        except discord.Forbidden:
+            raise
+        except discord.HTTPException:
+            required = [(target, overwrite) for target, overwrite in overwrites if isinstance(target, discord.Role) or target == server.me]
+            channel = await self.bot.create_channel(server, name, *required)
+            requests += 1
+        applied = set(target.id for target, overwrite in channel.overwrites)
+        requests += await self.repair(channel, overwrites, applied)
+        self.record(start, requests, 'Created channel {} on server {}'.format(channel.id, server.id))
+        return channel
+
+    async def apply(self, channel, overwrites, **fields):
+        """
+        Replace all of a channel's overwrites with :attr:`overwrites`, changing any :attr:`fields` in the same request
+        """
+        start = time.monotonic()
+        data = await edit_channel(self.bot, channel, overwrites=overwrites, **fields)
+        applied = set(overwrite['id'] for overwrite in (data or {}).get('permission_overwrites', ()))
+        requests = 1 + await self.repair(channel, overwrites, applied)
+        self.record(start, requests, 'Edited channel {}'.format(channel.id))
+
+    async def repair(self, channel, overwrites, applied):
+        """
+        Apply the overwrites whose targets aren't in :attr:`applied` one at a time
+
+        Returns the number of requests made
+        """
+        requests = 0
+        for target, overwrite in overwrites:
+            if target.id in applied:
+                continue
+            requests += 1
+            try:
+                await self.bot.edit_channel_permissions(channel, target, overwrite)
+            except discord.HTTPException as e:
+                log.warning('Could not apply overwrite for {} on channel {}: {}'.format(target.id, channel.id, e))
+                with self._lock:
+                    self.failed += 1
+            else:
+                with self._lock:
+                    self.repaired += 1
+        return requests
+
+    def record(self, start, requests, description):
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.calls += 1
+            self.requests += requests
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            self.last_time = elapsed
+        log.info('{} in {:.3f}s with {} request(s)'.format(description, elapsed, requests))
+
+    def stats(self):
+        """
+        Returns a dict of call and request counts and how long calls took
+        """
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'requests': self.requests,
+                'repaired': self.repaired,
+                'failed': self.failed,
+                'average_time': (self.total_time / self.calls) if self.calls else 0.0,
+                'max_time': self.max_time,
+                'last_time': self.last_time,
+            }
@@ -0,0 +1,149 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import traceback
+
+
+def utcnow():
+    """
+    Returns the current time as a timezone aware UTC datetime
+    """
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class Scheduler:
+    """
+    Runs callbacks when their deadline is reached
+
+    loop : Required[obj]
+        The event loop to run callbacks on
+
+    Deadlines are kept in a min-heap, and the scheduler sleeps until the earliest one is due.
+    Scheduling something earlier than everything else wakes it up early.
+    Every deadline has a key, and scheduling the same key again replaces the old deadline.
+    :meth:`schedule` and :meth:`cancel` can be called from any thread.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event(loop=loop)
+        self._runner = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self):
+        if self._runner is None or self._runner.done():
+            self._runner = self.loop.create_task(self.run())
+
+    def stop(self):
+        if self._runner is not None:
+            try:
+                self._runner.cancel()
+            except RuntimeError:
+                # The loop has already been closed
+                pass
+            self._runner = None
+
+    def schedule(self, when, key, callback, *args):
+        """
+        Call :attr:`callback` with :attr:`args` at :attr:`when`
+
+        when : Required[datetime]
+            A timezone aware datetime or a number of seconds from now
+        key : Required[hashable]
+            Identifies this deadline so it can be replaced or cancelled
+        callback : Required[callable]
+            A function or coroutine function
+        """
+        if not isinstance(when, datetime.datetime):
+            when = utcnow() + datetime.timedelta(seconds=when)
+        self._call(self._push, when, key, callback, args)
+
+    def cancel(self, key):
+        """
+        Cancel the deadline for :attr:`key` if there is one
+        """
+        self._call(self._remove, key)
+
+    def clear(self):
+        """
+        Cancel every deadline
+        """
+        self._call(self._clear)
+
+    def next_deadline(self):
+        """
+        Returns the datetime of the next deadline or None
+        """
+        self._discard_cancelled()
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def _call(self, func, *args):
+        try:
+            self.loop.call_soon_threadsafe(func, *args)
+        except RuntimeError:
+            # The loop has already been closed
+            pass
+
+    def _push(self, when, key, callback, args):
+        self._remove(key)
+        entry = [when, next(self._counter), key, callback, args, True]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[-1] = False
+
+    def _clear(self):
+        self._entries.clear()
+        self._heap = []
+        self._wakeup.set()
+
+    def _discard_cancelled(self):
+        while self._heap and not self._heap[0][-1]:
+            heapq.heappop(self._heap)
+
+    async def run(self):
+        try:
+            while True:
+                self._wakeup.clear()
+                self._discard_cancelled()
+                timeout = None
+                if self._heap:
+                    when, _, key, callback, args, active = self._heap[0]
+                    timeout = (when - utcnow()).total_seconds()
+                    if timeout <= 0:
+                        heapq.heappop(self._heap)
+                        del self._entries[key]
+                        self._dispatch(callback, args)
+                        continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout, loop=self.loop)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            pass
+
+    def _dispatch(self, callback, args):
+        try:
+            result = callback(*args)
+            if asyncio.iscoroutine(result):
+                self.loop.create_task(self._wrap(result))
+        except Exception:
+            traceback.print_exc()
+
+    async def _wrap(self, coro):
+        try:
+            await coro
+        except Exception:
+            traceback.print_exc()
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from gaming.models import *
+from gaming import search as message_search
 
 
 class DiscordUserHistoryInline(admin.TabularInline):
@@ -118,7 +119,7 @@ class GameSearchAdmin(admin.ModelAdmin):
     cancel_searches.short_description = 'Cancel selected Game Searches'
 
     fieldsets = [
-        (None, {'fields': ['user', 'game', 'created_date', 'expire_date', 'cancelled',]}),
+        (None, {'fields': ['user', 'game', 'server', 'created_date', 'expire_date', 'cancelled',]}),
     ]
 
     date_hierarchy = 'created_date'
@@ -154,11 +155,11 @@ class ChannelAdmin(admin.ModelAdmin):
     get_display_name.short_description = 'Display Name'
 
     fieldsets = [
-        (None, {'fields': ['name', 'channel_id', 'server', 'user', 'game', 'created_date', 'expire_date', 'private', 'deleted', 'game_channel','warning_sent',]}),
+        (None, {'fields': ['name', 'channel_id', 'server', 'user', 'game', 'created_date', 'expire_date', 'private', 'deleted', 'game_channel','warning_sent', 'pooled',]}),
     ]
 
     date_hierarchy = 'created_date'
-    list_display = ('get_display_name', 'server', 'user', 'game', 'created_date', 'expire_date', 'private', 'deleted', 'game_channel')
+    list_display = ('get_display_name', 'server', 'user', 'game', 'created_date', 'expire_date', 'private', 'deleted', 'game_channel', 'pooled')
     list_display_links = ('get_display_name',)
     search_fields = ('name', 'channel_id', 'user__name', 'user__user_id', 'server__server_id', 'server__name', 'game__name', 'game__url',)
     ordering = ('deleted', 'private', '-created_date', '-expire_date', 'name', 'channel_id')
@@ -233,6 +234,17 @@ class MessageAdmin(admin.ModelAdmin):
     list_display_links = ('get_display_name',)
     search_fields = ['server__server_id', 'server__name', 'channel__channel_id', 'channel__name', 'user__user_id', 'user__name', 'content', 'message_id']
     ordering = ['-timestamp']
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search content with the full-text index, or look up a message by its ID, falling back to :attr:`search_fields` without an index
+        """
+        match = message_search.match_sql(search_term)
+        if match is None:
+            return super(MessageAdmin, self).get_search_results(request, queryset, search_term)
+        sql, params = match
+        queryset = queryset.extra(where=['({} OR gaming_message.message_id = %s)'.format(sql)], params=params + [search_term.strip()])
+        return queryset, False
     fieldsets = [
         (None, {'fields': ['timestamp', 'message_id', 'server', 'channel', 'user', 'parent', 'deleted', 'content', 'attachments',]}),
     ]
@@ -0,0 +1,173 @@
+import csv
+import datetime
+import json
+import zlib
+from collections import defaultdict
+
+from django.db.models import Q
+from django.utils import dateparse, timezone
+
+from gaming.models import Message
+
+
+# Messages read from the database per query while exporting
+EXPORT_CHUNK_SIZE = 1000
+
+# Bytes of output gathered before they are compressed and handed on
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+FIELDS = ['message_id', 'timestamp', 'channel_id', 'channel_name', 'user_id', 'user_name', 'content', 'edit_of', 'deleted', 'attachments']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def parse_time(value):
+    """
+    Returns an aware datetime for an ISO 8601 date or date and time, taken as UTC if no offset is given
+
+    Raises ValueError if :attr:`value` is neither
+    """
+    when = dateparse.parse_datetime(value)
+    if when is None:
+        day = dateparse.parse_date(value)
+        if day is None:
+            raise ValueError('{} is not a date or a date and time'.format(value))
+        when = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when, datetime.timezone.utc)
+    return when
+
+
+def iter_messages(server, *, start=None, end=None, channel_ids=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields a dict of every :class:`gaming.models.Message` on :attr:`server`, oldest first
+
+    start : Optional[datetime]
+        Only messages sent at or after this time
+    end : Optional[datetime]
+        Only messages sent before this time
+    channel_ids : Optional[list]
+        Only messages sent in these Discord channels
+
+    The messages are read :attr:`chunk_size` at a time, each chunk starting after the (timestamp, id) the last one ended on,
+    so no query gets slower the further in it is and only one chunk is held at a time.
+    The attachments of a chunk are fetched with one more query.
+    """
+    queryset = Message.objects.filter(server=server)
+    if start is not None:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end is not None:
+        queryset = queryset.filter(timestamp__lt=end)
+    if channel_ids:
+        queryset = queryset.filter(channel__channel_id__in=channel_ids)
+    queryset = queryset.order_by('timestamp', 'pk').values_list(
+        'pk', 'message_id', 'timestamp', 'channel__channel_id', 'channel__name', 'user__user_id', 'user__name', 'content', 'parent__message_id', 'deleted')
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None:
+            when, pk = last
+            chunk = chunk.filter(Q(timestamp__gt=when) | Q(timestamp=when, pk__gt=pk))
+        rows = list(chunk[:chunk_size].iterator())
+        if not rows:
+            return
+        attachments = defaultdict(list)
+        through = Message.attachments.through.objects.filter(message_id__in=[row[0] for row in rows]).order_by('pk')
+        for message_pk, url in through.values_list('message_id', 'attachment__url').iterator():
+            attachments[message_pk].append(url)
+        for pk, message_id, when, channel_id, channel_name, user_id, user_name, content, edit_of, deleted in rows:
+            yield {
+                'message_id': message_id,
+                'timestamp': when.isoformat(),
+                'channel_id': channel_id,
+                'channel_name': channel_name,
+                'user_id': user_id,
+                'user_name': user_name,
+                'content': content,
+                'edit_of': edit_of,
+                'deleted': deleted,
+                'attachments': attachments.get(pk, []),
+            }
+        if len(rows) < chunk_size:
+            return
+        last = (rows[-1][2], rows[-1][0])
+
+
+class Echo:
+    """
+    A file-like object that hands back what is written to it, so :mod:`csv` can format one row at a time
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(records):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for record in records:
+        row = dict(record, attachments=' '.join(record['attachments']))
+        yield writer.writerow([row[field] for field in FIELDS])
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+FORMATS = {
+    'csv': csv_lines,
+    'jsonl': jsonl_lines,
+}
+
+
+def buffered(lines, size=EXPORT_BUFFER_SIZE):
+    """
+    Yields :attr:`lines` encoded as UTF-8 and joined into blocks of about :attr:`size` bytes
+    """
+    block = []
+    length = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        block.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(block)
+            block = []
+            length = 0
+    if block:
+        yield b''.join(block)
+
+
+def gzipped(blocks):
+    """
+    Yields :attr:`blocks` compressed as a single gzip stream
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_messages(server, export_format='csv', *, start=None, end=None, channel_ids=None, compress=False):
+    """
+    Returns an iterator of the bytes of :attr:`server`'s messages as CSV or JSON Lines, see :func:`iter_messages`
+
+    export_format : Optional[str]
+        ``'csv'`` or ``'jsonl'``
+    compress : Optional[bool]
+        Whether to gzip the output as it is made
+
+    Raises ValueError for an unknown format
+    """
+    if export_format not in FORMATS:
+        raise ValueError('Unknown export format {}, expected one of {}'.format(export_format, ', '.join(sorted(FORMATS))))
+    records = iter_messages(server, start=start, end=end, channel_ids=channel_ids)
+    blocks = buffered(FORMATS[export_format](records))
+    if compress:
+        blocks = gzipped(blocks)
+    return blocks
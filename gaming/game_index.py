@@ -0,0 +1,214 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from gaming.models import Game
+
+
+# Seconds before the index is reloaded, to pick up Games changed by another process (ex: the webapp)
+RELOAD_INTERVAL = 600
+
+# The lowest trigram similarity, from 0 to 1, for a Game to count as a typo match
+MIN_SIMILARITY = 0.3
+
+# The most typo matches to return
+MAX_FUZZY_MATCHES = 10
+
+
+def normalize(name):
+    """
+    Returns :attr:`name` lower cased, without accents, with anything but letters and numbers turned into single spaces
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(re.split(r'[\W_]+', name.lower())).strip()
+
+
+def trigrams(name):
+    """
+    Returns the set of three character pieces of a normalized :attr:`name`, with each word padded like ``pg_trgm``
+    """
+    grams = set()
+    for word in name.split():
+        padded = '  {} '.format(word)
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrieNode:
+    __slots__ = ('children', 'pks')
+
+    def __init__(self):
+        self.children = {}
+        self.pks = set()
+
+
+class GameNameIndex:
+    """
+    Finds :class:`gaming.models.Game` primary keys by name without querying the database
+
+    Every word of a Game's normalized name is put in a prefix trie, and every trigram in an inverted index.
+    The index is loaded on first use with a single query and then kept current by the Game receivers in :mod:`gaming.signals`.
+    """
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self.loaded_at = None
+        self._names = {}
+        self._gram_counts = {}
+        self._exact = defaultdict(set)
+        self._trie = TrieNode()
+        self._trigrams = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def _load(self):
+        games = list(Game.objects.values_list('pk', 'name'))
+        with self._lock:
+            self._names = {}
+            self._gram_counts = {}
+            self._exact = defaultdict(set)
+            self._trie = TrieNode()
+            self._trigrams = defaultdict(set)
+            for pk, name in games:
+                self._add(pk, name)
+            self.loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.reload_interval:
+            self._load()
+
+    def _add(self, pk, name):
+        name = normalize(name or '')
+        self._names[pk] = name
+        self._exact[name].add(pk)
+        for word in set(name.split()):
+            node = self._trie
+            for c in word:
+                node = node.children.setdefault(c, TrieNode())
+            node.pks.add(pk)
+        grams = trigrams(name)
+        self._gram_counts[pk] = len(grams)
+        for gram in grams:
+            self._trigrams[gram].add(pk)
+
+    def _remove(self, pk):
+        name = self._names.pop(pk, None)
+        if name is None:
+            return
+        del self._gram_counts[pk]
+        self._exact[name].discard(pk)
+        if not self._exact[name]:
+            del self._exact[name]
+        for word in set(name.split()):
+            path = [self._trie]
+            for c in word:
+                path.append(path[-1].children[c])
+            path[-1].pks.discard(pk)
+            # Prune the nodes that no longer lead anywhere
+            for parent, c in zip(reversed(path[:-1]), reversed(word)):
+                node = parent.children[c]
+                if node.pks or node.children:
+                    break
+                del parent.children[c]
+        for gram in trigrams(name):
+            self._trigrams[gram].discard(pk)
+            if not self._trigrams[gram]:
+                del self._trigrams[gram]
+
+    def add(self, game):
+        """
+        Index a saved Game, replacing its old name if it was renamed
+        """
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            self._remove(game.pk)
+            self._add(game.pk, game.name)
+
+    def discard(self, pk):
+        """
+        Remove the Game with primary key :attr:`pk`
+        """
+        with self._lock:
+            if self.loaded_at is not None:
+                self._remove(pk)
+
+    def clear(self):
+        """
+        Forget everything so it is reloaded on next use
+        """
+        with self._lock:
+            self.loaded_at = None
+
+    def _prefixed(self, prefix):
+        node = self._trie
+        for c in prefix:
+            node = node.children.get(c)
+            if node is None:
+                return set()
+        pks = set()
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            pks.update(node.pks)
+            nodes.extend(node.children.values())
+        return pks
+
+    def _containing(self, query):
+        # Every name containing the query must have these trigrams, so only names in all of their postings are checked
+        words = query.split()
+        grams = set()
+        for i, word in enumerate(words):
+            padded = '{}{}{}'.format('  ' if i > 0 else '', word, ' ' if i < len(words) - 1 else '')
+            grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+        if not grams:
+            # Too short to have any, so only match the start of words
+            return self._prefixed(query)
+        postings = sorted((self._trigrams.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+        return [pk for pk in candidates if query in self._names[pk]]
+
+    def _similar(self, query, max_fuzzy, min_similarity):
+        query_grams = trigrams(query)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for pk in self._trigrams.get(gram, ()):
+                shared[pk] += 1
+        scored = []
+        for pk, count in shared.items():
+            score = count / (len(query_grams) + self._gram_counts[pk] - count)
+            if score >= min_similarity:
+                scored.append((-score, len(self._names[pk]), pk))
+        return [pk for score, length, pk in sorted(scored)[:max_fuzzy]]
+
+    def search(self, query, max_fuzzy=MAX_FUZZY_MATCHES, min_similarity=MIN_SIMILARITY):
+        """
+        Returns a list of Game primary keys matching :attr:`query`, best match first
+
+        - An exact match on the normalized name is returned on its own
+        - Otherwise every name containing the query, names starting with it first
+        - Otherwise up to :attr:`max_fuzzy` names at least :attr:`min_similarity` alike, to allow for typos
+
+        Queries shorter than three characters only match the start of words
+        """
+        query = normalize(query or '')
+        if not query:
+            return []
+        self._ensure_loaded()
+        with self._lock:
+            exact = self._exact.get(query)
+            if exact:
+                return sorted(exact)
+            contains = self._containing(query)
+            if contains:
+                return sorted(contains, key=lambda pk: (not self._names[pk].startswith(query), len(self._names[pk]), pk))
+            return self._similar(query, max_fuzzy, min_similarity)
+
+
+game_index = GameNameIndex()
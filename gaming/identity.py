@@ -0,0 +1,197 @@
+import copy
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from gaming.models import Server, Channel, DiscordUser, ServerUser
+
+
+DEFAULT_MAX_SIZE = 10000
+
+
+def copy_instance(instance, snapshot_fields=False, update_fields=None):
+    """
+    Returns a copy of a model instance that can be changed and saved without touching the original
+
+    Related instances it has cached are still shared.
+    If :attr:`snapshot_fields` is True, the copy's change tracking snapshot is taken from its current values,
+    limited to :attr:`update_fields` if given.
+    """
+    clone = copy.copy(instance)
+    clone._state = copy.copy(instance._state)
+    if getattr(instance, '_loaded_values', None) is not None:
+        clone._loaded_values = dict(instance._loaded_values)
+    if snapshot_fields and hasattr(clone, 'snapshot_fields'):
+        clone.snapshot_fields(update_fields)
+    return clone
+
+
+class IdentityMap:
+    """
+    A bounded, least recently used map of model instances keyed by their Discord snowflake
+
+    name : Required[str]
+        A name used when reporting stats for this map
+    max_size : Optional[int]
+        The maximum number of instances to hold before the least recently used one is evicted
+
+    Entries are filled on a miss and kept current by the receivers in :mod:`gaming.signals`.
+    Every caller gets its own copy of the stored instance, since callers on different database pool threads
+    change and save what they are given at the same time.
+    """
+    def __init__(self, name, max_size=DEFAULT_MAX_SIZE):
+        self.name = name
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._keys_by_pk = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, loader):
+        """
+        Returns the instance stored for :attr:`key`, calling :attr:`loader` to fetch it on a miss
+
+        If :attr:`loader` raises, nothing is stored and the exception is passed along
+        """
+        with self._lock:
+            instance = self._items.get(key)
+            if instance is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return copy_instance(instance)
+            self.misses += 1
+        instance = loader()
+        if instance is not None:
+            self.set(key, instance)
+        return instance
+
+    def set(self, key, instance):
+        """
+        Stores a copy of :attr:`instance` under :attr:`key`, evicting the least recently used entry if full
+        """
+        instance = copy_instance(instance)
+        with self._lock:
+            self._items[key] = instance
+            self._items.move_to_end(key)
+            self._keys_by_pk[instance.pk] = key
+            while len(self._items) > self.max_size:
+                old_key, old_instance = self._items.popitem(last=False)
+                self._keys_by_pk.pop(old_instance.pk, None)
+                self.evictions += 1
+
+    def refresh(self, instance, update_fields=None):
+        """
+        Replaces the stored copy of :attr:`instance` if one is being held
+
+        Called from ``post_save``, before the instance has snapshotted what it just wrote, so the copy snapshots
+        :attr:`update_fields` (or every field) itself
+        """
+        with self._lock:
+            key = self._keys_by_pk.get(instance.pk)
+            if key is not None and key in self._items:
+                self._items[key] = copy_instance(instance, snapshot_fields=True, update_fields=update_fields)
+
+    def discard(self, pk):
+        """
+        Removes the instance with the primary key :attr:`pk` if one is being held
+        """
+        with self._lock:
+            key = self._keys_by_pk.pop(pk, None)
+            if key is not None:
+                self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._keys_by_pk.clear()
+
+    def stats(self):
+        """
+        Returns a dict of size, hits, misses, evictions and hit rate for this map
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+max_size = getattr(settings, 'IDENTITY_CACHE_SIZE', DEFAULT_MAX_SIZE)
+
+servers = IdentityMap('Server', max_size=max_size)
+channels = IdentityMap('Channel', max_size=max_size)
+users = IdentityMap('DiscordUser', max_size=max_size)
+server_users = IdentityMap('ServerUser', max_size=max_size)
+
+identity_maps = {
+    Server: servers,
+    Channel: channels,
+    DiscordUser: users,
+    ServerUser: server_users,
+}
+
+
+def get_server(server_id, create=True):
+    """
+    Returns the :class:`gaming.models.Server` for :attr:`server_id`, creating it if :attr:`create` is True
+    """
+    if create:
+        loader = lambda: Server.objects.get_or_create(server_id=server_id)[0]
+    else:
+        loader = lambda: Server.objects.get(server_id=server_id)
+    return servers.get(server_id, loader)
+
+
+def get_channel(channel_id, server, create=True):
+    """
+    Returns the :class:`gaming.models.Channel` for :attr:`channel_id` on :attr:`server`, creating it if :attr:`create` is True
+    """
+    if create:
+        loader = lambda: Channel.objects.get_or_create(channel_id=channel_id, server=server)[0]
+    else:
+        loader = lambda: Channel.objects.get(channel_id=channel_id, server=server)
+    return channels.get(channel_id, loader)
+
+
+def get_user(user_id, create=True):
+    """
+    Returns the :class:`gaming.models.DiscordUser` for :attr:`user_id`, creating it if :attr:`create` is True
+    """
+    if create:
+        loader = lambda: DiscordUser.objects.get_or_create(user_id=user_id)[0]
+    else:
+        loader = lambda: DiscordUser.objects.get(user_id=user_id)
+    return users.get(user_id, loader)
+
+
+def get_server_user(user, server, create=True):
+    """
+    Returns the :class:`gaming.models.ServerUser` for :attr:`user` and :attr:`server`, creating it if :attr:`create` is True
+    """
+    if create:
+        loader = lambda: ServerUser.objects.get_or_create(user=user, server=server)[0]
+    else:
+        loader = lambda: ServerUser.objects.get(user=user, server=server)
+    return server_users.get((user.user_id, server.server_id), loader)
+
+
+def stats():
+    """
+    Returns a list of stats for every identity map
+    """
+    return [identity_map.stats() for identity_map in identity_maps.values()]
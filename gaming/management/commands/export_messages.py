@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gaming.export import FORMATS, export_messages, parse_time
+from gaming.models import Server
+
+
+class Command(BaseCommand):
+    help = "Streams a server's logged messages as CSV or JSON Lines, see gaming.export"
+
+    def add_arguments(self, parser):
+        parser.add_argument('server_id', help='The Discord ID of the server')
+        parser.add_argument('--format', dest='export_format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--start', help='Only messages sent at or after this ISO 8601 date or time (UTC unless given)')
+        parser.add_argument('--end', help='Only messages sent before this ISO 8601 date or time (UTC unless given)')
+        parser.add_argument('--channel', dest='channel_ids', action='append', default=[], help='Only messages in this channel ID, can be given more than once')
+        parser.add_argument('--gzip', dest='compress', action='store_true', help='Compress the output')
+        parser.add_argument('--output', help='The file to write to instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            server = Server.objects.get(server_id=options['server_id'])
+        except Server.DoesNotExist:
+            raise CommandError('Server {} does not exist'.format(options['server_id']))
+        try:
+            start = parse_time(options['start']) if options['start'] else None
+            end = parse_time(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        blocks = export_messages(server, options['export_format'], start=start, end=end, channel_ids=options['channel_ids'], compress=options['compress'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for block in blocks:
+                    output.write(block)
+        else:
+            output = getattr(self.stdout, 'buffer', None) or sys.stdout.buffer
+            for block in blocks:
+                output.write(block)
+            output.flush()
@@ -0,0 +1,114 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from gaming.models import ServerUser
+
+
+# Seconds before everything is reloaded, to pick up ServerUsers changed by another process (ex: the webapp)
+RELOAD_INTERVAL = 600
+
+
+class MembershipIndex:
+    """
+    Keeps the :class:`gaming.models.DiscordUser` primary keys of every server's members in a sorted array
+
+    The index is loaded on first use with a single query and then kept current by the ServerUser receivers
+    in :mod:`gaming.signals` and by :meth:`cogs.tasks.Tasks.sync_members`.
+    Checking a member is a binary search, so filtering a list of users to a server never goes back to the database.
+    """
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self.loaded_at = None
+        self._members = defaultdict(lambda: array('q'))
+        self._rows = Counter()
+        self._lock = threading.RLock()
+
+    def _load(self):
+        server_users = list(ServerUser.objects.values_list('server_id', 'user_id'))
+        with self._lock:
+            self._rows = Counter(server_users)
+            members = defaultdict(set)
+            for server_pk, user_pk in self._rows:
+                members[server_pk].add(user_pk)
+            self._members = defaultdict(lambda: array('q'))
+            for server_pk, user_pks in members.items():
+                self._members[server_pk] = array('q', sorted(user_pks))
+            self.loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.reload_interval:
+            self._load()
+
+    def add(self, user_pk, server_pk):
+        """
+        A User has joined a server
+        """
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            self._rows[(server_pk, user_pk)] += 1
+            if self._rows[(server_pk, user_pk)] > 1:
+                return
+            members = self._members[server_pk]
+            members.insert(bisect_left(members, user_pk), user_pk)
+
+    def remove(self, user_pk, server_pk):
+        """
+        A User has left a server
+        """
+        with self._lock:
+            if self.loaded_at is None or not self._rows[(server_pk, user_pk)]:
+                return
+            self._rows[(server_pk, user_pk)] -= 1
+            if self._rows[(server_pk, user_pk)]:
+                return
+            del self._rows[(server_pk, user_pk)]
+            members = self._members[server_pk]
+            index = bisect_left(members, user_pk)
+            if index < len(members) and members[index] == user_pk:
+                del members[index]
+
+    def clear(self):
+        """
+        Forget everything so it is reloaded on next use
+        """
+        with self._lock:
+            self.loaded_at = None
+
+    def count(self, server):
+        """
+        Returns the number of members of :attr:`server`
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return len(self._members.get(server.pk, ()))
+
+    def is_member(self, server, user_pk):
+        """
+        Returns True if the User with primary key :attr:`user_pk` is a member of :attr:`server`
+        """
+        self._ensure_loaded()
+        with self._lock:
+            members = self._members.get(server.pk, ())
+            index = bisect_left(members, user_pk)
+            return index < len(members) and members[index] == user_pk
+
+    def intersect(self, server, user_pks):
+        """
+        Returns a sorted list of only the primary keys in :attr:`user_pks` that belong to members of :attr:`server`
+        """
+        self._ensure_loaded()
+        with self._lock:
+            members = self._members.get(server.pk, ())
+            found = []
+            for user_pk in sorted(set(user_pks)):
+                index = bisect_left(members, user_pk)
+                if index < len(members) and members[index] == user_pk:
+                    found.append(user_pk)
+            return found
+
+
+membership = MembershipIndex()
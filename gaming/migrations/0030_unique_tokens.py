@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import gaming.models
+
+
+def deduplicate_tokens(apps, schema_editor):
+    """
+    Give every row that shares a token or ID with an earlier row a new one, so the unique indexes can be created
+    """
+    Log = apps.get_model('gaming', 'Log')
+    Quote = apps.get_model('gaming', 'Quote')
+    for model, field, generate in ((Log, 'message_token', gaming.models.default_message_token), (Quote, 'quote_id', gaming.models.default_quote_id)):
+        duplicates = model.objects.values(field).annotate(count=models.Count('pk')).filter(count__gt=1).exclude(**{'{}__isnull'.format(field): True})
+        for duplicate in duplicates:
+            rows = model.objects.filter(**{field: duplicate[field]}).order_by('pk')
+            for row in rows[1:]:
+                setattr(row, field, generate())
+                row.save(update_fields=[field])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gaming', '0029_discorduserhistory'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='log',
+            name='message_token',
+            field=models.CharField(blank=True, default=gaming.models.default_message_token, max_length=50, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='quote',
+            name='quote_id',
+            field=models.CharField(blank=True, default=gaming.models.default_quote_id, max_length=50, null=True, unique=True),
+        ),
+    ]
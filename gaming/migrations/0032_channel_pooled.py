@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gaming', '0031_gamesearch_server'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='pooled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
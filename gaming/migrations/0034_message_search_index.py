@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+# The FTS5 table only stores the index, the text is read from gaming_message and kept in step by the triggers.
+# Django remakes a table on SQLite to alter it, which drops its triggers, so a migration that does that to
+# gaming_message needs to create them again.
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE gaming_message_fts USING fts5(content, content='gaming_message', content_rowid='id')",
+    "INSERT INTO gaming_message_fts(gaming_message_fts) VALUES ('rebuild')",
+    """CREATE TRIGGER gaming_message_fts_insert AFTER INSERT ON gaming_message BEGIN
+        INSERT INTO gaming_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER gaming_message_fts_delete AFTER DELETE ON gaming_message BEGIN
+        INSERT INTO gaming_message_fts(gaming_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER gaming_message_fts_update AFTER UPDATE OF content ON gaming_message BEGIN
+        INSERT INTO gaming_message_fts(gaming_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO gaming_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS gaming_message_fts_insert",
+    "DROP TRIGGER IF EXISTS gaming_message_fts_delete",
+    "DROP TRIGGER IF EXISTS gaming_message_fts_update",
+    "DROP TABLE IF EXISTS gaming_message_fts",
+]
+
+# An index on the expression is used by any query with the same expression, and PostgreSQL keeps it current itself
+POSTGRESQL_CREATE = [
+    "CREATE INDEX gaming_message_content_search ON gaming_message USING GIN (to_tsvector('english', content))",
+]
+
+POSTGRESQL_DROP = [
+    "DROP INDEX IF EXISTS gaming_message_content_search",
+]
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(SQLITE_CREATE[0])
+        except OperationalError:
+            # This SQLite wasn't built with FTS5, searches fall back to matching with LIKE
+            return
+        for sql in SQLITE_CREATE[1:]:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        for sql in POSTGRESQL_CREATE:
+            schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQLITE_DROP:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        for sql in POSTGRESQL_DROP:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gaming', '0033_message_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,5 +1,4 @@
-import random
-import string
+import uuid
 
 from django.db import models
 from django.db.models.aggregates import Count
@@ -7,10 +6,91 @@ from django.utils import timezone
 from django.utils.functional import lazy
 from django.core.urlresolvers import reverse
 
-from gaming.utils import logify_exception_info
+from gaming.utils import generate_id, logify_exception_info
 
 
-class DiscordUser(models.Model):
+def default_quote_id():
+    """
+    Returns a new ID for a :class:`gaming.models.Quote`
+    """
+    return generate_id(16)
+
+
+def default_message_token():
+    """
+    Returns a new token for a :class:`gaming.models.Log`
+    """
+    return generate_id(50)
+
+
+class ChangeTrackingMixin:
+    """
+    Remembers the field values an instance was loaded or last saved with
+
+    Saving an instance with no changes does nothing, and saving one with changes only writes the changed columns
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot_fields()
+        return instance
+
+    def snapshot_fields(self, field_names=None):
+        """
+        Store the current field values to compare against on the next save
+
+        If :attr:`field_names` is given, only those fields are stored
+        """
+        if field_names is None or getattr(self, '_loaded_values', None) is None:
+            self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            if field_names is not None and field.name not in field_names and field.attname not in field_names:
+                continue
+            if field.attname in self.__dict__:
+                self._loaded_values[field.attname] = self.__dict__[field.attname]
+
+    def get_changed_fields(self):
+        """
+        Returns a dict of field name to (old_value, new_value) for every field that changed since the last snapshot
+
+        A field that was deferred when the instance was loaded has no snapshot, so once it has been set it counts as changed
+        with an old value of None. Returns None if there is no snapshot to compare against
+        """
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return None
+        changed = {}
+        for field in self._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            if field.attname not in loaded_values:
+                # Still deferred, reading it would load it from the database
+                if field.attname in self.__dict__:
+                    changed[field.name] = (None, self.__dict__[field.attname])
+                continue
+            old_value = loaded_values[field.attname]
+            new_value = getattr(self, field.attname)
+            if old_value != new_value:
+                changed[field.name] = (old_value, new_value)
+        return changed
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.snapshot_fields()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self.pk is not None and not kwargs.get('force_insert') and update_fields is None:
+            changed = self.get_changed_fields()
+            if changed is not None:
+                if not changed:
+                    return
+                kwargs['update_fields'] = list(changed.keys())
+        super().save(*args, **kwargs)
+        self.snapshot_fields(update_fields)
+
+
+class DiscordUser(ChangeTrackingMixin, models.Model):
     """
     Used to represent a User on Discord
 
@@ -35,17 +115,22 @@ class DiscordUser(models.Model):
         return display_name
 
     def save(self, *args, **kwargs):
-        if self.pk is not None:
-            original = DiscordUser.objects.get(pk=self.pk)
-            for field in self._meta.get_fields():
-                try:
-                    old_value = getattr(original, field.name)
-                    new_value = getattr(self, field.name)
-                    if old_value != new_value:
-                        DiscordUserHistory.objects.create(user=self, old_value=old_value, new_value=new_value, field_modified=field.name)
-                except Exception as e:
-                    pass
+        changed = self.get_changed_fields() if self.pk is not None else None
+        update_fields = kwargs.get('update_fields')
+        if changed and update_fields is not None:
+            changed = {name: values for name, values in changed.items() if name in update_fields}
         super().save(*args, **kwargs)
+        if changed:
+            DiscordUserHistory.objects.bulk_create(self.get_history(changed))
+
+    def get_history(self, changed):
+        """
+        Returns unsaved :class:`gaming.models.DiscordUserHistory` objects for the output of :meth:`get_changed_fields`
+        """
+        return [
+            DiscordUserHistory(user=self, old_value='' if old_value is None else old_value, new_value='' if new_value is None else new_value, field_modified=field_name)
+            for field_name, (old_value, new_value) in changed.items()
+        ]
 
     def get_icon(self):
         """
@@ -132,7 +217,7 @@ class GameUser(models.Model):
         verbose_name_plural = "Game Users"
 
 
-class Server(models.Model):
+class Server(ChangeTrackingMixin, models.Model):
     """
     Represents a Server/Guild on DiscordUser
 
@@ -212,6 +297,8 @@ class Channel(models.Model):
         If the Channel is a associated with a Game
     warning_sent = Option[bool]
         This is used if the Channel is a Game Channel and is a place to store whether or not a warning was sent stating the Channel is going to be deleted soon
+    pooled = Optional[bool]
+        If the Channel is a hidden Game Channel waiting to be given to the next group (see :class:`cogs.utils.channel_pool.ChannelPool`)
     """
     server = models.ForeignKey('Server')
     user = models.ForeignKey('DiscordUser', blank=True, null=True)
@@ -224,6 +311,7 @@ class Channel(models.Model):
     deleted = models.BooleanField(default=False)
     game_channel = models.BooleanField(default=False)
     warning_sent = models.BooleanField(default=False)
+    pooled = models.BooleanField(default=False)
 
     def __str__(self):
         return '{} ({})'.format(self.name, self.channel_id)
@@ -295,6 +383,12 @@ class Message(models.Model):
     def __str__(self):
         return '{} - {} - {} - {}'.format(self.timestamp, self.user, self.channel, self.server)
 
+    class Meta:
+        # Pages of a server's messages are found by (timestamp, id), see :func:`gaming.utils.keyset_page`
+        index_together = [
+            ['server', 'timestamp', 'id'],
+        ]
+
 
 class Attachment(models.Model):
     """
@@ -332,6 +426,8 @@ class GameSearch(models.Model):
         The User searching for a Game
     game : Required[:class:`gaming.models.Game`]
         The Game the User is searching for
+    server : Optional[:class:`gaming.models.Server`]
+        The Server the Search was started on, only Users on the same Server are grouped together
     created_date : Optional[timestamp]
         When the Search was started
     expire_date : Optional[timestamp]
@@ -343,7 +439,7 @@ class GameSearch(models.Model):
     """
     user = models.ForeignKey('DiscordUser')
     game = models.ForeignKey('Game')
-    # server = models.ForeignKey('Server')
+    server = models.ForeignKey('Server', blank=True, null=True)
     created_date = models.DateTimeField(default=timezone.now)
     expire_date = models.DateTimeField(default=timezone.now)
     cancelled = models.BooleanField(default=False)
@@ -398,7 +494,7 @@ class Quote(models.Model):
     timestamp : Required[timestamp]
         When the Quote was created
     """
-    quote_id = models.CharField(blank=True, null=True, max_length=50)
+    quote_id = models.CharField(blank=True, null=True, max_length=50, unique=True, default=default_quote_id)
     user = models.ForeignKey('DiscordUser')
     server = models.ForeignKey('Server')
     added_by = models.ForeignKey('DiscordUser', related_name='added_by')
@@ -428,22 +524,26 @@ class Quote(models.Model):
             return False
 
     def generate_id(self):
-        quote_id = random_key(10)
-        if self.__class__.objects.filter(quote_id=quote_id).count() >= 1:
-            quote_id = self.generate_id()
-        return quote_id
+        return default_quote_id()
 
     @classmethod
     def random_quote(cls, server=None):
         """
-        Returns a random quote
+        Returns a random quote, only from :attr:`server` if one is given
+
+        Returns None if there are no quotes
         """
-        quotes = cls.objects.all()
-        if server is not None:
-            quotes.filter(server=server)
-        count = quotes.count()
-        random_index = random.randint(0, count - 1)
-        return quotes[random_index]
+        from gaming.quote_index import quote_index
+        for attempt in range(3):
+            pk = quote_index.random_pk(server)
+            if pk is None:
+                return None
+            try:
+                return cls.objects.select_related('user').get(pk=pk)
+            except cls.DoesNotExist:
+                # Deleted by another process since the index was loaded
+                quote_index.discard(pk)
+        return None
 
     class Meta:
         verbose_name = "Quote"
@@ -526,7 +626,7 @@ class Log(models.Model):
         the body of the email if one is to be sent out. If nothing is specified, a generic one will be generated.
     """
     timestamp = models.DateTimeField(default=timezone.now)
-    message_token = models.CharField(blank=True, null=True, max_length=50)
+    message_token = models.CharField(blank=True, null=True, max_length=50, unique=True, default=default_message_token)
     message = models.TextField(default="")
     email = models.BooleanField(default=False)
     subject = models.CharField(max_length=4000, blank=True, null=True, default=None)
@@ -551,28 +651,12 @@ class Log(models.Model):
             return True
         except Exception as e:
             print(e)
-            self.__class__.objects.create(message="{}\nError generating log token.\n\nException:\n{}".format(logify_exception_info(), e), message_token="ERROR_GENERATING_LOG_TOKEN")
+            self.__class__.objects.create(message="{}\nError generating log token.\n\nException:\n{}".format(logify_exception_info(), e), message_token="ERROR_GENERATING_LOG_TOKEN_{}".format(uuid.uuid4().hex[:16]))
             return False
 
-    def random_key(self, length=50):
-        key = ''
-        for i in range(length):
-            key += random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits)
-        return key
-
     def generate_token(self):
-        token_key = random_key()
-        if self.__class__.objects.filter(message_token=token_key).count() >= 1:
-            token_key = self.generate_token()
-        return token_key
+        return default_message_token()
 
     class Meta:
         verbose_name = 'Log'
         verbose_name_plural = 'Logs'
-
-
-def random_key(length=50):
-    key = ''
-    for i in range(length):
-        key += random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits)
-    return key
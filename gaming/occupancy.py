@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+
+from gaming.models import Channel, ChannelUser
+
+
+# Seconds before everything is reloaded, to pick up Channels changed by another process (ex: the webapp)
+RELOAD_INTERVAL = 600
+
+
+class ChannelOccupancy:
+    """
+    Counts the Users in every open game :class:`gaming.models.Channel` and indexes the ones with free slots
+
+    capacity : Optional[int]
+        The most Users a game channel holds
+
+    Open channels are grouped by server and game, then by how many slots they have left,
+    so finding one to join looks at no more than :attr:`capacity` buckets.
+    Everything is loaded on first use and then kept current by the Channel and ChannelUser receivers in :mod:`gaming.signals`.
+    """
+    def __init__(self, capacity=None, reload_interval=RELOAD_INTERVAL):
+        self.capacity = capacity or getattr(settings, 'MATCHMAKING_PARTY_SIZE', 5)
+        self.reload_interval = reload_interval
+        self.loaded_at = None
+        self._channels = {}
+        self._channel_pks = {}
+        self._users = {}
+        self._open = {}
+        self._lock = threading.RLock()
+
+    def _load(self):
+        channels = list(Channel.objects.filter(game_channel=True, private=False, deleted=False, pooled=False).values_list('pk', 'channel_id', 'server_id', 'game_id', 'expire_date'))
+        channel_users = list(ChannelUser.objects.filter(channel__game_channel=True, channel__private=False, channel__deleted=False, channel__pooled=False).values_list('channel_id', 'user_id'))
+        with self._lock:
+            self._channels = {}
+            self._channel_pks = {}
+            self._users = {}
+            self._open = {}
+            for pk, channel_id, server_pk, game_pk, expire_date in channels:
+                self._channels[pk] = (channel_id, server_pk, game_pk, expire_date)
+                self._channel_pks[channel_id] = pk
+                self._users[pk] = set()
+            for channel_pk, user_pk in channel_users:
+                if channel_pk in self._users:
+                    self._users[channel_pk].add(user_pk)
+            for pk in self._channels:
+                self._index(pk)
+            self.loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.reload_interval:
+            self._load()
+
+    def _free(self, pk):
+        return self.capacity - len(self._users[pk])
+
+    def _index(self, pk):
+        channel_id, server_pk, game_pk, expire_date = self._channels[pk]
+        free = self._free(pk)
+        if free > 0:
+            buckets = self._open.setdefault((server_pk, game_pk), {})
+            buckets.setdefault(free, OrderedDict())[pk] = None
+
+    def _unindex(self, pk):
+        channel_id, server_pk, game_pk, expire_date = self._channels[pk]
+        buckets = self._open.get((server_pk, game_pk))
+        free = self._free(pk)
+        if buckets is None or free not in buckets:
+            return
+        buckets[free].pop(pk, None)
+        if not buckets[free]:
+            del buckets[free]
+        if not buckets:
+            del self._open[(server_pk, game_pk)]
+
+    def add_channel(self, channel, created=False):
+        """
+        Track a saved Channel if it is an open game channel, or stop tracking it if it no longer is
+        """
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            users = self._users.get(channel.pk)
+            self.discard(channel.pk)
+            if not channel.game_channel or channel.private or channel.deleted or channel.pooled:
+                return
+            self._channels[channel.pk] = (channel.channel_id, channel.server_id, channel.game_id, channel.expire_date)
+            self._channel_pks[channel.channel_id] = channel.pk
+            self._users[channel.pk] = users or set()
+            self._index(channel.pk)
+        if users is None and not created:
+            # It wasn't being tracked before, so read back who is already in it
+            for user_pk in ChannelUser.objects.filter(channel=channel).values_list('user_id', flat=True):
+                self.add_user(channel.pk, user_pk)
+
+    def discard(self, pk):
+        """
+        Stop tracking the Channel with primary key :attr:`pk`
+        """
+        with self._lock:
+            if pk not in self._channels:
+                return
+            self._unindex(pk)
+            channel_id = self._channels.pop(pk)[0]
+            self._channel_pks.pop(channel_id, None)
+            del self._users[pk]
+
+    def add_user(self, channel_pk, user_pk):
+        """
+        A User has been let into a game channel
+        """
+        with self._lock:
+            users = self._users.get(channel_pk)
+            if users is None or user_pk in users:
+                return
+            self._unindex(channel_pk)
+            users.add(user_pk)
+            self._index(channel_pk)
+
+    def remove_user(self, channel_pk, user_pk):
+        """
+        A User has left a game channel
+        """
+        with self._lock:
+            users = self._users.get(channel_pk)
+            if users is None or user_pk not in users:
+                return
+            self._unindex(channel_pk)
+            users.discard(user_pk)
+            self._index(channel_pk)
+
+    def clear(self):
+        """
+        Forget everything so it is reloaded on next use
+        """
+        with self._lock:
+            self.loaded_at = None
+
+    def get_channel_pk(self, channel_id):
+        """
+        Returns the primary key of the open game channel with the Discord ID :attr:`channel_id`, or None
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return self._channel_pks.get(channel_id)
+
+    def occupancy(self, channel_pk):
+        """
+        Returns the number of Users in a game channel
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return len(self._users.get(channel_pk, ()))
+
+    def users(self, channel_pk):
+        """
+        Returns a set of the primary keys of the Users in a game channel
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return set(self._users.get(channel_pk, ()))
+
+    def find_open(self, server_pk, game_pk):
+        """
+        Returns the primary key of the fullest game channel with a free slot for a game on a server, or None
+
+        Channels that have expired are dropped as they are found
+        """
+        self._ensure_loaded()
+        now = timezone.now()
+        with self._lock:
+            for free in range(1, self.capacity + 1):
+                while True:
+                    buckets = self._open.get((server_pk, game_pk))
+                    if not buckets or free not in buckets:
+                        break
+                    pk = next(iter(buckets[free]))
+                    expire_date = self._channels[pk][3]
+                    if expire_date is None or expire_date > now:
+                        return pk
+                    self.discard(pk)
+        return None
+
+
+channel_occupancy = ChannelOccupancy()
@@ -0,0 +1,117 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+DEFAULT_TIMEOUT = 3600
+
+# Returned by the cache for a key it doesn't hold, as None is a value worth caching
+_MISSING = object()
+
+
+class PageCache:
+    """
+    Caches what the webapp's pages are built from, under keys that carry a version of everything shown on the page
+
+    alias : Optional[str]
+        The cache in ``settings.CACHES`` to use
+    timeout : Optional[int]
+        Seconds an entry is kept even if nothing on it changes
+
+    A scope is a tuple such as ``('server', server_id)`` for a server and its members, ``('server_info', server_id)`` for only
+    the server's own fields, ``('user', user_id)``, ``('messages', server_id)`` or ``('servers',)`` for the server list.
+    Every scope has a version held in the cache, which the receivers in :mod:`gaming.signals` bump when something in it
+    is saved or deleted, so entries are never deleted: their keys just stop being asked for.
+    The versions live in the cache rather than in memory so changes made by the bot reach the webapp.
+    Looking up an entry only reads from the cache, never the database.
+    """
+    def __init__(self, alias='pages', timeout=DEFAULT_TIMEOUT):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version_key(self, scope):
+        return 'version:{}'.format(':'.join(str(part) for part in scope))
+
+    def versions(self, scopes):
+        """
+        Returns the current version of every scope in :attr:`scopes`
+        """
+        keys = [self.version_key(scope) for scope in scopes]
+        found = self.cache.get_many(keys)
+        return [found[key] if found.get(key) is not None else self._start(key) for key in keys]
+
+    def _start(self, key):
+        # A version that was culled starts again from the clock instead of 1, so keys from before it was lost aren't reused
+        version = int(time.time() * 1000)
+        if not self.cache.add(key, version, timeout=None):
+            version = self.cache.get(key, version)
+        return version
+
+    def _increment(self, key, initial):
+        # add() and incr() are atomic on backends that share a cache between processes, so two processes bumping
+        # the same key at once always end up on different values
+        if self.cache.add(key, initial, timeout=None):
+            return
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # Culled between the two calls
+            self.cache.add(key, initial, timeout=None)
+
+    def bump(self, *scopes):
+        """
+        Move every scope in :attr:`scopes` on to a new version, so nothing cached under the old one is used again
+        """
+        for scope in scopes:
+            self._increment(self.version_key(scope), int(time.time() * 1000))
+
+    def key(self, name, scopes, parts=()):
+        """
+        Returns the key for page :attr:`name` showing :attr:`scopes` at their current versions
+
+        parts : Optional[list]
+            Anything else the page varies by (ex: a search)
+        """
+        versions = self.versions(scopes)
+        digest = hashlib.md5(repr((list(scopes), list(parts))).encode('utf-8')).hexdigest()
+        return 'page:{}:{}:{}'.format(name, '.'.join(str(version) for version in versions), digest)
+
+    def get(self, key, builder):
+        """
+        Returns what is cached under :attr:`key`, calling :attr:`builder` to make and store it on a miss
+        """
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.count('hits')
+            return value
+        self.count('misses')
+        value = builder()
+        self.cache.set(key, value, self.timeout)
+        return value
+
+    def count(self, name):
+        self._increment('stats:{}'.format(name), 1)
+
+    def stats(self):
+        """
+        Returns a dict of hits, misses and hit rate, counted across every process using the cache
+        """
+        found = self.cache.get_many(['stats:hits', 'stats:misses'])
+        hits = found.get('stats:hits', 0)
+        misses = found.get('stats:misses', 0)
+        lookups = hits + misses
+        return {
+            'name': 'Pages',
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': (hits / lookups) if lookups else 0.0,
+        }
+
+
+page_cache = PageCache(timeout=getattr(settings, 'PAGE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
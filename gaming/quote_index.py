@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+
+from gaming.models import Quote
+
+
+# Seconds before a server's quotes are reloaded, to pick up Quotes added or removed by another process (ex: the webapp)
+RELOAD_INTERVAL = 600
+
+
+class QuoteIndex:
+    """
+    Keeps a dense list of :class:`gaming.models.Quote` primary keys per server so a random Quote can be picked in constant time
+
+    Lists are loaded on first use with a single query and then kept current by the Quote receivers in :mod:`gaming.signals`.
+    The key ``None`` holds every Quote regardless of server.
+    """
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._pks = {}
+        self._positions = {}
+        self._loaded_at = {}
+        self._lock = threading.RLock()
+
+    def _load(self, server_pk):
+        quotes = Quote.objects.all()
+        if server_pk is not None:
+            quotes = quotes.filter(server_id=server_pk)
+        pks = list(quotes.values_list('pk', flat=True))
+        with self._lock:
+            self._pks[server_pk] = pks
+            self._positions[server_pk] = {pk: i for i, pk in enumerate(pks)}
+            self._loaded_at[server_pk] = time.monotonic()
+
+    def _ensure_loaded(self, server_pk):
+        loaded_at = self._loaded_at.get(server_pk)
+        if loaded_at is None or time.monotonic() - loaded_at > self.reload_interval:
+            self._load(server_pk)
+
+    def _append(self, key, pk):
+        positions = self._positions.get(key)
+        if positions is not None and pk not in positions:
+            positions[pk] = len(self._pks[key])
+            self._pks[key].append(pk)
+
+    def _remove(self, key, pk):
+        positions = self._positions.get(key)
+        if positions is None or pk not in positions:
+            return
+        # Swap the last primary key into the removed slot so the list stays dense
+        pks = self._pks[key]
+        index = positions.pop(pk)
+        last = pks.pop()
+        if last != pk:
+            pks[index] = last
+            positions[last] = index
+
+    def add(self, quote):
+        """
+        Add a saved Quote, moving it if its server changed
+        """
+        with self._lock:
+            for key in list(self._positions.keys()):
+                if key is not None and key != quote.server_id:
+                    self._remove(key, quote.pk)
+            self._append(quote.server_id, quote.pk)
+            self._append(None, quote.pk)
+
+    def discard(self, pk):
+        """
+        Remove the Quote with primary key :attr:`pk` from every list
+        """
+        with self._lock:
+            for key in list(self._positions.keys()):
+                self._remove(key, pk)
+
+    def clear(self):
+        """
+        Forget every list so they are reloaded on next use
+        """
+        with self._lock:
+            self._pks.clear()
+            self._positions.clear()
+            self._loaded_at.clear()
+
+    def count(self, server=None):
+        """
+        Returns the number of Quotes for :attr:`server`, or every Quote if no server is given
+        """
+        server_pk = server.pk if server is not None else None
+        self._ensure_loaded(server_pk)
+        return len(self._pks[server_pk])
+
+    def random_pk(self, server=None):
+        """
+        Returns the primary key of a random Quote for :attr:`server`, or None if there aren't any
+        """
+        server_pk = server.pk if server is not None else None
+        self._ensure_loaded(server_pk)
+        with self._lock:
+            pks = self._pks[server_pk]
+            if not pks:
+                return None
+            return random.choice(pks)
+
+
+quote_index = QuoteIndex()
@@ -0,0 +1,256 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+from gaming.models import GameUser, ServerUser
+
+
+# Seconds before everything is reloaded, to pick up GameUsers and ServerUsers changed by another process (ex: the webapp)
+RELOAD_INTERVAL = 600
+
+# The number of players a Game needs before it is listed
+MIN_PLAYERS = 3
+
+
+class Ranking:
+    """
+    Games ordered by their number of players, highest first
+
+    Games with the same number of players are kept together in a run, so adding or removing a player
+    only swaps the Game with the edge of its run instead of re-sorting.
+    """
+    def __init__(self):
+        self.order = []
+        self.positions = {}
+        self.counts = {}
+        self.first = {}
+        self.last = {}
+
+    def __len__(self):
+        return len(self.order)
+
+    def _swap(self, i, j):
+        if i == j:
+            return
+        order = self.order
+        order[i], order[j] = order[j], order[i]
+        self.positions[order[i]] = i
+        self.positions[order[j]] = j
+
+    def _leave_run(self, count, index, from_front):
+        if self.first[count] == self.last[count]:
+            del self.first[count]
+            del self.last[count]
+        elif from_front:
+            self.first[count] = index + 1
+        else:
+            self.last[count] = index - 1
+
+    def increment(self, game_pk):
+        count = self.counts.get(game_pk, 0)
+        if count == 0:
+            # The run of single player Games is always at the end
+            index = len(self.order)
+            self.order.append(game_pk)
+            self.positions[game_pk] = index
+            self.first.setdefault(1, index)
+            self.last[1] = index
+            self.counts[game_pk] = 1
+            return
+        index = self.first[count]
+        self._swap(self.positions[game_pk], index)
+        self._leave_run(count, index, from_front=True)
+        # The run for count + 1, if there is one, ends just before this one
+        self.first.setdefault(count + 1, index)
+        self.last[count + 1] = index
+        self.counts[game_pk] = count + 1
+
+    def decrement(self, game_pk):
+        count = self.counts.get(game_pk, 0)
+        if count == 0:
+            return
+        index = self.last[count]
+        self._swap(self.positions[game_pk], index)
+        self._leave_run(count, index, from_front=False)
+        if count == 1:
+            # Single player Games are at the end, so this is the last item
+            self.order.pop()
+            del self.positions[game_pk]
+            del self.counts[game_pk]
+            return
+        # The run for count - 1, if there is one, starts just after this one
+        self.first[count - 1] = index
+        self.last.setdefault(count - 1, index)
+        self.counts[game_pk] = count - 1
+
+    def listed(self, min_players=MIN_PLAYERS):
+        """
+        Returns the number of Games with at least :attr:`min_players`, which are always the first ones in :attr:`order`
+        """
+        for count in range(min_players - 1, 0, -1):
+            if count in self.first:
+                return self.first[count]
+        return len(self.order)
+
+
+class GameRankings:
+    """
+    Keeps a :class:`Ranking` of Games by the number of current members who play them, for every server
+
+    Everything is loaded on first use with one query each for :class:`gaming.models.GameUser` and
+    :class:`gaming.models.ServerUser`, and then kept current by the receivers in :mod:`gaming.signals`.
+    The key ``None`` ranks Games by every User who plays them, regardless of server.
+    """
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self.loaded_at = None
+        self._rankings = defaultdict(Ranking)
+        self._user_games = defaultdict(Counter)
+        self._user_servers = defaultdict(Counter)
+        self._lock = threading.RLock()
+
+    def _load(self):
+        game_users = list(GameUser.objects.values_list('user_id', 'game_id'))
+        server_users = list(ServerUser.objects.values_list('user_id', 'server_id'))
+        with self._lock:
+            self._rankings = defaultdict(Ranking)
+            self._user_games = defaultdict(Counter)
+            self._user_servers = defaultdict(Counter)
+            for user_pk, server_pk in server_users:
+                self._user_servers[user_pk][server_pk] += 1
+            for user_pk, game_pk in game_users:
+                self._add_game_user(user_pk, game_pk)
+            self.loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.reload_interval:
+            self._load()
+
+    def _add_game_user(self, user_pk, game_pk):
+        games = self._user_games[user_pk]
+        games[game_pk] += 1
+        if games[game_pk] > 1:
+            return
+        self._rankings[None].increment(game_pk)
+        for server_pk in self._user_servers.get(user_pk, ()):
+            self._rankings[server_pk].increment(game_pk)
+
+    def add_game_user(self, user_pk, game_pk):
+        """
+        A User has played a Game
+        """
+        with self._lock:
+            if self.loaded_at is not None:
+                self._add_game_user(user_pk, game_pk)
+
+    def remove_game_user(self, user_pk, game_pk):
+        """
+        A User no longer plays a Game
+        """
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            games = self._user_games.get(user_pk)
+            if not games or not games[game_pk]:
+                return
+            games[game_pk] -= 1
+            if games[game_pk]:
+                return
+            del games[game_pk]
+            self._rankings[None].decrement(game_pk)
+            for server_pk in self._user_servers.get(user_pk, ()):
+                self._rankings[server_pk].decrement(game_pk)
+
+    def add_member(self, user_pk, server_pk):
+        """
+        A User has joined a server
+        """
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            servers = self._user_servers[user_pk]
+            servers[server_pk] += 1
+            if servers[server_pk] > 1:
+                return
+            ranking = self._rankings[server_pk]
+            for game_pk in self._user_games.get(user_pk, ()):
+                ranking.increment(game_pk)
+
+    def remove_member(self, user_pk, server_pk):
+        """
+        A User has left a server
+        """
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            servers = self._user_servers.get(user_pk)
+            if not servers or not servers[server_pk]:
+                return
+            servers[server_pk] -= 1
+            if servers[server_pk]:
+                return
+            del servers[server_pk]
+            ranking = self._rankings[server_pk]
+            for game_pk in self._user_games.get(user_pk, ()):
+                ranking.decrement(game_pk)
+
+    def clear(self):
+        """
+        Forget everything so it is reloaded on next use
+        """
+        with self._lock:
+            self.loaded_at = None
+
+    def players(self, game_pk, server=None):
+        """
+        Returns the number of players of a Game on :attr:`server`, or everywhere if no server is given
+        """
+        server_pk = server.pk if server is not None else None
+        self._ensure_loaded()
+        with self._lock:
+            ranking = self._rankings.get(server_pk)
+            return ranking.counts.get(game_pk, 0) if ranking is not None else 0
+
+    def count(self, server=None, min_players=MIN_PLAYERS):
+        """
+        Returns the number of Games with at least :attr:`min_players` on :attr:`server`
+        """
+        server_pk = server.pk if server is not None else None
+        self._ensure_loaded()
+        with self._lock:
+            ranking = self._rankings.get(server_pk)
+            return ranking.listed(min_players) if ranking is not None else 0
+
+    def page(self, server=None, start=0, stop=None, min_players=MIN_PLAYERS):
+        """
+        Returns a list of ``(game_pk, players)`` from :attr:`start` to :attr:`stop` in ranking order
+
+        Only Games with at least :attr:`min_players` are included
+        """
+        server_pk = server.pk if server is not None else None
+        self._ensure_loaded()
+        with self._lock:
+            ranking = self._rankings.get(server_pk)
+            if ranking is None:
+                return []
+            listed = ranking.listed(min_players)
+            stop = listed if stop is None else min(stop, listed)
+            return [(game_pk, ranking.counts[game_pk]) for game_pk in ranking.order[start:stop]]
+
+    def rank(self, game_pks, server=None, min_players=MIN_PLAYERS):
+        """
+        Returns a list of ``(game_pk, players)`` for only :attr:`game_pks`, in ranking order
+
+        Games with fewer than :attr:`min_players` are left out
+        """
+        server_pk = server.pk if server is not None else None
+        self._ensure_loaded()
+        with self._lock:
+            ranking = self._rankings.get(server_pk)
+            if ranking is None:
+                return []
+            ranked = [(ranking.positions[pk], pk) for pk in set(game_pks) if ranking.counts.get(pk, 0) >= min_players]
+            return [(pk, ranking.counts[pk]) for position, pk in sorted(ranked)]
+
+
+game_rankings = GameRankings()
@@ -0,0 +1,161 @@
+import re
+from collections import OrderedDict
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from gaming.utils import KeysetPage
+
+
+# Put around matched terms by the database, and turned into <mark> once the rest of the content is escaped
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+# PostgreSQL text search configuration
+TS_CONFIG = 'english'
+
+TSVECTOR = "to_tsvector('{}', gaming_message.content)".format(TS_CONFIG)
+
+_sqlite_index = {}
+
+
+def backend():
+    """
+    Returns the kind of full-text index :class:`gaming.models.Message` content has, ``'fts5'``, ``'tsvector'`` or None
+
+    On SQLite the FTS5 table is made by a migration only if the SQLite build supports it, so its existence is checked once.
+    """
+    if connection.vendor == 'postgresql':
+        return 'tsvector'
+    if connection.vendor != 'sqlite':
+        return None
+    name = connection.settings_dict['NAME']
+    if name not in _sqlite_index:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gaming_message_fts'")
+            _sqlite_index[name] = cursor.fetchone() is not None
+    return 'fts5' if _sqlite_index[name] else None
+
+
+def fts5_query(query):
+    """
+    Returns :attr:`query` as an FTS5 query matching every word, with anything FTS5 would treat as syntax quoted away
+    """
+    terms = re.findall(r'\w+', query)
+    return ' '.join('"{}"'.format(term) for term in terms)
+
+
+def match_sql(query):
+    """
+    Returns ``(sql, params)`` of a WHERE condition on ``gaming_message`` for content matching :attr:`query`,
+    or None if there is no full-text index to use or nothing to search for
+    """
+    terms = fts5_query(query)
+    if not terms:
+        return None
+    kind = backend()
+    if kind == 'fts5':
+        return ('gaming_message.id IN (SELECT rowid FROM gaming_message_fts WHERE gaming_message_fts MATCH %s)', [terms])
+    if kind == 'tsvector':
+        return ("{} @@ plainto_tsquery('{}', %s)".format(TSVECTOR, TS_CONFIG), [query])
+    return None
+
+
+def ranked(queryset, query):
+    """
+    Returns :attr:`queryset` limited to content matching :attr:`query`, with ``search_rank`` (lower is better)
+    and ``search_highlight`` selected, or None if there is no full-text index to use
+
+    Also returns the SQL and params of the rank, and the placeholder for a rank read back from a cursor,
+    for comparing against in a WHERE clause
+    """
+    terms = fts5_query(query)
+    if not terms:
+        return None
+    kind = backend()
+    if kind == 'fts5':
+        rank, rank_params = 'bm25(gaming_message_fts)', []
+        highlight, highlight_params = 'highlight(gaming_message_fts, 0, %s, %s)', [HIGHLIGHT_START, HIGHLIGHT_STOP]
+        tables = ['gaming_message_fts']
+        where = ['gaming_message_fts.rowid = gaming_message.id', 'gaming_message_fts MATCH %s']
+        params = [terms]
+        value = '%s'
+    elif kind == 'tsvector':
+        tsquery = "plainto_tsquery('{}', %s)".format(TS_CONFIG)
+        # ts_rank is higher for better matches, so it is negated to sort the same way as bm25
+        rank, rank_params = '-ts_rank({}, {})'.format(TSVECTOR, tsquery), [query]
+        highlight = "ts_headline('{}', gaming_message.content, {}, %s)".format(TS_CONFIG, tsquery)
+        highlight_params = [query, 'StartSel={}, StopSel={}, HighlightAll=true'.format(HIGHLIGHT_START, HIGHLIGHT_STOP)]
+        tables = []
+        where = ['{} @@ {}'.format(TSVECTOR, tsquery)]
+        params = [query]
+        # ts_rank is a real, and a real read back as a double only compares equal once it is cast back
+        value = '%s::real'
+    else:
+        return None
+    queryset = queryset.extra(
+        select=OrderedDict([('search_rank', rank), ('search_highlight', highlight)]),
+        select_params=rank_params + highlight_params,
+        tables=tables,
+        where=where,
+        params=params,
+    )
+    return queryset, rank, rank_params, value
+
+
+def encode_rank_cursor(rank, pk):
+    return '{!r}_{}'.format(float(rank), pk)
+
+
+def decode_rank_cursor(cursor):
+    try:
+        rank, pk = cursor.rsplit('_', 1)
+        return (float(rank), int(pk))
+    except (AttributeError, ValueError):
+        return None
+
+
+def search_page(queryset, query, per_page, *, after=None, before=None):
+    """
+    Returns a :class:`gaming.utils.KeysetPage` of the messages in :attr:`queryset` matching :attr:`query`, best match first,
+    or None if there is no full-text index to use
+
+    Like :func:`gaming.utils.keyset_page`, the cursors are compared against (rank, primary key) instead of using an offset.
+    Every message has ``search_highlight``, its content with the matched terms marked, see :func:`render_highlight`.
+    """
+    search = ranked(queryset, query)
+    if search is None:
+        return None
+    queryset, rank, rank_params, value_sql = search
+    after = decode_rank_cursor(after) if after else None
+    before = decode_rank_cursor(before) if before else None
+    keyset = '({0} {1} {2} OR ({0} = {2} AND gaming_message.id {1} %s))'
+    if before is not None:
+        value, pk = before
+        queryset = queryset.extra(where=[keyset.format(rank, '<', value_sql)], params=rank_params + [value] + rank_params + [value, pk])
+        rows = list(queryset.order_by('-search_rank', '-pk')[:per_page + 1])
+        has_better = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_worse = True
+    else:
+        if after is not None:
+            value, pk = after
+            queryset = queryset.extra(where=[keyset.format(rank, '>', value_sql)], params=rank_params + [value] + rank_params + [value, pk])
+        rows = list(queryset.order_by('search_rank', 'pk')[:per_page + 1])
+        has_worse = len(rows) > per_page
+        items = rows[:per_page]
+        has_better = after is not None
+    if not items:
+        return KeysetPage(items)
+    older = encode_rank_cursor(items[-1].search_rank, items[-1].pk) if has_worse else None
+    newer = encode_rank_cursor(items[0].search_rank, items[0].pk) if has_better else None
+    return KeysetPage(items, older=older, newer=newer)
+
+
+def render_highlight(text):
+    """
+    Returns highlighted content from :func:`search_page` escaped for HTML, with the matched terms in ``<mark>``
+    """
+    text = escape(text)
+    return mark_safe(text.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>'))
@@ -1,10 +1,20 @@
+import uuid
+
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import send_mail
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
+from gaming import identity
+from gaming.game_index import game_index
+from gaming.membership import membership
+from gaming.occupancy import channel_occupancy
+from gaming.page_cache import page_cache
+from gaming.quote_index import quote_index
+from gaming.rankings import game_rankings
 from gaming.utils import logify_exception_info
-from gaming.models import Log, Quote
+from gaming.models import Log, Quote, Server, Channel, ChannelUser, DiscordUser, ServerUser, Game, GameUser, Message
 
 
 @receiver(pre_save, sender=Log)
@@ -43,4 +53,127 @@ def email_log(sender, instance, *args, **kwargs):
                     recipient_list=settings.ADMINS
                 )
             except Exception as e:
-                Log.objects.create(message="Error sending email about log {}\n\n{}".format(logify_exception_info()), message_token='ERROR_SENDING_EMAIL')
+                Log.objects.create(message="Error sending email about log {}\n\n{}".format(instance.message_token, logify_exception_info()), message_token='ERROR_SENDING_EMAIL_{}'.format(uuid.uuid4().hex[:16]))
+
+
+@receiver(post_save, sender=Server)
+@receiver(post_save, sender=Channel)
+@receiver(post_save, sender=DiscordUser)
+@receiver(post_save, sender=ServerUser)
+def refresh_identity_map(sender, instance, *args, **kwargs):
+    identity_map = identity.identity_maps.get(sender)
+    if identity_map is not None:
+        identity_map.refresh(instance, update_fields=kwargs.get('update_fields'))
+
+
+@receiver(post_delete, sender=Server)
+@receiver(post_delete, sender=Channel)
+@receiver(post_delete, sender=DiscordUser)
+@receiver(post_delete, sender=ServerUser)
+def discard_identity_map(sender, instance, *args, **kwargs):
+    identity_map = identity.identity_maps.get(sender)
+    if identity_map is not None:
+        identity_map.discard(instance.pk)
+
+
+@receiver(post_save, sender=Quote)
+def index_quote(sender, instance, *args, **kwargs):
+    quote_index.add(instance)
+
+
+@receiver(post_delete, sender=Quote)
+def unindex_quote(sender, instance, *args, **kwargs):
+    quote_index.discard(instance.pk)
+
+
+@receiver(post_save, sender=GameUser)
+def rank_game_user(sender, instance, created, *args, **kwargs):
+    if created:
+        game_rankings.add_game_user(instance.user_id, instance.game_id)
+
+
+@receiver(post_delete, sender=GameUser)
+def unrank_game_user(sender, instance, *args, **kwargs):
+    game_rankings.remove_game_user(instance.user_id, instance.game_id)
+
+
+@receiver(post_save, sender=ServerUser)
+def add_member(sender, instance, created, *args, **kwargs):
+    if created:
+        membership.add(instance.user_id, instance.server_id)
+        game_rankings.add_member(instance.user_id, instance.server_id)
+
+
+@receiver(post_delete, sender=ServerUser)
+def remove_member(sender, instance, *args, **kwargs):
+    membership.remove(instance.user_id, instance.server_id)
+    game_rankings.remove_member(instance.user_id, instance.server_id)
+
+
+@receiver(post_save, sender=Game)
+def index_game(sender, instance, *args, **kwargs):
+    game_index.add(instance)
+
+
+@receiver(post_delete, sender=Game)
+def unindex_game(sender, instance, *args, **kwargs):
+    game_index.discard(instance.pk)
+
+
+@receiver(post_save, sender=Channel)
+def track_channel(sender, instance, created, *args, **kwargs):
+    channel_occupancy.add_channel(instance, created=created)
+
+
+@receiver(post_delete, sender=Channel)
+def untrack_channel(sender, instance, *args, **kwargs):
+    channel_occupancy.discard(instance.pk)
+
+
+@receiver(post_save, sender=ChannelUser)
+def add_channel_user(sender, instance, created, *args, **kwargs):
+    if created:
+        channel_occupancy.add_user(instance.channel_id, instance.user_id)
+
+
+@receiver(post_delete, sender=ChannelUser)
+def remove_channel_user(sender, instance, *args, **kwargs):
+    channel_occupancy.remove_user(instance.channel_id, instance.user_id)
+
+
+@receiver(post_save, sender=Server)
+@receiver(post_delete, sender=Server)
+def expire_server_pages(sender, instance, *args, **kwargs):
+    page_cache.bump(('servers',), ('server', instance.server_id), ('server_info', instance.server_id))
+
+
+@receiver(post_save, sender=ServerUser)
+@receiver(post_delete, sender=ServerUser)
+def expire_server_user_pages(sender, instance, *args, **kwargs):
+    scopes = []
+    try:
+        scopes.append(('server', instance.server.server_id))
+    except ObjectDoesNotExist:
+        pass
+    try:
+        scopes.append(('user', instance.user.user_id))
+    except ObjectDoesNotExist:
+        pass
+    page_cache.bump(*scopes)
+
+
+@receiver(post_save, sender=DiscordUser)
+@receiver(post_delete, sender=DiscordUser)
+def expire_user_pages(sender, instance, *args, **kwargs):
+    # Looking up every server the user is on would add a query to each save, so the server pages they show up on
+    # are expired by :meth:`cogs.tasks.Tasks.get_user` and :meth:`cogs.tasks.Tasks.sync_members` instead
+    page_cache.bump(('user', instance.user_id))
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def expire_message_pages(sender, instance, *args, **kwargs):
+    try:
+        page_cache.bump(('messages', instance.server.server_id))
+    except ObjectDoesNotExist:
+        pass
@@ -0,0 +1,13 @@
+from django import template
+
+from gaming.search import render_highlight
+
+register = template.Library()
+
+
+@register.filter
+def highlight(text):
+    """
+        {{ message.search_highlight|highlight }}
+    """
+    return render_highlight(text)
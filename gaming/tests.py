@@ -1,13 +1,41 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+
 from django.contrib.auth.models import AnonymousUser, User
-from django.test import TestCase, RequestFactory
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from cogs.gaming import Gaming
+from cogs.utils.channel_pool import ChannelPool
+from cogs.utils.matchmaking import Matchmaker
+from gaming import export, identity, search, utils
+from gaming.models import Server, DiscordUser, DiscordUserHistory, ServerUser, Log, Quote, Game, GameUser, GameSearch, Channel, ChannelUser, Message, Attachment
+from gaming.game_index import game_index
+from gaming.page_cache import PageCache
+from gaming.membership import membership
+from gaming.occupancy import channel_occupancy
+from gaming.quote_index import quote_index
+from gaming.rankings import Ranking, game_rankings
 
-from gaming import utils
-from gaming.models import Server, DiscordUser, ServerUser
 
+PAGE_CACHES = dict(settings.CACHES, pages={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'squidbot-test-pages'})
 
+
+@override_settings(CACHES=PAGE_CACHES)
 class ViewsTestCase(TestCase):
     def setUp(self):
+        caches['pages'].clear()
         self.factory = RequestFactory()
         self.user = User.objects.create_user(username='bsquidwrd', email='someone@example.com', password='top_secret')
         self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
@@ -24,3 +52,589 @@ class ViewsTestCase(TestCase):
     def test_user_view(self):
         resp = self.client.get(reverse('user', kwargs={'user_id': self.discord_user.user_id}))
         self.assertEqual(resp.status_code, 200)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(queries)
+
+    def add_member(self, i):
+        user = DiscordUser.objects.create(user_id=str(i), name=str(i), avatar_url='https://example.com/{}.png'.format(i))
+        server = Server.objects.create(server_id='s{}'.format(i), name=str(i), owner=user)
+        ServerUser.objects.create(user=user, server=self.server)
+        ServerUser.objects.create(user=self.discord_user, server=server)
+        channel = Channel.objects.create(server=self.server, channel_id=str(i), name='general')
+        message = Message.objects.create(server=self.server, channel=channel, user=user, timestamp=timezone.now(), content=str(i), message_id=str(i))
+        message.attachments.add(Attachment.objects.create(server=self.server, channel=channel, user=user, attachment_id=str(i), url='https://example.com/{}.png'.format(i)))
+
+    def get_urls(self):
+        return [
+            reverse('index'),
+            reverse('server', kwargs={'server_id': self.server.server_id}),
+            reverse('user', kwargs={'user_id': self.discord_user.user_id}),
+            reverse('server_messages', kwargs={'server_id': self.server.server_id}),
+            reverse('server_messages_json', kwargs={'server_id': self.server.server_id}),
+        ]
+
+    def test_query_count_does_not_grow_with_rows(self):
+        urls = self.get_urls()
+        self.add_member(1)
+        few = [self.count_queries(url) for url in urls]
+        for i in range(2, 6):
+            self.add_member(i)
+        many = [self.count_queries(url) for url in urls]
+        self.assertEqual(few, many)
+
+    def test_cached_page_does_not_query(self):
+        self.add_member(1)
+        for url in self.get_urls():
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([query['sql'] for query in queries if 'gaming_' in query['sql']], [])
+
+    def test_saving_expires_cached_page(self):
+        url = reverse('server', kwargs={'server_id': self.server.server_id})
+        self.client.get(url)
+        user = DiscordUser.objects.create(user_id='1', name='New Member')
+        ServerUser.objects.create(user=user, server=self.server)
+        self.assertContains(self.client.get(url), 'New Member')
+
+        url = reverse('user', kwargs={'user_id': user.user_id})
+        self.assertContains(self.client.get(url), 'Squid Bot Testing Server')
+        user.name = 'Renamed Member'
+        user.save()
+        self.assertContains(self.client.get(url), 'Renamed Member')
+        self.server.name = 'Renamed Server'
+        self.server.save()
+        self.assertContains(self.client.get(url), 'Renamed Server')
+
+    def test_other_servers_do_not_expire_user_page(self):
+        ServerUser.objects.create(user=self.discord_user, server=self.server)
+        url = reverse('user', kwargs={'user_id': self.discord_user.user_id})
+        self.client.get(url)
+        Server.objects.create(server_id='1', name='Another Server')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertEqual([query['sql'] for query in queries if 'gaming_' in query['sql']], [])
+
+
+class IdentityMapTestCase(TestCase):
+    def setUp(self):
+        identity.servers.clear()
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+
+    def test_hit_after_miss(self):
+        identity_map = identity.IdentityMap('Server')
+        loader = lambda: Server.objects.get(server_id=self.server.server_id)
+        first = identity_map.get(self.server.server_id, loader)
+        with self.assertNumQueries(0):
+            second = identity_map.get(self.server.server_id, loader)
+        self.assertEqual(first, second)
+        self.assertEqual(identity_map.stats()['hits'], 1)
+        self.assertEqual(identity_map.stats()['misses'], 1)
+
+    def test_callers_get_their_own_copy(self):
+        first = identity.get_server(self.server.server_id)
+        second = identity.get_server(self.server.server_id)
+        self.assertIsNot(first, second)
+        first.name = 'Half Changed'
+        self.assertEqual(second.name, 'Squid Bot Testing Server')
+        self.assertEqual(identity.get_server(self.server.server_id).name, 'Squid Bot Testing Server')
+        first.save()
+        with self.assertNumQueries(0):
+            # The stored copy took a snapshot of what was written, so saving it again has nothing to write
+            stored = identity.get_server(self.server.server_id)
+            self.assertEqual(stored.name, 'Half Changed')
+            stored.save()
+
+    def test_least_recently_used_is_evicted(self):
+        identity_map = identity.IdentityMap('DiscordUser', max_size=2)
+        users = [DiscordUser.objects.create(user_id=str(i), name=str(i)) for i in range(3)]
+        identity_map.set('0', users[0])
+        identity_map.set('1', users[1])
+        identity_map.get('0', lambda: None)
+        identity_map.set('2', users[2])
+        self.assertIn('0', identity_map)
+        self.assertNotIn('1', identity_map)
+        self.assertEqual(identity_map.stats()['evictions'], 1)
+
+    def test_signals_keep_map_current(self):
+        identity.get_server(self.server.server_id)
+        self.server.name = 'Renamed Server'
+        self.server.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(identity.get_server(self.server.server_id).name, 'Renamed Server')
+        self.server.delete()
+        self.assertNotIn(self.server.server_id, identity.servers)
+
+
+class ChangeTrackingTestCase(TestCase):
+    def setUp(self):
+        DiscordUser.objects.create(user_id='251960188217720832', name='Squid Testing Bot')
+        self.discord_user = DiscordUser.objects.get(user_id='251960188217720832')
+
+    def test_unchanged_save_does_nothing(self):
+        with self.assertNumQueries(0):
+            self.discord_user.save()
+
+    def test_changed_save_writes_history(self):
+        self.discord_user.name = 'Squid Bot'
+        self.discord_user.avatar_url = 'https://cdn.discordapp.com/avatars/example.png'
+        with self.assertNumQueries(2):
+            self.discord_user.save()
+        history = DiscordUserHistory.objects.filter(user=self.discord_user)
+        self.assertEqual(sorted(history.values_list('field_modified', flat=True)), ['avatar_url', 'name'])
+        self.assertEqual(DiscordUser.objects.get(pk=self.discord_user.pk).name, 'Squid Bot')
+        with self.assertNumQueries(0):
+            self.discord_user.save()
+
+    def test_deferred_field_is_saved(self):
+        user = DiscordUser.objects.only('user_id', 'name').get(pk=self.discord_user.pk)
+        user.avatar_url = 'https://cdn.discordapp.com/avatars/example.png'
+        user.save()
+        self.assertEqual(DiscordUser.objects.get(pk=user.pk).avatar_url, 'https://cdn.discordapp.com/avatars/example.png')
+        with self.assertNumQueries(0):
+            user.save()
+
+
+class BulkUpdateTestCase(TestCase):
+    def test_chunks(self):
+        self.assertEqual(list(utils.chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_bulk_update(self):
+        for i in range(3):
+            DiscordUser.objects.create(user_id=str(i), name='User {}'.format(i))
+        users = list(DiscordUser.objects.order_by('pk'))
+        for user in users:
+            user.name = '{} renamed'.format(user.name)
+            user.bot = True
+        with self.assertNumQueries(2):
+            updated = utils.bulk_update(DiscordUser, users, ['name', 'bot'], batch_size=2)
+        self.assertEqual(updated, 3)
+        self.assertEqual(list(DiscordUser.objects.order_by('pk').values_list('name', 'bot')), [('User 0 renamed', True), ('User 1 renamed', True), ('User 2 renamed', True)])
+
+
+class GenerateIdTestCase(TestCase):
+    def test_length_and_alphabet(self):
+        token = utils.generate_id(50)
+        self.assertEqual(len(token), 50)
+        self.assertTrue(all(c in utils.ID_ALPHABET for c in token))
+
+    def test_ids_sort_by_time(self):
+        self.assertLess(utils.encode_id(1483228800000, utils.ID_TIME_LENGTH), utils.encode_id(1483228800001, utils.ID_TIME_LENGTH))
+
+    def test_log_create_is_one_query(self):
+        with self.assertNumQueries(1):
+            log_item = Log.objects.create(message='Testing')
+        self.assertEqual(len(log_item.message_token), 50)
+
+
+class RandomQuoteTestCase(TestCase):
+    def setUp(self):
+        quote_index.clear()
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        self.other_server = Server.objects.create(server_id='138036477643718656', name='Other Server')
+        self.discord_user = DiscordUser.objects.create(user_id='251960188217720832', name='Squid Testing Bot')
+
+    def create_quote(self, server, message):
+        return Quote.objects.create(user=self.discord_user, added_by=self.discord_user, server=server, message=message)
+
+    def test_random_quote_is_from_server(self):
+        quote = self.create_quote(self.server, 'Only quote here')
+        self.create_quote(self.other_server, 'Somewhere else')
+        for i in range(10):
+            self.assertEqual(Quote.random_quote(server=self.server), quote)
+
+    def test_no_quotes(self):
+        self.assertIsNone(Quote.random_quote(server=self.server))
+
+    def test_index_follows_saves_and_deletes(self):
+        quotes = [self.create_quote(self.server, str(i)) for i in range(3)]
+        self.assertEqual(quote_index.count(self.server), 3)
+        quotes[0].delete()
+        self.assertEqual(quote_index.count(self.server), 2)
+        self.create_quote(self.server, 'New quote')
+        self.assertEqual(quote_index.count(self.server), 3)
+        with self.assertNumQueries(1):
+            Quote.random_quote(server=self.server)
+
+
+class RankingTestCase(TestCase):
+    def test_ranking_stays_sorted(self):
+        ranking = Ranking()
+        for game_pk in [1, 2, 2, 3, 3, 3, 2, 1, 2]:
+            ranking.increment(game_pk)
+        self.assertEqual(ranking.order, [2, 3, 1])
+        ranking.decrement(2)
+        ranking.decrement(2)
+        self.assertEqual(ranking.order, [3, 2, 1])
+        ranking.decrement(1)
+        ranking.decrement(1)
+        self.assertEqual(ranking.order, [3, 2])
+        self.assertEqual(ranking.counts, {3: 3, 2: 2})
+        self.assertEqual(ranking.listed(3), 1)
+
+    def test_rankings_are_per_server(self):
+        game_rankings.clear()
+        server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        other_server = Server.objects.create(server_id='138036477643718656', name='Other Server')
+        popular = Game.objects.create(name='Overwatch')
+        elsewhere = Game.objects.create(name='Rocket League')
+        users = [DiscordUser.objects.create(user_id=str(i), name='User {}'.format(i)) for i in range(4)]
+        for user in users[:3]:
+            ServerUser.objects.create(user=user, server=server)
+            GameUser.objects.create(user=user, game=popular)
+        self.assertEqual(game_rankings.page(server), [(popular.pk, 3)])
+
+        # Updates after loading are applied by the receivers
+        ServerUser.objects.create(user=users[3], server=server)
+        for user in users[1:]:
+            ServerUser.objects.create(user=user, server=other_server)
+            GameUser.objects.create(user=user, game=elsewhere)
+        self.assertCountEqual(game_rankings.page(server), [(elsewhere.pk, 3), (popular.pk, 3)])
+        self.assertEqual(game_rankings.page(other_server), [(elsewhere.pk, 3)])
+
+        ServerUser.objects.filter(user=users[0], server=server).delete()
+        self.assertEqual(game_rankings.page(server), [(elsewhere.pk, 3)])
+        self.assertEqual(game_rankings.players(popular.pk, server), 2)
+        self.assertCountEqual(game_rankings.rank([popular.pk, elsewhere.pk]), [(elsewhere.pk, 3), (popular.pk, 3)])
+
+
+class GameNameIndexTestCase(TestCase):
+    def setUp(self):
+        game_index.clear()
+        self.overwatch = Game.objects.create(name='Overwatch')
+        self.overwatch_ptr = Game.objects.create(name='Overwatch PTR')
+        self.csgo = Game.objects.create(name='Counter-Strike: Global Offensive')
+
+    def test_exact_match_only(self):
+        self.assertEqual(game_index.search('OVERWATCH'), [self.overwatch.pk])
+
+    def test_contains(self):
+        self.assertEqual(game_index.search('over'), [self.overwatch.pk, self.overwatch_ptr.pk])
+        self.assertEqual(game_index.search('counter strike'), [self.csgo.pk])
+        self.assertEqual(game_index.search('strike'), [self.csgo.pk])
+
+    def test_typos(self):
+        self.assertEqual(game_index.search('overwach')[0], self.overwatch.pk)
+        self.assertEqual(game_index.search('zzzz'), [])
+
+    def test_follows_saves_and_deletes(self):
+        game_index.search('over')
+        self.overwatch_ptr.name = 'Rocket League'
+        self.overwatch_ptr.save()
+        self.assertEqual(game_index.search('over'), [self.overwatch.pk])
+        self.assertEqual(game_index.search('rocket'), [self.overwatch_ptr.pk])
+        self.csgo.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(game_index.search('strike'), [])
+
+
+class PageTestCase(TestCase):
+    def test_page_numbers(self):
+        start, stop = utils.page_bounds(1, 20)
+        page = utils.Page(range(start, 45)[:stop - start], 1, 20, 45)
+        self.assertEqual(page.pages, 3)
+        self.assertEqual(list(page.keys())[0], 21)
+        self.assertEqual(page[21], 20)
+        self.assertEqual(len(page), 20)
+        self.assertNotIn(1, page)
+        self.assertEqual(utils.Page([], 0, 20, 0).pages, 1)
+        self.assertEqual(list(page.items())[0], (21, 20))
+
+    def test_game_beautify_lists_page(self):
+        games = [Game(name='Overwatch'), Game(name='Rocket League')]
+        for searching, game in enumerate(games):
+            game.searching = searching
+        message = Gaming(None).game_beautify(utils.Page(games, 0, 20, 2))
+        self.assertIn('1: `Overwatch` 0 people searching', message)
+        self.assertIn('2: `Rocket League` 1 people searching', message)
+
+    def test_render_lines_stops_at_limit(self):
+        formatted = []
+        def lines():
+            for i in range(1000):
+                formatted.append(i)
+                yield 'x' * 99
+        message = utils.render_lines(lines(), length=1000)
+        self.assertEqual(len(message), 1000)
+        self.assertEqual(len(formatted), 11)
+        self.assertEqual(len(utils.render_lines(['x' * 5000], length=1000, reserve=100)), 900)
+
+
+class KeysetPageTestCase(TestCase):
+    def setUp(self):
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        self.channel = Channel.objects.create(server=self.server, channel_id='1', name='general')
+        self.user = DiscordUser.objects.create(user_id='251960188217720832', name='Squid Testing Bot')
+        now = timezone.now()
+        # Two messages share each timestamp so the primary key has to break ties
+        self.messages = [Message.objects.create(server=self.server, channel=self.channel, user=self.user, timestamp=now - timedelta(seconds=i // 2), content=str(i), message_id=str(i)) for i in range(5)]
+        self.newest_first = sorted(self.messages, key=lambda message: (message.timestamp, message.pk), reverse=True)
+
+    def test_forward_and_back(self):
+        queryset = Message.objects.filter(server=self.server)
+        first = utils.keyset_page(queryset, 2)
+        self.assertEqual(first.items, self.newest_first[:2])
+        self.assertIsNone(first.newer)
+        second = utils.keyset_page(queryset, 2, after=first.older)
+        self.assertEqual(second.items, self.newest_first[2:4])
+        last = utils.keyset_page(queryset, 2, after=second.older)
+        self.assertEqual(last.items, self.newest_first[4:])
+        self.assertIsNone(last.older)
+        self.assertEqual(utils.keyset_page(queryset, 2, before=second.newer).items, first.items)
+        self.assertIsNone(utils.keyset_page(queryset, 2, before=second.newer).newer)
+
+    def test_invalid_cursor_is_first_page(self):
+        self.assertIsNone(utils.decode_cursor('not-a-cursor'))
+        self.assertEqual(len(utils.keyset_page(Message.objects.all(), 2, after='junk')), 2)
+
+    def test_json_view(self):
+        resp = self.client.get(reverse('server_messages_json', kwargs={'server_id': self.server.server_id}))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['messages']), 5)
+        self.assertIsNone(resp.json()['older'])
+
+
+class MessageSearchTestCase(TestCase):
+    def setUp(self):
+        if search.backend() is None:
+            self.skipTest('No full-text index on this database')
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        self.channel = Channel.objects.create(server=self.server, channel_id='1', name='general')
+        self.user = DiscordUser.objects.create(user_id='251960188217720832', name='Squid Testing Bot')
+        contents = ['hello world', 'hello <b>there</b> hello', 'goodbye world']
+        self.messages = [Message.objects.create(server=self.server, channel=self.channel, user=self.user, timestamp=timezone.now(), content=content, message_id=str(i)) for i, content in enumerate(contents)]
+
+    def test_ranked_pages(self):
+        first = search.search_page(Message.objects.all(), 'hello', 1)
+        self.assertEqual(len(first), 1)
+        second = search.search_page(Message.objects.all(), 'hello', 1, after=first.older)
+        self.assertEqual(set(first.items + second.items), set(self.messages[:2]))
+        self.assertIsNone(second.older)
+        self.assertEqual(search.search_page(Message.objects.all(), 'hello', 1, before=second.newer).items, first.items)
+
+    def test_highlight_is_escaped(self):
+        page = search.search_page(Message.objects.filter(pk=self.messages[1].pk), 'there', 10)
+        self.assertEqual(search.render_highlight(page.items[0].search_highlight), 'hello &lt;b&gt;<mark>there</mark>&lt;/b&gt; hello')
+
+    def test_index_follows_edits(self):
+        message = self.messages[2]
+        message.content = 'hello again'
+        message.save()
+        self.assertIn(message, search.search_page(Message.objects.all(), 'again', 10).items)
+        self.assertEqual(len(search.search_page(Message.objects.all(), 'goodbye', 10)), 0)
+
+
+class MembershipIndexTestCase(TestCase):
+    def setUp(self):
+        membership.clear()
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        self.users = [DiscordUser.objects.create(user_id=str(i), name='User {}'.format(i)) for i in range(5)]
+        for user in self.users[:3]:
+            ServerUser.objects.create(user=user, server=self.server)
+
+    def test_intersect(self):
+        user_pks = [user.pk for user in reversed(self.users)]
+        self.assertEqual(membership.intersect(self.server, user_pks), sorted(user.pk for user in self.users[:3]))
+        self.assertEqual(membership.count(self.server), 3)
+
+    def test_follows_joins_and_removes(self):
+        membership.count(self.server)
+        ServerUser.objects.create(user=self.users[4], server=self.server)
+        ServerUser.objects.filter(user=self.users[0]).delete()
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.is_member(self.server, self.users[4].pk))
+            self.assertFalse(membership.is_member(self.server, self.users[0].pk))
+            self.assertEqual(membership.count(self.server), 3)
+
+
+class MatchmakerTestCase(TestCase):
+    def setUp(self):
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        self.game = Game.objects.create(name='Overwatch')
+        self.users = [DiscordUser.objects.create(user_id=str(i), name='User {}'.format(i)) for i in range(7)]
+        self.matchmaker = Matchmaker(party_size=3, min_party_size=3)
+
+    def search(self, user, server=None):
+        return GameSearch.objects.create(user=user, game=self.game, server=server or self.server)
+
+    def test_group_formed_when_enough_players(self):
+        searches = [self.search(user) for user in self.users[:3]]
+        self.assertEqual(self.matchmaker.enqueue(searches[0]), [])
+        self.assertEqual(self.matchmaker.enqueue(searches[1]), [])
+        self.assertEqual(self.matchmaker.enqueue(searches[2]), searches)
+        self.assertEqual(len(self.matchmaker), 0)
+
+    def test_queues_are_per_server(self):
+        other_server = Server.objects.create(server_id='138036477643718656', name='Other Server')
+        self.matchmaker.enqueue(self.search(self.users[0]))
+        self.matchmaker.enqueue(self.search(self.users[1]))
+        self.assertEqual(self.matchmaker.enqueue(self.search(self.users[2], server=other_server)), [])
+        self.assertEqual(self.matchmaker.waiting(self.server.pk, self.game.pk), 2)
+
+    def test_duplicate_and_removed_searches(self):
+        first = self.search(self.users[0])
+        self.matchmaker.enqueue(first)
+        self.assertEqual(self.matchmaker.enqueue(self.search(self.users[0])), [])
+        self.assertEqual(len(self.matchmaker), 1)
+        self.assertEqual(self.matchmaker.remove_user(self.users[0].pk, self.game.pk), [first])
+        self.assertIsNone(self.matchmaker.remove(first.pk))
+
+    def test_requeued_group_keeps_its_place(self):
+        searches = [self.search(user) for user in self.users[:4]]
+        for search in searches[:3]:
+            self.matchmaker.enqueue(search)
+        self.assertEqual(self.matchmaker.enqueue(searches[3]), [])
+        self.matchmaker.requeue(searches[:3])
+        self.assertEqual(self.matchmaker.waiting(self.server.pk, self.game.pk), 4)
+        self.assertEqual(self.matchmaker.enqueue(self.search(self.users[4])), searches[:3])
+
+
+class ChannelOccupancyTestCase(TestCase):
+    def setUp(self):
+        channel_occupancy.clear()
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        self.game = Game.objects.create(name='Overwatch')
+        self.users = [DiscordUser.objects.create(user_id=str(i), name='User {}'.format(i)) for i in range(channel_occupancy.capacity)]
+        self.expire_date = timezone.now() + timedelta(minutes=15)
+
+    def create_channel(self, channel_id):
+        return Channel.objects.create(server=self.server, game=self.game, channel_id=channel_id, name='overwatch', game_channel=True, expire_date=self.expire_date)
+
+    def test_fullest_open_channel_is_found(self):
+        self.assertIsNone(channel_occupancy.find_open(self.server.pk, self.game.pk))
+        emptier = self.create_channel('1')
+        fuller = self.create_channel('2')
+        ChannelUser.objects.create(channel=emptier, user=self.users[0])
+        for user in self.users[:2]:
+            ChannelUser.objects.create(channel=fuller, user=user)
+        self.assertEqual(channel_occupancy.occupancy(fuller.pk), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(channel_occupancy.find_open(self.server.pk, self.game.pk), fuller.pk)
+
+    def test_full_and_deleted_channels_are_skipped(self):
+        full = self.create_channel('1')
+        for user in self.users:
+            ChannelUser.objects.create(channel=full, user=user)
+        self.assertIsNone(channel_occupancy.find_open(self.server.pk, self.game.pk))
+        ChannelUser.objects.filter(channel=full, user=self.users[0]).delete()
+        self.assertEqual(channel_occupancy.find_open(self.server.pk, self.game.pk), full.pk)
+        full.deleted = True
+        full.save()
+        self.assertIsNone(channel_occupancy.find_open(self.server.pk, self.game.pk))
+
+
+class ChannelPoolTestCase(TestCase):
+    def setUp(self):
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        self.pool = ChannelPool(bot=None, min_size=1, max_size=3, window=60)
+
+    def test_size_follows_recent_demand(self):
+        self.assertEqual(self.pool.target_size(self.server.server_id, now=0), 1)
+        for now in range(5):
+            self.pool.record_claim(self.server.server_id, now=now)
+        self.assertEqual(self.pool.target_size(self.server.server_id, now=10), 3)
+        self.assertEqual(self.pool.demand(self.server.server_id, now=62), 2)
+        self.assertEqual(self.pool.target_size(self.server.server_id, now=100), 1)
+
+    def test_take_oldest_first(self):
+        channels = [Channel.objects.create(server=self.server, channel_id=str(i), name='game-channel', game_channel=True, pooled=True) for i in range(2)]
+        for channel in channels:
+            self.pool.put(self.server.server_id, channel)
+        self.assertEqual(self.pool.size(self.server.server_id), 2)
+        self.assertEqual(self.pool.take(self.server.server_id), channels[0])
+        self.assertEqual(self.pool.take(self.server.server_id), channels[1])
+        self.assertIsNone(self.pool.take(self.server.server_id))
+
+    def test_pooled_channels_are_not_open(self):
+        channel_occupancy.clear()
+        game = Game.objects.create(name='Overwatch')
+        channel = Channel.objects.create(server=self.server, channel_id='1', name='game-channel', game=game, game_channel=True, pooled=True)
+        self.assertIsNone(channel_occupancy.get_channel_pk(channel.channel_id))
+        channel.pooled = False
+        channel.expire_date = timezone.now() + timedelta(minutes=15)
+        channel.save()
+        self.assertEqual(channel_occupancy.find_open(self.server.pk, game.pk), channel.pk)
+
+
+class PageCacheTestCase(TestCase):
+    def setUp(self):
+        self.page_cache = PageCache(alias='default')
+        self.page_cache.cache.clear()
+
+    def test_hit_until_bumped(self):
+        builds = []
+        build = lambda: builds.append(1) or len(builds)
+        key = self.page_cache.key('server', [('server', '1')])
+        self.assertEqual(self.page_cache.get(key, build), 1)
+        self.assertEqual(self.page_cache.get(self.page_cache.key('server', [('server', '1')]), build), 1)
+        self.page_cache.bump(('server', '2'))
+        self.assertEqual(self.page_cache.get(self.page_cache.key('server', [('server', '1')]), build), 1)
+        self.page_cache.bump(('server', '1'))
+        self.assertEqual(self.page_cache.get(self.page_cache.key('server', [('server', '1')]), build), 2)
+        stats = self.page_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+
+    def test_scopes_with_the_same_version_do_not_share_keys(self):
+        self.page_cache.cache.set(self.page_cache.version_key(('server', '1')), 5, None)
+        self.page_cache.cache.set(self.page_cache.version_key(('server', '2')), 5, None)
+        self.assertNotEqual(self.page_cache.key('server', [('server', '1')]), self.page_cache.key('server', [('server', '2')]))
+
+    def test_lost_version_does_not_reuse_keys(self):
+        self.page_cache.cache.set(self.page_cache.version_key(('server', '1')), 1, None)
+        first = self.page_cache.key('server', [('server', '1')])
+        self.page_cache.cache.delete(self.page_cache.version_key(('server', '1')))
+        self.assertNotEqual(self.page_cache.key('server', [('server', '1')]), first)
+
+
+class MessageExportTestCase(TestCase):
+    def setUp(self):
+        self.server = Server.objects.create(server_id='225471771355250688', name='Squid Bot Testing Server')
+        self.channels = [Channel.objects.create(server=self.server, channel_id=str(i), name='channel-{}'.format(i)) for i in range(2)]
+        self.user = DiscordUser.objects.create(user_id='251960188217720832', name='Squid Testing Bot')
+        self.start = timezone.now() - timedelta(days=1)
+        # Pairs of messages share a timestamp so chunks have to break ties on the primary key
+        self.messages = [Message.objects.create(server=self.server, channel=self.channels[i % 2], user=self.user, timestamp=self.start + timedelta(hours=i // 2), content='line {}\nwith, "quotes"'.format(i), message_id=str(i)) for i in range(7)]
+        attachment = Attachment.objects.create(server=self.server, channel=self.channels[0], user=self.user, attachment_id='1', url='https://example.com/1.png')
+        self.messages[2].attachments.add(attachment)
+
+    def test_chunks_cover_every_message_in_order(self):
+        records = list(export.iter_messages(self.server, chunk_size=2))
+        self.assertEqual([record['message_id'] for record in records], [message.message_id for message in self.messages])
+        self.assertEqual(records[2]['attachments'], ['https://example.com/1.png'])
+
+    def test_filters(self):
+        records = export.iter_messages(self.server, start=self.start + timedelta(hours=1), end=self.start + timedelta(hours=3), channel_ids=['0'], chunk_size=1)
+        self.assertEqual([record['message_id'] for record in records], ['2', '4'])
+
+    def test_csv_round_trip(self):
+        data = b''.join(export.export_messages(self.server, 'csv')).decode('utf-8')
+        rows = list(csv.DictReader(io.StringIO(data)))
+        self.assertEqual([row['content'] for row in rows], [message.content for message in self.messages])
+
+    def test_gzipped_jsonl(self):
+        data = gzip.decompress(b''.join(export.export_messages(self.server, 'jsonl', compress=True))).decode('utf-8')
+        self.assertEqual([json.loads(line)['message_id'] for line in data.splitlines()], [message.message_id for message in self.messages])
+
+    def test_view_is_for_admins(self):
+        url = reverse('server_messages_export', kwargs={'server_id': self.server.server_id})
+        self.assertEqual(self.client.get(url).status_code, 302)
+        User.objects.create_user(username='admin', password='top_secret', is_staff=True)
+        self.client.login(username='admin', password='top_secret')
+        resp = self.client.get(url, {'format': 'jsonl', 'channel': '1'})
+        self.assertEqual(resp.status_code, 200)
+        lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['message_id'] for line in lines], ['1', '3', '5'])
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.csv')
+            call_command('export_messages', self.server.server_id, '--output', path, '--start', (self.start + timedelta(hours=3)).isoformat())
+            with open(path, newline='', encoding='utf-8') as output:
+                rows = list(csv.DictReader(output))
+        self.assertEqual([row['message_id'] for row in rows], ['6'])
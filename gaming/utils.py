@@ -1,10 +1,23 @@
+import datetime
 import json
+import math
+import os
 import sys
+import time
+from collections.abc import Mapping
 from django.core import serializers
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
 from inspect import getframeinfo, getouterframes, currentframe
 
 DISCORD_MSG_CHAR_LIMIT = 2000
 
+# Digits, then upper case, then lower case so encoded values sort the same as the numbers they represent
+ID_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+ID_TIME_LENGTH = 8
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
 
 def paginate(content, *, length=DISCORD_MSG_CHAR_LIMIT, reserve=0):
     """
@@ -33,6 +46,213 @@ def paginate(content, *, length=DISCORD_MSG_CHAR_LIMIT, reserve=0):
     return chunks
 
 
+class Page(Mapping):
+    """
+    One page of a numbered list, mapping each item's number (starting at 1) to the item
+
+    items : Required[list]
+        The items on this page only
+    number : Required[int]
+        Which page this is, starting at 0
+    per_page : Required[int]
+        The most items on a page
+    total : Required[int]
+        The number of items across every page
+
+    The items are kept in :attr:`page_items`, since ``items`` is already :meth:`Mapping.items`
+    """
+    def __init__(self, items, number, per_page, total):
+        self.page_items = list(items)
+        self.number = number
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def start(self):
+        return self.number * self.per_page
+
+    @property
+    def pages(self):
+        return max(int(math.ceil(self.total / self.per_page)), 1)
+
+    def __getitem__(self, key):
+        index = key - self.start - 1
+        if not 0 <= index < len(self.page_items):
+            raise KeyError(key)
+        return self.page_items[index]
+
+    def __iter__(self):
+        return iter(range(self.start + 1, self.start + len(self.page_items) + 1))
+
+    def __len__(self):
+        return len(self.page_items)
+
+
+def page_bounds(page, per_page):
+    """
+    Returns the ``(start, stop)`` slice indexes of a page, starting at page 0
+    """
+    page = max(page, 0)
+    return (page * per_page, (page + 1) * per_page)
+
+
+def render_lines(lines, *, length=DISCORD_MSG_CHAR_LIMIT, reserve=0):
+    """
+    Join lines from an iterable until the next one would go over :attr:`length`, so the rest are never formatted
+    """
+    message = ''
+    for line in lines:
+        if len(message) + len(line) + 1 > length - reserve:
+            if not message:
+                # Cut a line that is too long on its own rather than sending nothing
+                message = line[:max(length - reserve - 1, 0)] + '\n'
+            break
+        message += line + '\n'
+    return message
+
+
+def encode_cursor(when, pk):
+    """
+    Returns a URL safe cursor for the row at :attr:`when` with primary key :attr:`pk`
+    """
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when, datetime.timezone.utc)
+    microseconds = (when - EPOCH) // datetime.timedelta(microseconds=1)
+    return '{}_{}'.format(microseconds, pk)
+
+
+def decode_cursor(cursor):
+    """
+    Returns the ``(when, pk)`` a cursor from :func:`encode_cursor` points at, or None if it isn't valid
+    """
+    try:
+        microseconds, pk = (int(part) for part in cursor.split('_'))
+    except (AttributeError, ValueError):
+        return None
+    try:
+        return (EPOCH + datetime.timedelta(microseconds=microseconds), pk)
+    except OverflowError:
+        return None
+
+
+class KeysetPage:
+    """
+    One page of rows ordered newest first, with cursors to the pages either side of it
+
+    items : Required[list]
+        The rows on this page, newest first
+    older : Optional[str]
+        The cursor for the next page of older rows, or None if there aren't any
+    newer : Optional[str]
+        The cursor for the page of newer rows, or None if this is the first page
+    """
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_page(queryset, per_page, *, after=None, before=None, field='timestamp'):
+    """
+    Returns a :class:`KeysetPage` of :attr:`queryset` ordered by :attr:`field` then primary key, newest first
+
+    after : Optional[str]
+        A cursor to return the rows older than, for going forward
+    before : Optional[str]
+        A cursor to return the rows newer than, for going back
+
+    Rows are found by comparing against the cursor instead of with an offset, so every page costs the same
+    as the first one as long as there is an index on (:attr:`field`, primary key).
+    """
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+    if before is not None:
+        when, pk = before
+        queryset = queryset.filter(Q(**{field + '__gt': when}) | Q(**{field: when, 'pk__gt': pk}))
+        rows = list(queryset.order_by(field, 'pk')[:per_page + 1])
+        has_newer = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_older = True
+    else:
+        if after is not None:
+            when, pk = after
+            queryset = queryset.filter(Q(**{field + '__lt': when}) | Q(**{field: when, 'pk__lt': pk}))
+        rows = list(queryset.order_by('-' + field, '-pk')[:per_page + 1])
+        has_older = len(rows) > per_page
+        items = rows[:per_page]
+        has_newer = after is not None
+    if not items:
+        return KeysetPage(items)
+    older = encode_cursor(getattr(items[-1], field), items[-1].pk) if has_older else None
+    newer = encode_cursor(getattr(items[0], field), items[0].pk) if has_newer else None
+    return KeysetPage(items, older=older, newer=newer)
+
+
+def encode_id(number, length):
+    """
+    Encodes :attr:`number` as exactly :attr:`length` characters of :data:`ID_ALPHABET`
+    """
+    base = len(ID_ALPHABET)
+    characters = []
+    for i in range(length):
+        number, remainder = divmod(number, base)
+        characters.append(ID_ALPHABET[remainder])
+    return ''.join(reversed(characters))
+
+
+def generate_id(length=50):
+    """
+    Returns a random, URL safe ID of :attr:`length` characters that sorts by the time it was created
+
+    The first :data:`ID_TIME_LENGTH` characters are the current time in milliseconds, the rest are random.
+    No query is made to check for collisions, that is left to a unique index on the column.
+    """
+    random_length = length - ID_TIME_LENGTH
+    if random_length < 8:
+        raise ValueError("length must be at least {}".format(ID_TIME_LENGTH + 8))
+    milliseconds = int(time.time() * 1000)
+    # 6 bits of randomness are used per character, a few extra bytes keep the modulo bias negligible
+    random_number = int.from_bytes(os.urandom(random_length + 8), 'big')
+    return encode_id(milliseconds, ID_TIME_LENGTH) + encode_id(random_number, random_length)
+
+
+def chunks(items, size):
+    """
+    Yields lists of at most :attr:`size` items from :attr:`items`
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_update(model, objects, fields, batch_size=100):
+    """
+    Saves :attr:`fields` for every instance in :attr:`objects` using one UPDATE query per batch
+
+    Signals are not sent and ``save()`` is not called for any of the instances.
+    """
+    fields = [model._meta.get_field(name) for name in fields]
+    updated = 0
+    for batch in chunks(objects, batch_size):
+        updates = {}
+        for field in fields:
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in batch]
+            updates[field.name] = Case(*whens, output_field=field)
+        updated += model._default_manager.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+    return updated
+
+
 def logify_object(obj):
     """
     Returns a JSON string containing usually a Queryset of items based on :attr:`obj`
@@ -2,13 +2,30 @@ import re
 from django.contrib import messages
 from django.contrib.auth import logout
 from django.db.models import Q
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse
 
+from gaming.export import CONTENT_TYPES, export_messages, parse_time
 from gaming.forms import UpdateAccountForm
 from gaming.models import Server, DiscordUser, ServerUser, Message, Attachment
-from gaming.utils import logify_exception_info
+from gaming.page_cache import page_cache
+from gaming.search import search_page, render_highlight
+from gaming.utils import logify_exception_info, keyset_page
+
+
+# The number of messages shown at a time on a server's message page
+MESSAGES_PER_PAGE = 50
+
+
+def url_format(view_name, placeholder='0'):
+    """
+    Returns a function that builds the URL of :attr:`view_name` for an ID
+
+    The URL is reversed once and the ID put in its place, instead of calling ``reverse()`` for every row of a page
+    """
+    prefix, suffix = reverse(view_name, args=[placeholder]).rsplit(placeholder, 1)
+    return lambda object_id: '{}{}{}'.format(prefix, object_id, suffix)
 
 
 def normalize_query(query_string,
@@ -46,13 +63,88 @@ def get_query(query_string, search_fields):
     return query
 
 
+def server_values(server, server_url):
+    """
+    Returns the fields of a Server shown on pages, with its URL and icon filled in
+    """
+    return {
+        'server_id': server.server_id,
+        'name': server.name,
+        'url': server_url(server.server_id),
+        'icon_url': server.get_icon(),
+    }
+
+
+def get_servers(search):
+    """
+    Returns the Servers on the server list
+    """
+    servers = Server.objects.only('server_id', 'name', 'icon')
+    if search:
+        servers = servers.filter(get_query(search, ['name', 'server_id', 'owner__name']))
+    server_url = url_format('server')
+    return [server_values(server, server_url) for server in servers]
+
+
+def get_server_users(server_id, search):
+    """
+    Returns the Server and the members shown on its page, or ``(None, [])`` if it does not exist
+    """
+    try:
+        server = Server.objects.get(server_id=server_id)
+    except Server.DoesNotExist:
+        return None, []
+    serverusers = ServerUser.objects.filter(server=server, user__bot=False).select_related('user').only('user', 'user__user_id', 'user__name', 'user__avatar_url')
+    if search:
+        serverusers = serverusers.filter(get_query(search, ['user__name', 'user__user_id']))
+    user_url = url_format('user')
+    members = [{
+        'user_id': su.user.user_id,
+        'name': su.user.name,
+        'url': user_url(su.user.user_id),
+        'avatar_url': su.user.avatar_url,
+        'owner': su.user_id == server.owner_id,
+    } for su in serverusers]
+    return server_values(server, url_format('server')), members
+
+
+def get_user_server_ids(user_id):
+    """
+    Returns the IDs of the servers a user is on
+    """
+    return list(ServerUser.objects.filter(user__user_id=user_id).values_list('server__server_id', flat=True))
+
+
+def get_user_servers(user_id):
+    """
+    Returns the DiscordUser and the servers shown on their page, or ``(None, [])`` if they do not exist
+    """
+    try:
+        discorduser = DiscordUser.objects.get(user_id=user_id)
+    except DiscordUser.DoesNotExist:
+        return None, []
+    serverusers = ServerUser.objects.filter(user=discorduser).select_related('server').only('server', 'server__server_id', 'server__name', 'server__icon', 'server__owner')
+    server_url = url_format('server')
+    servers = []
+    for su in serverusers:
+        server = server_values(su.server, server_url)
+        server['owner'] = su.server.owner_id == discorduser.pk
+        servers.append(server)
+    user = {
+        'user_id': discorduser.user_id,
+        'name': discorduser.name,
+        'avatar_url': discorduser.avatar_url,
+    }
+    return user, servers
+
+
 def index_view(request):
     template = 'gaming/serverlist.html'
-    servers = Server.objects.all()
     search = request.GET.get('search', None)
     if search:
-        servers = servers.filter(get_query(search, ['name', 'server_id', 'owner__name']))
         messages.add_message(request, messages.INFO, 'Servers filtered based on query "{}"'.format(search))
+    cache_key = page_cache.key('index', [('servers',)], [search])
+    servers = page_cache.get(cache_key, lambda: get_servers(search))
     context = {
         'title': 'Server List',
         'servers': servers,
@@ -64,21 +156,21 @@ def index_view(request):
 def server_view(request, server_id):
     template = 'gaming/server.html'
     search = request.GET.get('search', None)
-    try:
-        server = Server.objects.get(server_id=server_id)
-    except:
+    cache_key = page_cache.key('server', [('server', server_id)], [search])
+    server, members = page_cache.get(cache_key, lambda: get_server_users(server_id, search))
+    if server is None:
         messages.add_message(request, messages.ERROR, "Requested server does not exist!")
         return redirect('index')
 
-    serverusers = ServerUser.objects.filter(server=server, user__bot=False)
     if search:
-        serverusers = serverusers.filter(get_query(search, ['user__name', 'user__user_id']))
         messages.add_message(request, messages.INFO, 'Users filtered based on query "{}"'.format(search))
 
     context = {
         'server': server,
-        'serverusers': serverusers,
+        'members': members,
         'search': search,
+        'cache_key': cache_key,
+        'cache_timeout': page_cache.timeout,
     }
     return render(request, template, context)
 
@@ -119,37 +211,152 @@ def update_account_view(request):
 def user_view(request, user_id):
     template = 'gaming/user.html'
 
-    try:
-        discorduser = DiscordUser.objects.get(user_id=user_id)
-    except:
+    # The page shows the user's servers, so which ones they are on is looked up first to version the page by them
+    server_ids = page_cache.get(page_cache.key('user_servers', [('user', user_id)]), lambda: get_user_server_ids(user_id))
+    cache_key = page_cache.key('user', [('user', user_id)] + [('server_info', server_id) for server_id in server_ids])
+    discorduser, servers = page_cache.get(cache_key, lambda: get_user_servers(user_id))
+    if discorduser is None:
         messages.add_message(request, messages.ERROR, "Requested user does not exist!")
         return redirect('index')
 
     context = {
         'discorduser': discorduser,
+        'servers': servers,
+        'cache_key': cache_key,
+        'cache_timeout': page_cache.timeout,
     }
     return render(request, template, context)
 
 
+def get_message_page(request, server):
+    """
+    Returns the :class:`gaming.utils.KeysetPage` of a server's messages asked for by the ``after``, ``before`` and ``search`` parameters,
+    with each message as a dict
+
+    Searches use the full-text index and are ordered by how well they match, see :func:`gaming.search.search_page`.
+    Without an index they fall back to matching with LIKE, newest first.
+    """
+    server_messages = Message.objects.filter(server=server).select_related('user', 'channel').prefetch_related('attachments').only(
+        'timestamp', 'content', 'message_id', 'user', 'user__user_id', 'user__name', 'channel', 'channel__channel_id', 'channel__name')
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    search = request.GET.get('search', None)
+    page = None
+    if search:
+        page = search_page(server_messages, search, MESSAGES_PER_PAGE, after=after, before=before)
+        if page is None:
+            server_messages = server_messages.filter(get_query(search, ['user__name', 'user__user_id', 'content']))
+    if page is None:
+        page = keyset_page(server_messages, MESSAGES_PER_PAGE, after=after, before=before)
+    user_url = url_format('user')
+    page.items = [{
+        'message_id': message.message_id,
+        'timestamp': message.timestamp,
+        'content': message.content,
+        'search_highlight': getattr(message, 'search_highlight', None),
+        'channel': {'channel_id': message.channel.channel_id, 'name': message.channel.name},
+        'user': {
+            'user_id': message.user.user_id,
+            'name': message.user.name,
+            'url': user_url(message.user.user_id),
+            'owner': message.user_id == server.owner_id,
+        },
+        'attachments': [attachment.url for attachment in message.attachments.all()],
+    } for message in page]
+    return page
+
+
+def get_server_messages(request, server_id):
+    """
+    Returns the Server and the page of its messages asked for, or ``(None, None)`` if it does not exist
+    """
+    def build():
+        try:
+            server = Server.objects.get(server_id=server_id)
+        except Server.DoesNotExist:
+            return None, None
+        return server_values(server, url_format('server')), get_message_page(request, server)
+
+    parts = [request.GET.get('after'), request.GET.get('before'), request.GET.get('search')]
+    cache_key = page_cache.key('server_messages', [('server', server_id), ('messages', server_id)], parts)
+    return page_cache.get(cache_key, build)
+
+
 def server_message_view(request, server_id):
     template = 'gaming/server_messages.html'
     search = request.GET.get('search', None)
-    try:
-        server = Server.objects.get(server_id=server_id)
-    except:
+    server, page = get_server_messages(request, server_id)
+    if server is None:
         messages.add_message(request, messages.ERROR, "Requested server does not exist!")
         return redirect('index')
 
-    server_messages = Message.objects.filter(server=server)
     if search:
-        server_messages = server_messages.filter(get_query(search, ['user__name', 'user__user_id', 'content']))
         messages.add_message(request, messages.INFO, 'Messages filtered based on query "{}"'.format(search))
 
-    server_messages.order_by('-timestamp')
-
     context = {
         'server': server,
-        'server_messages': server_messages,
+        'server_messages': page,
         'search': search,
     }
     return render(request, template, context)
+
+
+def server_message_json_view(request, server_id):
+    """
+    The same page of messages as :func:`server_message_view` as JSON, for loading more as the page is scrolled
+    """
+    server, page = get_server_messages(request, server_id)
+    if server is None:
+        raise Http404("Requested server does not exist!")
+
+    data = {
+        'messages': [{
+            'message_id': message['message_id'],
+            'timestamp': message['timestamp'].isoformat(),
+            'content': message['content'],
+            'channel': message['channel'],
+            'user': {'user_id': message['user']['user_id'], 'name': message['user']['name'], 'url': message['user']['url']},
+            'attachments': message['attachments'],
+            'highlight': render_highlight(message['search_highlight']) if message['search_highlight'] is not None else None,
+        } for message in page],
+        'older': page.older,
+        'newer': page.newer,
+    }
+    return JsonResponse(data)
+
+
+def server_message_export_view(request, server_id):
+    """
+    Streams every logged message on a server as CSV or JSON Lines, for admins
+
+    Takes ``format`` (``csv`` or ``jsonl``), ``start`` and ``end`` dates, any number of ``channel`` IDs,
+    and ``gzip=1`` to compress the download, see :func:`gaming.export.export_messages`
+    """
+    user = request.user
+    if not user.is_authenticated() or not user.is_staff:
+        messages.add_message(request, messages.WARNING, 'Please login as an admin before accessing that page')
+        return redirect('{}?next={}'.format(reverse('account_login'), request.get_full_path()))
+
+    try:
+        server = Server.objects.get(server_id=server_id)
+    except Server.DoesNotExist:
+        raise Http404("Requested server does not exist!")
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in CONTENT_TYPES:
+        return HttpResponseBadRequest('Unknown format {}'.format(export_format))
+    try:
+        start = parse_time(request.GET['start']) if request.GET.get('start') else None
+        end = parse_time(request.GET['end']) if request.GET.get('end') else None
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    compress = request.GET.get('gzip') in ('1', 'true')
+
+    filename = '{}-messages.{}'.format(server.server_id, export_format)
+    content_type = CONTENT_TYPES[export_format]
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(export_messages(server, export_format, start=start, end=end, channel_ids=request.GET.getlist('channel'), compress=compress), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -197,6 +198,50 @@ MESSAGE_TAGS = {
     message_constants.ERROR: 'danger',
 }
 
+# Number of threads the bot uses to run database queries
+DATABASE_POOL_SIZE = int(os.getenv('SQUID_BOT_DATABASE_POOL_SIZE', 4))
+
+# Maximum number of Servers, Channels, DiscordUsers and ServerUsers each kept in memory by the bot
+IDENTITY_CACHE_SIZE = int(os.getenv('SQUID_BOT_IDENTITY_CACHE_SIZE', 10000))
+
+# Logged messages are written in batches of MESSAGE_LOG_BATCH_SIZE or every MESSAGE_LOG_FLUSH_INTERVAL milliseconds
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv('SQUID_BOT_MESSAGE_LOG_BATCH_SIZE', 100))
+MESSAGE_LOG_FLUSH_INTERVAL = int(os.getenv('SQUID_BOT_MESSAGE_LOG_FLUSH_INTERVAL', 500))
+MESSAGE_LOG_QUEUE_SIZE = int(os.getenv('SQUID_BOT_MESSAGE_LOG_QUEUE_SIZE', 10000))
+
+# Groups of up to MATCHMAKING_PARTY_SIZE are formed once MATCHMAKING_MIN_PARTY_SIZE players are searching for a game on a server
+MATCHMAKING_PARTY_SIZE = int(os.getenv('SQUID_BOT_MATCHMAKING_PARTY_SIZE', 5))
+MATCHMAKING_MIN_PARTY_SIZE = int(os.getenv('SQUID_BOT_MATCHMAKING_MIN_PARTY_SIZE', 2))
+# Milliseconds between writes of finished searches
+MATCHMAKING_FLUSH_INTERVAL = int(os.getenv('SQUID_BOT_MATCHMAKING_FLUSH_INTERVAL', 1000))
+
+# Each server keeps as many hidden game channels ready as groups it started in the last GAME_CHANNEL_POOL_WINDOW seconds,
+# between GAME_CHANNEL_POOL_MIN_SIZE and GAME_CHANNEL_POOL_MAX_SIZE
+GAME_CHANNEL_POOL_MIN_SIZE = int(os.getenv('SQUID_BOT_GAME_CHANNEL_POOL_MIN_SIZE', 0))
+GAME_CHANNEL_POOL_MAX_SIZE = int(os.getenv('SQUID_BOT_GAME_CHANNEL_POOL_MAX_SIZE', 5))
+GAME_CHANNEL_POOL_WINDOW = int(os.getenv('SQUID_BOT_GAME_CHANNEL_POOL_WINDOW', 900))
+
+# The server list, server, user and message pages are cached for PAGE_CACHE_TIMEOUT seconds, or until what is on them changes.
+# The bot and the webapp both need to reach the backend for the bot's changes to show up, so it defaults to files on disk
+PAGE_CACHE_BACKEND = os.getenv('SQUID_BOT_PAGE_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache')
+PAGE_CACHE_LOCATION = os.getenv('SQUID_BOT_PAGE_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'squidbot_pages'))
+PAGE_CACHE_TIMEOUT = int(os.getenv('SQUID_BOT_PAGE_CACHE_TIMEOUT', 3600))
+PAGE_CACHE_MAX_ENTRIES = int(os.getenv('SQUID_BOT_PAGE_CACHE_MAX_ENTRIES', 10000))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': {
+        'BACKEND': PAGE_CACHE_BACKEND,
+        'LOCATION': PAGE_CACHE_LOCATION,
+        'TIMEOUT': PAGE_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': PAGE_CACHE_MAX_ENTRIES,
+        },
+    },
+}
+
 ##########################
 # End my custom settings #
 ##########################
@@ -27,6 +27,8 @@ urlpatterns = [
     url(r'^server/(?P<server_id>\w+)/$', views.server_view, name='server'),
     url(r'^user/(?P<user_id>\w+)/$', views.user_view, name='user'),
     url(r'^server/(?P<server_id>\w+)/messages$', views.server_message_view, name='server_messages'),
+    url(r'^server/(?P<server_id>\w+)/messages\.json$', views.server_message_json_view, name='server_messages_json'),
+    url(r'^server/(?P<server_id>\w+)/messages/export$', views.server_message_export_view, name='server_messages_export'),
     url(r'^accounts/update/', views.update_account_view, name='account_update'),
     url(r'^accounts/', include('allauth.urls')),
     url(r'^admin/', admin.site.urls),